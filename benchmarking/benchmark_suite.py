@@ -0,0 +1,248 @@
+"""
+Headless, reproducible benchmark suite.
+
+Sweeps solver x timestep x scene (and scene size) and records steps/sec, ns per particle-step,
+peak memory and energy drift for every combination. The results are written to a JSON file
+and can be compared against a stored baseline to catch performance regressions:
+
+    python benchmark_suite.py --output results.json
+    python benchmark_suite.py --output new.json --baseline results.json
+"""
+# import from directory above
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import argparse, json, platform, time, tracemalloc
+import numpy as np
+
+from objects import Particle, ParticleSystem, SpringNetwork
+from constraints import ConstraintManager
+from forces import Gravity
+from simulation import Scene, Simulation
+from ode_solvers.rk4 import RungeKutta4
+from ode_solvers.euler import SemiImplicitEuler, ImplicitEuler
+from ode_solvers.dormand_prince import DormandPrince
+from ode_solvers.symplectic import VelocityVerlet, PositionVerlet, Leapfrog
+
+DIMENSIONS = 2
+WHITE = (255, 255, 255)
+
+SOLVERS = {
+    "rk4": RungeKutta4,
+    "semi_implicit_euler": SemiImplicitEuler,
+    "implicit_euler": ImplicitEuler,
+    "dormand_prince": DormandPrince,
+    "velocity_verlet": VelocityVerlet,
+    "position_verlet": PositionVerlet,
+    "leapfrog": Leapfrog,
+}
+
+TIMESTEPS = [1 / 600, 1 / 160, 1 / 60]
+
+# a run is a regression if it is this much slower than the baseline
+REGRESSION_THRESHOLD = 0.10
+
+
+def _particle(system: ParticleSystem, position: list, mass: float, timestep: float) -> Particle:
+    return Particle(position, mass, DIMENSIONS, 1, timestep, 0.1, WHITE, system=system)
+
+
+def _kinetic_energy(system: ParticleSystem) -> float:
+    return 0.5 * np.sum(system.masses * np.sum(system.velocities ** 2, axis=1))
+
+
+def spring_pair(size: int, timestep: float) -> Scene:
+    # two particles connected by a spring (the scene of the old benchmark scripts)
+    system = ParticleSystem(DIMENSIONS)
+    p1 = _particle(system, [0, 100], 10, timestep)
+    p2 = _particle(system, [0, 250], 10, timestep)
+    springs = SpringNetwork(system, [p1], [p2], 100, 5)
+
+    return Scene([p1, p2], springs.add_forces, springs=[springs],
+                 energy=lambda: _kinetic_energy(system) + springs.energy())
+
+
+def pendulums(size: int, timestep: float) -> Scene:
+    # size independent triple pendulums with slightly different initial velocities
+    system = ParticleSystem(DIMENSIONS)
+    particles = []
+    for i in range(size):
+        chain = [_particle(system, [1, -k], 1, timestep) for k in range(3)]
+        chain[1].velocity = [0.01 * i, 0]
+        particles += chain
+
+    gravity = Gravity(particles, 9.81, 1)
+    constraint_manager = ConstraintManager(particles, DIMENSIONS)
+    for i in range(size):
+        p1, p2, p3 = particles[3 * i:3 * i + 3]
+        constraint_manager.circular_wire_constraint(p1)
+        constraint_manager.distance_constraint(p1, p2)
+        constraint_manager.distance_constraint(p2, p3)
+
+    def add_forces():
+        gravity.add_forces()
+        constraint_manager.update()
+        constraint_manager.add_forces()
+
+    return Scene(particles, add_forces, constraints=constraint_manager,
+                 energy=lambda: _kinetic_energy(system) + gravity.potential_energy())
+
+
+def rails(size: int, timestep: float) -> Scene:
+    # particles sliding on two different rails under gravity
+    system = ParticleSystem(DIMENSIONS)
+    particles, functions = [], []
+    for i in range(size):
+        x = -2 + 4 * i / max(size - 1, 1)
+        if i % 2:
+            functions.append("sin(x)")
+            particles.append(_particle(system, [x, np.sin(x)], 1, timestep))
+        else:
+            functions.append("x**2 / 4")
+            particles.append(_particle(system, [x, x ** 2 / 4], 1, timestep))
+
+    gravity = Gravity(particles, 9.81, 1)
+    constraint_manager = ConstraintManager(particles, DIMENSIONS)
+    for particle, function in zip(particles, functions):
+        constraint_manager.rail_constraint(particle, function)
+
+    def add_forces():
+        gravity.add_forces()
+        constraint_manager.update()
+        constraint_manager.add_forces()
+
+    return Scene(particles, add_forces, constraints=constraint_manager,
+                 energy=lambda: _kinetic_energy(system) + gravity.potential_energy())
+
+
+def _energy(simulation: Simulation) -> float:
+    # integrators with staggered velocities (Leapfrog) provide a synchronized state for the energy
+    synchronized_state = getattr(simulation.solver, "synchronized_state", None)
+    if synchronized_state is None:
+        return simulation.scene.energy()
+
+    system, index = simulation.system, simulation.index
+    positions, velocities = system.positions[index].copy(), system.velocities[index].copy()
+    system.positions[index], system.velocities[index] = synchronized_state()
+    energy = simulation.scene.energy()
+    system.positions[index], system.velocities[index] = positions, velocities
+    return energy
+
+
+# scene name -> (builder, sizes)
+SCENES = {
+    "spring_pair": (spring_pair, [2]),
+    "triple_pendulum": (pendulums, [1]),
+    "pendulum_ensemble": (pendulums, [10, 100]),
+    "rails": (rails, [10, 100]),
+}
+
+
+def benchmark(scene_name: str, size: int, solver_name: str, timestep: float, steps: int) -> dict:
+    builder, _ = SCENES[scene_name]
+
+    # timing run
+    scene = builder(size, timestep)
+    simulation = Simulation(scene, timestep, solver=SOLVERS[solver_name])
+    particle_count = len(simulation.system.masses[simulation.index])
+    initial_energy = scene.energy()
+
+    energies = np.zeros(steps, dtype=np.float64)
+    start = time.perf_counter()
+    for step in range(steps):
+        simulation.step()
+        energies[step] = _energy(simulation)
+    elapsed = time.perf_counter() - start
+
+    # separate run for the memory, tracemalloc slows down the simulation
+    scene = builder(size, timestep)
+    simulation = Simulation(scene, timestep, solver=SOLVERS[solver_name])
+    tracemalloc.start()
+    for _ in range(min(steps, 100)):
+        simulation.step()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    scale = max(abs(initial_energy), 1e-12)
+    return {
+        "scene": scene_name,
+        "size": size,
+        "particles": particle_count,
+        "solver": solver_name,
+        "timestep": timestep,
+        "steps": steps,
+        "seconds": elapsed,
+        "steps_per_second": steps / elapsed,
+        "ns_per_particle_step": 1e9 * elapsed / (steps * particle_count),
+        "peak_memory_bytes": peak_memory,
+        "energy_drift": abs(energies[-1] - initial_energy) / scale,
+        "max_energy_error": np.max(np.abs(energies - initial_energy)) / scale,
+    }
+
+
+def run_suite(steps: int, scenes=None, solvers=None, timesteps=None) -> dict:
+    results = []
+    for scene_name in scenes or SCENES:
+        for size in SCENES[scene_name][1]:
+            for solver_name in solvers or SOLVERS:
+                for timestep in timesteps or TIMESTEPS:
+                    result = benchmark(scene_name, size, solver_name, timestep, steps)
+                    results.append(result)
+                    print(f"{scene_name:18} n={size:<4} {solver_name:20} dt={timestep:.5f} "
+                          f"{result['steps_per_second']:10.1f} steps/s "
+                          f"{result['ns_per_particle_step']:10.1f} ns/particle-step "
+                          f"drift={result['energy_drift']:.2e}")
+
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def _key(result: dict) -> tuple:
+    return result["scene"], result["size"], result["solver"], round(result["timestep"], 10)
+
+
+def compare(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """
+    :return: list of (key, baseline steps/s, current steps/s) for every run that got slower than the threshold
+    """
+    baseline_results = {_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        reference = baseline_results.get(_key(result))
+        if reference is not None and result["steps_per_second"] < (1 - threshold) * reference["steps_per_second"]:
+            regressions.append((_key(result), reference["steps_per_second"], result["steps_per_second"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_results.json", help="file for the results (JSON)")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--steps", type=int, default=500, help="steps per run")
+    parser.add_argument("--scenes", nargs="*", choices=list(SCENES), help="only run these scenes")
+    parser.add_argument("--solvers", nargs="*", choices=list(SOLVERS), help="only run these solvers")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative slowdown that counts as a regression")
+    arguments = parser.parse_args()
+
+    results = run_suite(arguments.steps, arguments.scenes, arguments.solvers)
+    with open(arguments.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {arguments.output}")
+
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            regressions = compare(results, json.load(file), arguments.threshold)
+        for key, reference, current in regressions:
+            print(f"REGRESSION {key}: {reference:.1f} -> {current:.1f} steps/s")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
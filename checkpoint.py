@@ -0,0 +1,242 @@
+import glob, hashlib, io, json, os
+import numpy as np
+from objects import Particle
+
+VERSION = 1
+
+# arrays of the ParticleSystem that hold the state of the particles
+SYSTEM_ARRAYS = ("positions", "velocities", "previous_positions", "forces", "masses", "inverse_masses", "radii")
+
+
+def _capture_attributes(obj, prefix: str, arrays: dict) -> None:
+    # all numpy arrays and numbers of an object (e.g. the internals of an integrator), references are skipped
+    for name, value in vars(obj).items():
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            arrays[f"{prefix}/{name}"] = value.copy()
+        elif isinstance(value, (bool, int, float, np.number)):
+            arrays[f"{prefix}/{name}"] = np.array(value)
+
+
+def _restore_attributes(obj, prefix: str, arrays: dict) -> None:
+    for key, value in arrays.items():
+        if not key.startswith(prefix + "/"):
+            continue
+        name = key[len(prefix) + 1:]
+        current = getattr(obj, name, None)
+        if isinstance(current, np.ndarray) and current.shape == value.shape:
+            # in place, other objects can hold references to the array
+            np.copyto(current, value)
+        elif isinstance(current, np.ndarray) or current is None:
+            setattr(obj, name, value.copy())
+        else:
+            setattr(obj, name, type(current)(value.item()))
+
+
+def _constraint_set(manager) -> list:
+    # json description of the constraints, to check that a checkpoint is restored into the same scene
+    description = []
+    for constraint in manager.constraints.values():
+        parameters = {name: value.item() if isinstance(value, np.generic) else value
+                      for name, value in vars(constraint).items()
+                      if name != "particles" and isinstance(value, (str, int, float, np.generic, type(None)))}
+        description.append([type(constraint).__name__, [int(i) for i in constraint.particles], parameters])
+    # constraints declared as arrays are compared by a digest of the arrays
+    for constraint_type, blocks in manager.constraint_arrays.items():
+        for particles, parameters in blocks:
+            digest = hashlib.sha1(particles.tobytes() + parameters.tobytes()).hexdigest()
+            description.append([constraint_type.__name__, len(particles), digest])
+    return description
+
+
+class Checkpoint:
+    """
+    Snapshot of the complete state of a Simulation: the arrays of the ParticleSystem, the internals of
+    the integrator (e.g. cached accelerations, warm starts, the step size of an adaptive integrator),
+    the trails of the particles, the lagrange multipliers of the ConstraintManager of the scene and
+    the tick counter.
+
+    The functions of a scene (forces, constraints) can't be stored, a checkpoint is restored into a
+    simulation of the same scene, e.g. created again by its create_scene function. The metadata
+    records the solver, the particle count and the constraint set, restore() refuses a different scene.
+
+    :param arrays: dict of the state arrays
+    :param metadata: json serializable dict
+    """
+
+    def __init__(self, arrays: dict, metadata: dict):
+        self.arrays = arrays
+        self.metadata = metadata
+
+    @property
+    def tick(self) -> int:
+        return self.metadata["tick"]
+
+    @property
+    def time(self) -> float:
+        return self.metadata["time"]
+
+    @classmethod
+    def capture(cls, simulation, metadata: dict = None) -> "Checkpoint":
+        system = simulation.system
+        arrays = {"system/" + name: getattr(system, name).copy() for name in SYSTEM_ARRAYS}
+        arrays["simulation/tickcounter"] = np.array(simulation.tickcounter)
+        _capture_attributes(simulation.solver, "solver", arrays)
+
+        particles = simulation.scene.particles
+        if isinstance(particles, list) and all(isinstance(particle, Particle) for particle in particles):
+            for number, particle in enumerate(particles):
+                _capture_attributes(particle.trail, f"trail/{number}", arrays)
+
+        manager = simulation.scene.constraints
+        if manager is not None:
+            arrays["constraints/lagrange_multipliers"] = manager.lagrange_multipliers.copy()
+
+        header = {
+            "version": VERSION,
+            "tick": simulation.tickcounter,
+            "time": simulation.time,
+            "timestep": float(simulation.timestep),
+            "solver": type(simulation.solver).__name__,
+            "particle_count": system.count,
+            "dimensions": system.dimensions,
+            "constraints": _constraint_set(manager) if manager is not None else None,
+            "metadata": metadata or {},
+        }
+        return cls(arrays, header)
+
+    def check(self, simulation) -> None:
+        # raises a ValueError if the simulation is not a simulation of the checkpointed scene
+        system, header = simulation.system, self.metadata
+        expected = {
+            "solver": type(simulation.solver).__name__,
+            "particle_count": system.count,
+            "dimensions": system.dimensions,
+            "timestep": float(simulation.timestep),
+        }
+        for name, value in expected.items():
+            if header[name] != value:
+                raise ValueError(f"the checkpoint has the {name} {header[name]}, the simulation {value}")
+
+        manager = simulation.scene.constraints
+        constraints = _constraint_set(manager) if manager is not None else None
+        if header["constraints"] is not None and constraints != header["constraints"]:
+            raise ValueError("the constraints of the simulation differ from the constraints of the checkpoint")
+
+    def restore(self, simulation) -> None:
+        """
+        Writes the state into a simulation of the same scene, the following steps are bit-exact
+        the steps of the checkpointed simulation.
+        """
+        self.check(simulation)
+        system = simulation.system
+        for name in SYSTEM_ARRAYS:
+            getattr(system, name)[...] = self.arrays["system/" + name]
+        simulation.tickcounter = int(self.arrays["simulation/tickcounter"])
+        _restore_attributes(simulation.solver, "solver", self.arrays)
+
+        particles = simulation.scene.particles
+        if "trail/0/length" in self.arrays:
+            for number, particle in enumerate(particles):
+                _restore_attributes(particle.trail, f"trail/{number}", self.arrays)
+
+        manager = simulation.scene.constraints
+        if manager is not None and "constraints/lagrange_multipliers" in self.arrays:
+            manager.lagrange_multipliers = self.arrays["constraints/lagrange_multipliers"].copy()
+
+    def save(self, path: str) -> None:
+        """
+        Saves the checkpoint as an uncompressed .npz file (the metadata is a json byte array).
+        The file is written to a temporary file first, a crash while saving keeps the old file.
+        """
+        buffer = io.BytesIO()
+        metadata = np.frombuffer(json.dumps(self.metadata).encode(), dtype=np.uint8)
+        np.savez(buffer, metadata=metadata, **self.arrays)
+        with open(path + ".tmp", "wb") as file:
+            file.write(buffer.getbuffer())
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "Checkpoint":
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        metadata = json.loads(arrays.pop("metadata").tobytes())
+        if metadata["version"] > VERSION:
+            raise ValueError(f"{path} has the unsupported version {metadata['version']}")
+        return cls(arrays, metadata)
+
+
+def fork(checkpoint: Checkpoint, create_simulation, count: int) -> list:
+    """
+    Creates simulations that all continue from one checkpoint, e.g. to branch what-if runs after an
+    expensive warm-up. Every simulation has its own ParticleSystem.
+
+    :param create_simulation: function without arguments that creates a new Simulation of the scene
+    :return: list of count restored simulations
+    """
+    simulations = []
+    for _ in range(count):
+        simulation = create_simulation()
+        checkpoint.restore(simulation)
+        simulations.append(simulation)
+    return simulations
+
+
+class Checkpointer:
+    """
+    Periodic automatic checkpoints of a long run. The checkpoints are saved as
+    "<directory>/checkpoint_<tick>.npz", only the newest keep checkpoints are kept.
+
+    Resuming a crashed run:
+        checkpointer = Checkpointer("checkpoints", every=10000)
+        checkpointer.resume(simulation)
+        checkpointer.run(simulation, total_steps - simulation.tickcounter)
+
+    :param directory: directory of the checkpoints, created if it doesn't exist
+    :param every: number of steps between two checkpoints
+    :param keep: number of checkpoints that are kept
+    :param metadata: json serializable dict stored in every checkpoint
+    """
+
+    def __init__(self, directory: str, every: int, keep: int = 3, metadata: dict = None):
+        self.directory = directory
+        self.every = every
+        self.keep = keep
+        self.metadata = metadata
+        os.makedirs(directory, exist_ok=True)
+
+    def paths(self) -> list:
+        # checkpoints from the oldest to the newest
+        return sorted(glob.glob(os.path.join(self.directory, "checkpoint_*.npz")))
+
+    def latest(self):
+        paths = self.paths()
+        return paths[-1] if paths else None
+
+    def save(self, simulation) -> str:
+        path = os.path.join(self.directory, f"checkpoint_{simulation.tickcounter:012d}.npz")
+        Checkpoint.capture(simulation, self.metadata).save(path)
+        for old in self.paths()[:-self.keep]:
+            os.remove(old)
+        return path
+
+    def __call__(self, simulation) -> None:
+        # saves a checkpoint every self.every steps, e.g. as the renderer of the Simulation runner
+        if simulation.tickcounter % self.every == 0:
+            self.save(simulation)
+
+    def resume(self, simulation) -> bool:
+        """
+        Restores the newest checkpoint into the simulation.
+
+        :return: False if there is no checkpoint
+        """
+        path = self.latest()
+        if path is None:
+            return False
+        Checkpoint.load(path).restore(simulation)
+        return True
+
+    def run(self, simulation, steps: int) -> None:
+        for _ in range(steps):
+            simulation.step()
+            self(simulation)
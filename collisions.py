@@ -0,0 +1,269 @@
+import itertools
+import numpy as np
+from objects import particle_indices
+from profiler import NULL_PROFILER
+
+# rings of cells searched by SpatialHash.nearest before falling back to comparing all points
+NEAREST_RING_LIMIT = 8
+
+# the hash table has at least this many buckets per point (rounded up to a power of two)
+BUCKETS_PER_POINT = 2
+
+# primes of the cell hash, one per dimension
+HASH_PRIMES = np.array([73856093, 19349663, 83492791], dtype=np.uint64)
+
+# multiplier of the fibonacci hashing, the top bits of the product depend on all bits of the hash
+_FIBONACCI = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _half_stencil(dimensions: int) -> np.ndarray:
+    # the own cell and half of the neighbour cells, so every pair of neighbouring cells is visited once
+    offsets = np.array(list(itertools.product((-1, 0, 1), repeat=dimensions)), dtype=np.int64)
+    first_nonzero = np.array([offset[np.flatnonzero(offset)[0]] if np.any(offset) else 1 for offset in offsets])
+    return offsets[first_nonzero > 0]
+
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> tuple:
+    # (owner, position) of every element of the ranges [start, start + count)
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(counts)), counts)
+    position = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+    return owner, position
+
+
+class SpatialHash:
+    """
+    Uniform grid over a set of points, stored as a hash table. The integer cell coordinates are hashed
+    into a fixed number of buckets (proportional to the number of points), so the memory doesn't depend
+    on the extent of the points. The points are sorted by their bucket and the bucket ranges are looked
+    up in a dense table of the bucket starts, so all queries are vectorized instead of python lists per
+    cell. Buckets can be shared by different cells, the queries only keep the points of the queried cells.
+
+    :param cell_size: edge length of the cells, at least the largest interaction distance
+    """
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.positions = np.zeros((0, 2), dtype=np.float64)
+        self.cells = np.zeros((0, 2), dtype=np.int64)
+        self.order = np.zeros(0, dtype=np.intp)
+        self.sorted_cells = np.zeros((0, 2), dtype=np.int64)
+        self._bits = 6
+        self._table = np.zeros((1 << self._bits) + 1, dtype=np.intp)
+
+    def _cells(self, positions: np.ndarray) -> np.ndarray:
+        return np.floor(positions / self.cell_size).astype(np.int64)
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        # bucket of every cell: xor of the coordinates times large primes, spread by fibonacci hashing
+        coordinates = cells.astype(np.uint64)
+        hashed = coordinates[..., 0] * HASH_PRIMES[0]
+        for dim in range(1, cells.shape[-1]):
+            hashed ^= coordinates[..., dim] * HASH_PRIMES[dim]
+        return ((hashed * _FIBONACCI) >> np.uint64(64 - self._bits)).astype(np.intp)
+
+    def build(self, positions: np.ndarray) -> None:
+        self.positions = positions
+        self.cells = self._cells(positions)
+        self._bits = max(6, (BUCKETS_PER_POINT * len(positions) - 1).bit_length())
+        keys = self._keys(self.cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_cells = self.cells[self.order]
+
+        # start of every bucket in the sorted order, the points of bucket k are order[table[k]:table[k + 1]]
+        buckets = 1 << self._bits
+        self._table = np.zeros(buckets + 1, dtype=np.intp)
+        np.cumsum(np.bincount(keys, minlength=buckets), out=self._table[1:])
+
+    def _points(self, cells: np.ndarray) -> tuple:
+        """
+        :return: (query, point) for all points in the cells, query is the row of the cell in cells
+        """
+        keys = self._keys(cells)
+        starts = self._table[keys]
+        query, position = _ranges(starts, self._table[keys + 1] - starts)
+        points = self.order[position]
+
+        # points of other cells in the same bucket are dropped
+        same = self.sorted_cells[position, 0] == cells[query, 0]
+        for dim in range(1, cells.shape[-1]):
+            same &= self.sorted_cells[position, dim] == cells[query, dim]
+        return query[same], points[same]
+
+    def pairs(self) -> tuple:
+        """
+        Candidate pairs: all pairs of points in the same or in neighbouring cells, every pair once.
+
+        :return: index arrays (i, j) into the built positions
+        """
+        first, second = [], []
+        for offset in _half_stencil(self.cells.shape[1]):
+            owner, other = self._points(self.cells + offset)
+            if not np.any(offset):
+                # pairs inside one cell are found from both points
+                keep = owner < other
+                owner, other = owner[keep], other[keep]
+            first.append(owner)
+            second.append(other)
+        return np.concatenate(first), np.concatenate(second)
+
+    def within(self, point, radius: float) -> np.ndarray:
+        # indices of all points closer than radius to the point
+        point = np.asarray(point, dtype=np.float64)
+        low, high = self._cells(point - radius), self._cells(point + radius)
+        cells = np.stack(np.meshgrid(*[np.arange(l, h + 1) for l, h in zip(low, high)], indexing="ij"), axis=-1)
+        _, candidates = self._points(cells.reshape(-1, len(point)))
+        distances = np.sum((self.positions[candidates] - point) ** 2, axis=1)
+        return candidates[distances < radius ** 2]
+
+    def nearest(self, point) -> int:
+        """
+        Nearest point, searched ring by ring around the cell of the point.
+
+        :return: index of the nearest point, -1 if the grid is empty
+        """
+        if len(self.positions) == 0:
+            return -1
+        point = np.asarray(point, dtype=np.float64)
+        cell = self._cells(point)
+        dimensions = len(point)
+
+        best, best_distance = -1, np.inf
+        for ring in range(NEAREST_RING_LIMIT + 1):
+            offsets = np.array(list(itertools.product(range(-ring, ring + 1), repeat=dimensions)), dtype=np.int64)
+            offsets = offsets[np.max(np.abs(offsets), axis=1) == ring]
+            _, candidates = self._points(cell + offsets)
+            if len(candidates):
+                distances = np.sum((self.positions[candidates] - point) ** 2, axis=1)
+                closest = np.argmin(distances)
+                if distances[closest] < best_distance:
+                    best, best_distance = int(candidates[closest]), distances[closest]
+
+            # all points in further rings are at least ring * cell_size away
+            if best >= 0 and np.sqrt(best_distance) <= ring * self.cell_size:
+                return best
+
+        # far away from all points, compare with all of them
+        return int(np.argmin(np.sum((self.positions - point) ** 2, axis=1)))
+
+
+class Collisions:
+    """
+    Collisions between the particles of a scene, which are circles (spheres) with the radii of
+    the ParticleSystem. A SpatialHash finds the candidate pairs, the overlaps of all pairs are
+    calculated in one vectorized pass.
+
+    Two kinds of response:
+    - impulses: call resolve() after every step (the Simulation runner does this for Scene(collisions=...)).
+      Overlapping particles are pushed apart (split by their inverse masses) and approaching particles get
+      a restitution impulse.
+    - penalty forces: add_forces() adds a spring-damper force k * overlap - c * v_n for every contact.
+
+    :param scene: list of particles (or a ParticleSystem)
+    :param restitution: coefficient of restitution of the impulses (0: inelastic, 1: elastic)
+    :param stiffness: stiffness k of the penalty forces
+    :param damping: damping c of the penalty forces
+    :param iterations: number of detect/resolve passes of resolve()
+    :param cell_size: edge length of the grid cells (default: largest diameter)
+    :param profiler: optional Profiler, times "collisions.broadphase" and "collisions.narrowphase"
+    """
+
+    def __init__(self, scene, restitution: float = 0.5, stiffness: float = 1e4, damping: float = 0.0,
+                 iterations: int = 4, cell_size: float = None, profiler=None):
+        self.system, self.index = particle_indices(scene)
+        self.particles = np.arange(self.system.count)[self.index]
+        self.restitution = restitution
+        self.stiffness = stiffness
+        self.damping = damping
+        self.iterations = iterations
+        self.cell_size = cell_size
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+        self.grid = SpatialHash(1.0)
+        self.contact_count = 0
+
+    def build(self) -> SpatialHash:
+        # grid over the current positions, also used for nearest() queries
+        radii = self.system.radii[self.particles]
+        self.grid.cell_size = self.cell_size or max(2 * float(radii.max(initial=0.0)), 1e-12)
+        self.grid.build(self.system.positions[self.particles])
+        return self.grid
+
+    def nearest(self, point) -> int:
+        """
+        :return: system index of the particle closest to the point
+        """
+        self.build()
+        nearest = self.grid.nearest(point)
+        return int(self.particles[nearest]) if nearest >= 0 else -1
+
+    def detect(self) -> tuple:
+        """
+        :return: (i, j, normals, overlaps) of all overlapping pairs, i and j are system indices,
+                 the normals point from j to i
+        """
+        with self.profiler.phase("collisions.broadphase"):
+            grid = self.build()
+            a, b = grid.pairs()
+
+        with self.profiler.phase("collisions.narrowphase"):
+            positions = grid.positions
+            radii = self.system.radii[self.particles]
+            d = positions[a] - positions[b]
+            distance = np.sqrt(np.einsum("ij,ij->i", d, d))
+            overlap = radii[a] + radii[b] - distance
+            contact = overlap > 0
+            a, b, d, distance, overlap = a[contact], b[contact], d[contact], distance[contact], overlap[contact]
+
+            # particles at the same position are separated along the first axis
+            normals = np.zeros_like(d)
+            normals[:, 0] = 1
+            np.divide(d, distance[:, np.newaxis], out=normals, where=distance[:, np.newaxis] > 0)
+
+        self.contact_count = len(a)
+        self.profiler.count("contacts", self.contact_count)
+        return self.particles[a], self.particles[b], normals, overlap
+
+    def _scatter(self, i: np.ndarray, j: np.ndarray, values_i: np.ndarray, values_j: np.ndarray) -> np.ndarray:
+        # per particle sum of values_i of the contacts where it is i minus values_j of the contacts where it is j
+        result = np.zeros((self.system.count, self.system.dimensions), dtype=np.float64)
+        for dim in range(self.system.dimensions):
+            result[:, dim] = (np.bincount(i, values_i[:, dim], minlength=self.system.count)
+                              - np.bincount(j, values_j[:, dim], minlength=self.system.count))
+        return result
+
+    def add_forces(self) -> None:
+        i, j, normals, overlap = self.detect()
+        velocities = self.system.velocities
+        normal_velocity = np.einsum("ij,ij->i", velocities[i] - velocities[j], normals)
+
+        # only push, never pull the particles together
+        forces = np.maximum(self.stiffness * overlap - self.damping * normal_velocity, 0.0)[:, np.newaxis] * normals
+        self.system.forces[...] += self._scatter(i, j, forces, forces)
+
+    def resolve(self) -> None:
+        system = self.system
+        for iteration in range(self.iterations):
+            i, j, normals, overlap = self.detect()
+            if len(i) == 0:
+                break
+
+            # changes along the normals are split by the inverse masses
+            w_i, w_j = system.inverse_masses[i], system.inverse_masses[j]
+            w = w_i + w_j
+            share = np.divide(1.0, w, out=np.zeros_like(w), where=w > 0)
+            weight_i = (w_i * share)[:, np.newaxis] * normals
+            weight_j = (w_j * share)[:, np.newaxis] * normals
+
+            # every particle moves by the mean of the changes of its contacts (jacobi)
+            contacts = np.bincount(i, minlength=system.count) + np.bincount(j, minlength=system.count)
+            scale = 1.0 / np.maximum(contacts, 1)[:, np.newaxis]
+
+            if iteration == 0:
+                # restitution impulse for approaching particles: Δv_n = - (1 + e) v_n
+                velocities = system.velocities
+                normal_velocity = np.einsum("ij,ij->i", velocities[i] - velocities[j], normals)
+                change = np.where(normal_velocity < 0, -(1 + self.restitution) * normal_velocity, 0.0)[:, np.newaxis]
+                velocities += self._scatter(i, j, change * weight_i, change * weight_j) * scale
+
+            system.positions[...] += self._scatter(i, j, overlap[:, np.newaxis] * weight_i,
+                                                   overlap[:, np.newaxis] * weight_j) * scale
@@ -1,193 +1,762 @@
 import numpy as np
-import math
-from sympy import symbols, diff
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from sympy import symbols, diff, lambdify
 from sympy.parsing.sympy_parser import parse_expr
-from objects import Particle
+from objects import Particle, particle_indices
+from linear_solvers import SOLVERS
+from profiler import NULL_PROFILER
 
 
-class ConstraintManager:
-    def __init__(self, scene: list, dimensions: int):
-        self.scene = scene
-        self.dimensions = dimensions
+def _system_index(particle) -> int:
+    # constraints can be declared with Particle objects or directly with indices into the particle system
+    return particle.index if isinstance(particle, Particle) else int(particle)
 
-        # list of positions, velocities and forces
-        scene_length = len(self.scene)
-        self.q = np.zeros(self.dimensions * scene_length, dtype=np.float64).reshape((self.dimensions * scene_length, 1))
-        self.dq = np.zeros(self.dimensions * scene_length, dtype=np.float64).reshape((self.dimensions * scene_length, 1))
-        self.Q = np.zeros(self.dimensions * scene_length, dtype=np.float64).reshape((self.dimensions * scene_length, 1))
-
-        # create the diagonal mass matrix
-        dim_times_particles = self.dimensions * scene_length
-        self.M = np.zeros(shape=(dim_times_particles, dim_times_particles), dtype=np.float64)
-
-        for c, particle in enumerate(scene):
-            for dim in range(self.dimensions):
-                self.q[2*c+dim] = particle.position[dim]
-                self.dq[2*c+dim] = particle.velocity[dim]
-                self.Q[2*c+dim] = particle.force_accumulator[dim]
-                self.M[2*c+dim, 2*c+dim] = particle.mass
-
-        self.W = np.linalg.inv(self.M)                                         # inverse mass matrix
-
-        self.j = np.zeros(shape=(0, dim_times_particles), dtype=np.float64)      # jacobi matrix J = δC/δq
-        self.dj = np.zeros(shape=(0, dim_times_particles), dtype=np.float64)     # derivative of the jacobi matrix
-
-        self.c = []                                                              # constraint C
-        self.dc = []                                                             # derivative of the constraints δC/dδ
-
-    def update(self) -> None:
-        self.__init__(self.scene, self.dimensions)
-
-    def rail_constraint(self, particle: Particle, function: str) -> None:
-
-        # find index of object in scene
-        index = self.scene.index(particle)
-        objects = len(self.scene)
-
-        # parse the function
-        x = symbols('x')
-        f = parse_expr(function)
-        df = diff(f, x)
-        ddf = diff(df, x)
-
-        # reshape the arrays so that it's a row vector instead of a column vector
-        # also the data type is changed to float64
-        j = []
-        for c, i in enumerate(range(objects)):
-            if c == index:
-                j.extend([-df.subs(x, particle.position[0]), 1])
-            else:
-                j.extend([0, 0])
-
-        j = np.array(j, dtype=np.float64).reshape((1, objects*2))
-
-        # reshape the arrays so that it's a row vector instead of a column vector
-        # also the data type is changed to float64
-        dj = []
-        for c, i in enumerate(range(objects)):
-            if c == index:
-                dj.extend([-ddf.subs(x, particle.position[0]) * particle.velocity[0], 0])
-            else:
-                dj.extend([0, 0])
-
-        dj = np.array(dj, dtype=np.float64).reshape((1, objects*2))
-
-        self.j = np.concatenate((self.j, j), axis=0)
-        self.dj = np.concatenate((self.dj, dj), axis=0)
-
-        self.c += [particle.position[1] - f.subs(x, particle.position[0])]
-        self.dc += [-df.subs(x, particle.position[0]) * particle.velocity[0] + particle.velocity[1]]
-
-    def distance_constraint(self, particle1: Particle, particle2: Particle) -> None:
-
-        # find index of object in scene
-        index1 = self.scene.index(particle1)
-        index2 = self.scene.index(particle2)
-        objects = len(self.scene)
-
-        # positions
-        x1 = particle1.position[0]
-        y1 = particle1.position[1]
-        x2 = particle2.position[0]
-        y2 = particle2.position[1]
-
-        # velocities
-        x1_vel = particle1.velocity[0]
-        y1_vel = particle1.velocity[1]
-        x2_vel = particle2.velocity[0]
-        y2_vel = particle2.velocity[1]
 
-        # denominator for all the derivatives
-        u = np.sqrt((x1 - x2)**2 + (y1 - y2)**2)
-
-        j = []
-        for c, i in enumerate(range(objects)):
-            if c == index1:
-                j.extend([(x1 - x2) / u, (y1 - y2) / u])
-            elif c == index2:
-                j.extend([(-1 * (x1 - x2)) / u, (-1 * (y1 - y2)) / u])
-            else:
-                j.extend([0, 0])
-
-        # jacobian matrix
-        j = np.array(j, dtype=np.float64).reshape((1, objects*2))
-
-        dj = []
-        for c, i in enumerate(range(objects)):
-            if c == index1:
-                dj.extend([(-1 * (x1 * (y1_vel - y2_vel) - x1_vel * (y1 - y2) - x2 * (y1_vel - y2_vel) + x2_vel * (y1 - y2)) * (y1 - y2)) / u**3,
-                           ((x1 ** 2) * (y1_vel - y2_vel) - x1 * (x1_vel * (y1 - y2) + 2 * x2 * (y1_vel - y2_vel) - x2_vel * (y1 - y2)) + ((x1_vel * (y1 - y2) + x2 * (y1_vel - y2_vel) - x2_vel * (y1 - y2)) * x2)) / u**3])
-            elif c == index2:
-                dj.extend([(x1 * (y1_vel - y2_vel) - x1_vel * (y1 - y2) - x2 * (y1_vel - y2_vel) + x2_vel * (y1 - y2)) * (y1 - y2) / u**3,
-                           (-1 * ((x1 ** 2) * (y1_vel - y2_vel) - x1 * (x1_vel * (y1 - y2) + 2 * x2 * (y1_vel - y2_vel) - x2_vel * (y1 - y2)) + ((x1_vel * (y1 - y2) + x2 * (y1_vel - y2_vel) - x2_vel * (y1 - y2)) * x2))) / u**3])
-            else:
-                dj.extend([0, 0])
+class DistanceConstraint:
+    """
+    Keeps the distance between two particles constant.
+    C = |x1 - x2| - l
+    """
 
-        # derivative of the jacobi matrix
-        dj = np.array(dj, dtype=np.float64).reshape((1, objects*2))
+    def __init__(self, particle1, particle2, length: float = None):
+        self.particles = (_system_index(particle1), _system_index(particle2))
+        self.length = length
 
-        self.j = np.concatenate((self.j, j), axis=0)
-        self.dj = np.concatenate((self.dj, dj), axis=0)
+    @property
+    def key(self) -> tuple:
+        return DistanceConstraint, self.particles
 
-    def circular_wire_constraint(self, particle: Particle) -> None:
+    def initialize(self, positions: np.ndarray) -> None:
+        # the distance at declaration time is kept if no length is given
+        if self.length is None:
+            self.length = np.linalg.norm(positions[self.particles[0]] - positions[self.particles[1]])
 
-        # find index of object in scene
-        index = self.scene.index(particle)
-        objects = len(self.scene)
+    @staticmethod
+    def parameters(constraints: list) -> np.ndarray:
+        return np.array([constraint.length for constraint in constraints], dtype=np.float64)
 
-        # positions
-        x = particle.position[0]
-        y = particle.position[1]
+    @staticmethod
+    def prepare(lengths: np.ndarray) -> np.ndarray:
+        return lengths
 
-        # velocities
-        x_vel = particle.velocity[0]
-        y_vel = particle.velocity[1]
+    @staticmethod
+    def value(positions: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        return np.linalg.norm(positions[..., 0, :] - positions[..., 1, :], axis=-1) - lengths
+
+    @staticmethod
+    def jacobian(positions: np.ndarray, velocities: np.ndarray, lengths: np.ndarray) -> tuple:
+        # relative positions and velocities, shape (..., C, D)
+        d = positions[..., 0, :] - positions[..., 1, :]
+        dv = velocities[..., 0, :] - velocities[..., 1, :]
 
         # denominator for all the derivatives
-        u = np.sqrt(x**2 + y**2)
-
-        j = []
-        for c, i in enumerate(range(objects)):
-            if c == index:
-                j.extend([x / u, y / u])
-            else:
-                j.extend([0, 0])
-
-        # jacobi matrix
-        j = np.array(j, dtype=np.float64).reshape((1, objects*2))
-
-        dj = []
-        for c, i in enumerate(range(objects)):
-            if c == index:
-                dj.extend([(x_vel * (y ** 2) - y_vel * x * y) / u**3,
-                           (y_vel * (x ** 2) - x_vel * x * y) / u**3])
-            else:
-                dj.extend([0, 0])
+        u = np.sqrt(np.einsum("...i,...i->...", d, d))[..., np.newaxis]
 
-        # derivative of the jacobi matrix
-        dj = np.array(dj, dtype=np.float64).reshape((1, objects*2))
+        # J = d / |d|,  dJ/dt = dv / |d| - d (d · dv) / |d|^3
+        j = d / u
+        dj = dv / u - d * np.einsum("...i,...i->...", d, dv)[..., np.newaxis] / u**3
+
+        return np.stack((j, -j), axis=-2), np.stack((dj, -dj), axis=-2)
+
+
+class CircularWireConstraint:
+    """
+    Keeps a particle at a constant distance to the origin.
+    C = |x| - r
+    """
+
+    def __init__(self, particle, radius: float = None):
+        self.particles = (_system_index(particle),)
+        self.radius = radius
+
+    @property
+    def key(self) -> tuple:
+        return CircularWireConstraint, self.particles
+
+    def initialize(self, positions: np.ndarray) -> None:
+        if self.radius is None:
+            self.radius = np.linalg.norm(positions[self.particles[0]])
+
+    @staticmethod
+    def parameters(constraints: list) -> np.ndarray:
+        return np.array([constraint.radius for constraint in constraints], dtype=np.float64)
+
+    @staticmethod
+    def prepare(radii: np.ndarray) -> np.ndarray:
+        return radii
+
+    @staticmethod
+    def value(positions: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        return np.linalg.norm(positions[..., 0, :], axis=-1) - radii
+
+    @staticmethod
+    def jacobian(positions: np.ndarray, velocities: np.ndarray, radii: np.ndarray) -> tuple:
+        d = positions[..., 0, :]
+        dv = velocities[..., 0, :]
+
+        u = np.sqrt(np.einsum("...i,...i->...", d, d))[..., np.newaxis]
+
+        j = d / u
+        dj = dv / u - d * np.einsum("...i,...i->...", d, dv)[..., np.newaxis] / u**3
+
+        return j[..., np.newaxis, :], dj[..., np.newaxis, :]
+
+
+@lru_cache(maxsize=None)
+def compile_rail_function(function: str) -> tuple:
+    """
+    Parses and differentiates a rail function once and compiles f, f' and f'' to numpy functions.
+    The result is memoized by the expression string.
+    """
+    x = symbols('x')
+    f = parse_expr(function)
+    df = diff(f, x)
+    ddf = diff(df, x)
+    return tuple(lambdify(x, expression, "numpy") for expression in (f, df, ddf))
 
-        self.j = np.concatenate((self.j, j), axis=0)
-        self.dj = np.concatenate((self.dj, dj), axis=0)
+
+def _evaluate(compiled_function, x: np.ndarray) -> np.ndarray:
+    # constant expressions return a scalar, so broadcast them to the shape of x
+    return np.broadcast_to(compiled_function(x), x.shape).astype(np.float64)
+
+
+class RailConstraint:
+    """
+    Keeps a particle on the graph of a function f(x) (only in two dimensions).
+    C = y - f(x)
+    """
+
+    def __init__(self, particle, function: str):
+        self.particles = (_system_index(particle),)
+        self.function = function
+        self.f, self.df, self.ddf = compile_rail_function(function)
+
+    @property
+    def key(self) -> tuple:
+        return RailConstraint, self.particles, self.function
+
+    def initialize(self, positions: np.ndarray) -> None:
+        pass
+
+    @staticmethod
+    def parameters(constraints: list) -> np.ndarray:
+        return np.array([constraint.function for constraint in constraints], dtype=str)
+
+    @staticmethod
+    def prepare(functions: np.ndarray) -> list:
+        # rows of the constraints sharing the same rail, so every rail is evaluated once for all its particles
+        rails, inverse = np.unique(functions, return_inverse=True)
+        groups = np.split(np.argsort(inverse, kind="stable"), np.cumsum(np.bincount(inverse, minlength=len(rails)))[:-1])
+        return [(compile_rail_function(str(function)), rows) for function, rows in zip(rails, groups)]
+
+    @staticmethod
+    def value(positions: np.ndarray, rails: list) -> np.ndarray:
+        c = np.zeros(positions.shape[:-2], dtype=np.float64)
+        for (f, df, ddf), rows in rails:
+            c[..., rows] = positions[..., rows, 0, 1] - _evaluate(f, positions[..., rows, 0, 0])
+        return c
+
+    @staticmethod
+    def jacobian(positions: np.ndarray, velocities: np.ndarray, rails: list) -> tuple:
+        j = np.zeros(positions.shape, dtype=np.float64)
+        dj = np.zeros(positions.shape, dtype=np.float64)
+
+        for (f, df, ddf), rows in rails:
+            x = positions[..., rows, 0, 0]
+            j[..., rows, 0, 0] = -_evaluate(df, x)
+            j[..., rows, 0, 1] = 1
+            dj[..., rows, 0, 0] = -_evaluate(ddf, x) * velocities[..., rows, 0, 0]
+
+        return j, dj
+
+
+# constraint systems up to this size are assembled and solved densely, where scipy.sparse has too much overhead
+DENSE_CONSTRAINT_LIMIT = 64
+
+# islands (independent groups of constraints) up to this size are solved with batched dense solves
+ISLAND_SIZE_LIMIT = 64
+
+
+class ConstraintManager:
+    """
+    Keeps a persistent graph of constraints between the particles of a scene and
+    calculates the constraint forces with the method of lagrange multipliers.
+
+    Constraints are declared once. Every force evaluation only refreshes the state
+    vectors in place and re-evaluates the values of the sparse jacobian. Large sets of constraints can be
+    declared as index arrays (add_distance_constraints etc.), without one constraint object per constraint.
+
+    Drift of the constraints can be reduced with baumgarte stabilization
+    (J W J^T λ = - dJ dq - J W Q - α C - β dC) and/or by calling project() after each step.
+
+    Constraints that don't share particles (directly or through other constraints) form
+    independent islands. With the direct solver and islands enabled, every island is solved as
+    its own small system; islands of the same size are stacked into one batched solve, which can
+    be spread over a thread pool. close() (or leaving the manager as a context manager) shuts it down.
+
+    With solver="xpbd" the manager adds no constraint forces. Instead, the XPBD integrator
+    (ode_solvers/xpbd.py) calls solve_positions() after every substep, which projects the
+    positions constraint by constraint (extended position based dynamics with the given compliance).
+    The constraints are colored so that constraints of one color share no particles and are
+    projected together in one vectorized call per constraint type.
+
+    An optional Profiler times the phases "constraints.update", "constraints.jacobian",
+    "constraints.solve" and "constraints.project" and counts the constraints, the solver
+    iterations and the residual of every step.
+    """
+
+    def __init__(self, scene, dimensions: int, solver: str = "direct",
+                 tolerance: float = 1e-10, max_iterations: int = 100,
+                 baumgarte_alpha: float = 0.0, baumgarte_beta: float = 0.0,
+                 islands: bool = True, threads: int = 0, compliance: float = 0.0, profiler=None):
+        self.scene = scene
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+        self.dimensions = dimensions
+        self.system, self.index = particle_indices(scene)
+
+        # linear solver for J W J^T λ = ..., one of linear_solvers.SOLVERS, or "xpbd"
+        if solver not in SOLVERS and solver != "xpbd":
+            raise ValueError(f"unknown solver '{solver}', choose one of {list(SOLVERS) + ['xpbd']}")
+        self.solver = solver
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+        # lagrange multipliers of the last solve, used to warm start the iterative solvers
+        self.lagrange_multipliers = np.zeros(0, dtype=np.float64)
+        self.solver_iterations = 0
+        self.solver_residual = 0.0
+        self._forces = None
+
+        # inverse stiffness of the constraints for the xpbd solver (0 is a rigid constraint)
+        self.compliance = compliance
+        self._colors = []
+
+        # baumgarte stabilization
+        self.baumgarte_alpha = baumgarte_alpha
+        self.baumgarte_beta = baumgarte_beta
+
+        # island detection
+        self.islands_enabled = islands
+        self.threads = threads
+        self.islands = []
+        self._island_groups = []
+        self._use_islands = False
+        self._executor = None
+
+        # local position of every particle of the system in q (-1 if not part of the scene)
+        particle_count = len(self.system.masses[self.index])
+        self.local_index = np.full(self.system.count, -1, dtype=np.intp)
+        self.local_index[self.index] = np.arange(particle_count)
+
+        # list of positions, velocities and forces
+        size = self.dimensions * particle_count
+        self.q = np.zeros((size, 1), dtype=np.float64)
+        self.dq = np.zeros((size, 1), dtype=np.float64)
+        self.Q = np.zeros((size, 1), dtype=np.float64)
+
+        # diagonal of the inverse mass matrix W
+        self.inverse_masses = np.zeros(size, dtype=np.float64)
+
+        # constraint graph: constraint objects by key and bulk declared (particles (C, P), parameters (C,)) arrays by type
+        self.constraints = {}
+        self.constraint_arrays = {}
+        self._groups = []
+        self._dirty = True
+
+        # sparsity pattern of J and dJ (rebuilt when the graph changes)
+        self.constraint_count = 0
+        self._j_values = np.zeros(0, dtype=np.float64)
+        self._dj_values = np.zeros(0, dtype=np.float64)
+        self._indices = np.zeros(0, dtype=np.intp)
+        self._indptr = np.zeros(1, dtype=np.intp)
+        self._order = np.zeros(0, dtype=np.intp)
+        self._rows = np.zeros(0, dtype=np.intp)
+        self._cols = np.zeros(0, dtype=np.intp)
+
+        self.c = np.zeros(0, dtype=np.float64)                                   # constraint C
+        self.dc = np.zeros(0, dtype=np.float64)                                  # derivative of the constraints δC/dt
+
+        self.update()
+
+    def add_constraint(self, constraint):
+        # declaring the same constraint twice has no effect
+        if constraint.key not in self.constraints:
+            self._grow_local_index()
+            if np.any(self.local_index[list(constraint.particles)] < 0):
+                raise ValueError("constraint references a particle that is not part of the scene")
+            constraint.initialize(self.system.positions)
+            self.constraints[constraint.key] = constraint
+            self._dirty = True
+        return self.constraints[constraint.key]
+
+    def remove_constraint(self, constraint) -> None:
+        del self.constraints[constraint.key]
+        self._dirty = True
+
+    def rail_constraint(self, particle: Particle, function: str) -> RailConstraint:
+        return self.add_constraint(RailConstraint(particle, function))
+
+    def distance_constraint(self, particle1: Particle, particle2: Particle) -> DistanceConstraint:
+        return self.add_constraint(DistanceConstraint(particle1, particle2))
+
+    def circular_wire_constraint(self, particle: Particle) -> CircularWireConstraint:
+        return self.add_constraint(CircularWireConstraint(particle))
+
+    def _add_arrays(self, constraint_type, particles: np.ndarray, parameters: np.ndarray) -> None:
+        # bulk declaration: the arrays go into the graph as they are, there is no check for duplicates
+        self._grow_local_index()
+        if np.any(self.local_index[particles] < 0):
+            raise ValueError("constraint references a particle that is not part of the scene")
+        self.constraint_arrays.setdefault(constraint_type, []).append((particles, parameters))
+        self._dirty = True
+
+    def add_distance_constraints(self, particles1, particles2, lengths=None) -> None:
+        """
+        Declares many distance constraints at once without creating constraint objects (e.g. for scene files).
+
+        :param particles1: system indices of the first particles (C,)
+        :param particles2: system indices of the second particles (C,)
+        :param lengths: lengths (C,) or one length for all constraints (default: the current distances)
+        """
+        particles = np.stack((np.asarray(particles1, dtype=np.intp), np.asarray(particles2, dtype=np.intp)), axis=1)
+        if lengths is None:
+            positions = self.system.positions
+            lengths = np.linalg.norm(positions[particles[:, 0]] - positions[particles[:, 1]], axis=1)
+        self._add_arrays(DistanceConstraint, particles, np.broadcast_to(np.asarray(lengths, dtype=np.float64),
+                                                                        len(particles)).copy())
+
+    def add_circular_wire_constraints(self, particles, radii=None) -> None:
+        """
+        Declares many circular wire constraints at once.
+
+        :param particles: system indices of the particles (C,)
+        :param radii: radii (C,) or one radius for all constraints (default: the current distances to the origin)
+        """
+        particles = np.asarray(particles, dtype=np.intp)[:, np.newaxis]
+        if radii is None:
+            radii = np.linalg.norm(self.system.positions[particles[:, 0]], axis=1)
+        self._add_arrays(CircularWireConstraint, particles, np.broadcast_to(np.asarray(radii, dtype=np.float64),
+                                                                            len(particles)).copy())
+
+    def add_rail_constraints(self, particles, function: str) -> None:
+        """
+        Declares rail constraints of many particles on the same function f(x) at once.
+
+        :param particles: system indices of the particles (C,)
+        """
+        compile_rail_function(function)
+        particles = np.asarray(particles, dtype=np.intp)[:, np.newaxis]
+        self._add_arrays(RailConstraint, particles, np.full(len(particles), function))
+
+    def _grow_local_index(self) -> None:
+        # particles added to the system after the manager was created are not part of the scene
+        missing = self.system.count - len(self.local_index)
+        if missing > 0:
+            self.local_index = np.concatenate((self.local_index, np.full(missing, -1, dtype=np.intp)))
+
+    def _rebuild(self) -> None:
+        self._grow_local_index()
+
+        # group the constraints by type, so that every type is evaluated in one vectorized call
+        by_type = {}
+        for constraint in self.constraints.values():
+            by_type.setdefault(type(constraint), []).append(constraint)
+        arrays = {constraint_type: [(np.array([constraint.particles for constraint in constraints], dtype=np.intp),
+                                     constraint_type.parameters(constraints))]
+                  for constraint_type, constraints in by_type.items()}
+        for constraint_type, blocks in self.constraint_arrays.items():
+            arrays.setdefault(constraint_type, []).extend(blocks)
+
+        self._groups = []
+        rows, cols = [], []
+        row = 0
+        blocks = []
+        for constraint_type, type_arrays in arrays.items():
+            system_particles = np.concatenate([block[0] for block in type_arrays])
+            parameters = np.concatenate([block[1] for block in type_arrays])
+            blocks.append((constraint_type, system_particles, parameters, row))
+
+            particles = self.local_index[system_particles]
+            count, particles_per_constraint = particles.shape
+            self._groups.append((constraint_type, constraint_type.prepare(parameters), particles, slice(row, row + count)))
+
+            # every constraint row has an entry for every coordinate of its particles
+            rows.append(np.repeat(np.arange(row, row + count), particles_per_constraint * self.dimensions))
+            cols.append((self.dimensions * particles[:, :, np.newaxis] + np.arange(self.dimensions)).ravel())
+            row += count
+
+        self.constraint_count = row
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.intp)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.intp)
+
+        # the csr structure is fixed, only the order of the values has to be permuted every step
+        pattern = sparse.csr_matrix((np.arange(1, len(rows) + 1, dtype=np.float64), (rows, cols)),
+                                    shape=(self.constraint_count, len(self.q)))
+        self._order = pattern.data.astype(np.intp) - 1
+        self._rows = rows
+        self._cols = cols
+        self._indices = pattern.indices
+        self._indptr = pattern.indptr
+        self._j_values = np.zeros(len(rows), dtype=np.float64)
+        self._dj_values = np.zeros(len(rows), dtype=np.float64)
+        self.lagrange_multipliers = np.zeros(self.constraint_count, dtype=np.float64)
+        self.c = np.zeros(self.constraint_count, dtype=np.float64)
+        self.dc = np.zeros(self.constraint_count, dtype=np.float64)
+        self._build_islands(rows, cols)
+        self._build_colors(blocks)
+        self._dirty = False
+
+    def _build_colors(self, blocks: list) -> None:
+        # greedy coloring: a constraint gets the first color that none of its particles uses yet
+        # blocks: (constraint type, system indices of the particles (C, P), parameters (C,), first row) of every type
+        self._colors = []
+        if self.solver != "xpbd":
+            return
+
+        particle_colors = {}
+        colored = {}
+        for number, (constraint_type, particles, parameters, first) in enumerate(blocks):
+            for c, constraint_particles in enumerate(particles.tolist()):
+                used = set()
+                for particle in constraint_particles:
+                    used.update(particle_colors.get(particle, ()))
+                color = next(color for color in range(len(used) + 1) if color not in used)
+                for particle in constraint_particles:
+                    particle_colors.setdefault(particle, set()).add(color)
+                colored.setdefault(color, {}).setdefault(number, []).append(c)
+
+        for color in sorted(colored):
+            groups = []
+            for number, members in colored[color].items():
+                constraint_type, particles, parameters, first = blocks[number]
+                members = np.array(members, dtype=np.intp)
+                groups.append((constraint_type, constraint_type.prepare(parameters[members]), particles[members],
+                               first + members))
+            self._colors.append(groups)
+
+    @property
+    def color_count(self) -> int:
+        return len(self._colors)
+
+    def solve_positions(self, timestep: float, iterations: int = 1) -> None:
+        """
+        XPBD projection of the positions of the system (solver="xpbd"), called by the XPBD integrator
+        after the positions of a substep were predicted.
+
+        :param timestep: timestep of the substep, scales the compliance
+        :param iterations: number of passes over all colors
+        """
+        if self._dirty:
+            self._rebuild()
+
+        with self.profiler.phase("constraints.xpbd"):
+            positions = self.system.positions
+            inverse_masses = self.system.inverse_masses
+            alpha = self.compliance / timestep ** 2
+            self.lagrange_multipliers[...] = 0
+
+            for _ in range(iterations):
+                for groups in self._colors:
+                    for constraint_type, data, particles, rows in groups:
+                        # particles of one color are distinct, so all corrections are applied at once
+                        group_positions = positions[particles]
+                        c = constraint_type.value(group_positions, data)
+                        j, _ = constraint_type.jacobian(group_positions, np.zeros_like(group_positions), data)
+                        w = inverse_masses[particles]
+
+                        # Δλ = (- C - α̃ λ) / (Σ w |∇C|² + α̃),  Δx = w ∇C Δλ
+                        denominator = np.einsum("cp,cpd,cpd->c", w, j, j) + alpha
+                        delta = np.divide(- c - alpha * self.lagrange_multipliers[rows], denominator,
+                                          out=np.zeros_like(c), where=denominator > 0)
+                        self.lagrange_multipliers[rows] += delta
+                        positions[particles] += w[:, :, np.newaxis] * j * delta[:, np.newaxis, np.newaxis]
+
+        self.solver_iterations = iterations
+
+    def _build_islands(self, rows: np.ndarray, cols: np.ndarray) -> None:
+        self.islands = []
+        self._island_groups = []
+        self._use_islands = False
+        if self.constraint_count == 0:
+            return
+
+        # two constraints are connected if they act on the same particle
+        particles = cols // self.dimensions
+        incidence = sparse.csr_matrix((np.ones(len(rows)), (rows, particles)),
+                                      shape=(self.constraint_count, len(self.q) // self.dimensions))
+        island_count, labels = connected_components(incidence.dot(incidence.T), directed=False)
+
+        # constraint rows and jacobian entries of every island
+        counts = np.bincount(labels, minlength=island_count)
+        self.islands = np.split(np.argsort(labels, kind="stable"), np.cumsum(counts)[:-1])
+        entries = np.split(np.argsort(labels[rows], kind="stable"),
+                           np.cumsum(np.bincount(labels[rows], minlength=island_count))[:-1])
+
+        if not self.islands_enabled or self.solver != "direct" or island_count < 2 or counts.max() > ISLAND_SIZE_LIMIT:
+            return
+        self._use_islands = True
+
+        # islands with the same number of constraints and coordinates are solved together
+        groups = {}
+        for island_rows, island_entries in zip(self.islands, entries):
+            columns = np.unique(cols[island_entries])
+            groups.setdefault((len(island_rows), len(columns)), []).append(
+                (island_rows, columns, island_entries,
+                 np.searchsorted(island_rows, rows[island_entries]), np.searchsorted(columns, cols[island_entries])))
+
+        for members in groups.values():
+            chunks = max(1, min(self.threads, len(members)))
+            for chunk in np.array_split(np.arange(len(members)), chunks):
+                chunk_members = [members[m] for m in chunk]
+                self._island_groups.append((
+                    np.stack([member[0] for member in chunk_members]),
+                    np.stack([member[1] for member in chunk_members]),
+                    np.concatenate([member[2] for member in chunk_members]),
+                    np.repeat(np.arange(len(chunk_members)), [len(member[2]) for member in chunk_members]),
+                    np.concatenate([member[3] for member in chunk_members]),
+                    np.concatenate([member[4] for member in chunk_members]),
+                ))
+
+    @property
+    def island_count(self) -> int:
+        return len(self.islands)
+
+    def _solve_island_group(self, group: tuple, forces: np.ndarray) -> float:
+        rows, columns, entries, island, local_rows, local_columns = group
+        count, constraints = rows.shape
+
+        # dense jacobians of all islands in the group, shape (G, C_i, N_i)
+        j = np.zeros((count, constraints, columns.shape[1]), dtype=np.float64)
+        dj = np.zeros_like(j)
+        j[island, local_rows, local_columns] = self._j_values[entries]
+        dj[island, local_rows, local_columns] = self._dj_values[entries]
+
+        jw = j * self.inverse_masses[columns][:, np.newaxis, :]
+        b = - dj @ self.dq[columns] - jw @ self.Q[columns]
+        if self.baumgarte_alpha or self.baumgarte_beta:
+            b -= (self.baumgarte_alpha * self.c[rows] + self.baumgarte_beta * self.dc[rows])[..., np.newaxis]
+
+        a = jw @ j.transpose(0, 2, 1)
+        lagrange_multipliers = np.linalg.solve(a, b)
+        self.lagrange_multipliers[rows] = lagrange_multipliers[..., 0]
+
+        # the islands don't share coordinates, so the forces can be written directly
+        forces[columns] = (j.transpose(0, 2, 1) @ lagrange_multipliers)[..., 0]
+        return float(np.sum((a @ lagrange_multipliers - b) ** 2))
+
+    def _solve_islands(self) -> np.ndarray:
+        forces = np.zeros(len(self.q), dtype=np.float64)
+
+        if self.threads and len(self._island_groups) > 1:
+            # numpy releases the GIL in LAPACK, so the groups can be solved in parallel threads
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads)
+            residuals = list(self._executor.map(lambda group: self._solve_island_group(group, forces),
+                                                self._island_groups))
+        else:
+            residuals = [self._solve_island_group(group, forces) for group in self._island_groups]
+
+        self.solver_iterations = 1
+        self.solver_residual = np.sqrt(sum(residuals))
+        return forces
+
+    def close(self) -> None:
+        # shuts down the thread pool of the island solver, the next threaded solve starts a new one
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception) -> bool:
+        self.close()
+        return False
+
+    def update(self, jacobian: bool = None) -> None:
+        """
+        Refreshes the state vectors and re-evaluates the constraints.
+
+        :param jacobian: also evaluate J, dJ and dC (default: not for the xpbd solver, which only needs C)
+        """
+        if jacobian is None:
+            jacobian = self.solver != "xpbd"
+
+        with self.profiler.phase("constraints.update"):
+            # refresh the state vectors in place
+            system = self.system
+            self.q.reshape((-1, system.dimensions))[...] = system.positions[self.index]
+            self.dq.reshape((-1, system.dimensions))[...] = system.velocities[self.index]
+            self.Q.reshape((-1, system.dimensions))[...] = system.forces[self.index]
+            self.inverse_masses.reshape((-1, system.dimensions))[...] = system.inverse_masses[self.index][:, np.newaxis]
+
+            if self._dirty:
+                self._rebuild()
+            self._forces = None
+
+            if not jacobian:
+                positions = self.q.reshape((-1, system.dimensions))
+                for constraint_type, data, particles, rows in self._groups:
+                    self.c[rows] = constraint_type.value(positions[particles], data)
+                return
+
+            # re-evaluate the jacobian values
+            with self.profiler.phase("constraints.jacobian"):
+                self._j_values[...], self._dj_values[...], self.c[...] = self.evaluate(
+                    self.q.reshape((-1, system.dimensions)), self.dq.reshape((-1, system.dimensions)))
+
+                self._j = self._matrix(self._j_values)
+                self._dj = self._matrix(self._dj_values)
+                self.dc[...] = self._j.dot(self.dq).ravel()
+
+    def evaluate(self, positions: np.ndarray, velocities: np.ndarray) -> tuple:
+        """
+        Evaluates all constraints for local state arrays of shape (..., N, D), the leading axes
+        can be used to evaluate a batch of independent copies of the scene at once.
+
+        :return: (values of J, values of dJ, C) with shapes (..., nnz), (..., nnz), (..., C),
+                 the values belong to the entries of the pattern (rows, cols)
+        """
+        if self._dirty:
+            self._rebuild()
+
+        batch = positions.shape[:-2]
+        j_values = np.zeros(batch + (len(self._rows),), dtype=np.float64)
+        dj_values = np.zeros(batch + (len(self._rows),), dtype=np.float64)
+        c = np.zeros(batch + (self.constraint_count,), dtype=np.float64)
+
+        offset = 0
+        for constraint_type, data, particles, rows in self._groups:
+            group_positions = positions[..., particles, :]
+            j, dj = constraint_type.jacobian(group_positions, velocities[..., particles, :], data)
+            size = int(np.prod(j.shape[len(batch):]))
+            j_values[..., offset:offset + size] = j.reshape(batch + (size,))
+            dj_values[..., offset:offset + size] = dj.reshape(batch + (size,))
+            c[..., rows] = constraint_type.value(group_positions, data)
+            offset += size
+
+        return j_values, dj_values, c
+
+    @property
+    def pattern(self) -> tuple:
+        # row and column of every value returned by evaluate()
+        if self._dirty:
+            self._rebuild()
+        return self._rows, self._cols
+
+    @property
+    def residual(self) -> float:
+        # largest constraint error at the last update
+        return float(np.max(np.abs(self.c))) if self.constraint_count else 0.0
+
+    def _matrix(self, values: np.ndarray):
+        if self.constraint_count <= DENSE_CONSTRAINT_LIMIT:
+            matrix = np.zeros((self.constraint_count, len(self.q)), dtype=np.float64)
+            matrix[self._rows, self._cols] = values
+            return matrix
+        return sparse.csr_matrix((values[self._order], self._indices, self._indptr),
+                                 shape=(self.constraint_count, len(self.q)))
+
+    def _weighted(self, j):
+        # J W
+        if isinstance(j, np.ndarray):
+            return j * self.inverse_masses
+        return j.multiply(self.inverse_masses).tocsr()
+
+    @property
+    def j(self):
+        # jacobi matrix J = δC/δq (sparse, or dense for small systems)
+        return self._j
+
+    @property
+    def dj(self):
+        # derivative of the jacobi matrix
+        return self._dj
+
+    @property
+    def W(self) -> sparse.dia_matrix:
+        # inverse mass matrix
+        return sparse.diags(self.inverse_masses)
+
+    def _lagrange_multipliers(self) -> np.ndarray:
+        j = self.j
+        jw = self._weighted(j)
+        # J W J^T λ = - dJ dq - J W Q
+        a = jw.dot(j.T)
+        b = - self.dj.dot(self.dq).ravel() - jw.dot(self.Q).ravel()
+        if self.baumgarte_alpha or self.baumgarte_beta:
+            b -= self.baumgarte_alpha * self.c + self.baumgarte_beta * self.dc
+
+        self.lagrange_multipliers, self.solver_iterations, self.solver_residual = SOLVERS[self.solver](
+            a, b, self.lagrange_multipliers, self.tolerance, self.max_iterations)
+        return self.lagrange_multipliers
 
     def add_forces(self):
-        j_trans = self.j.T
-        """p1 = self.j.dot(self.W).dot(j_trans)
-        p2 = self.dj.dot(self.dq)
-        p3 = self.j.dot(self.W).dot(self.Q)"""
-        solution_vectors = np.linalg.solve(self.j.dot(self.W).dot(j_trans),
-                                           - self.dj.dot(self.dq) - self.j.dot(self.W).dot(self.Q))
-        constraint = j_trans.dot(solution_vectors)
+        constraint = self.get_forces()
 
         # add forces
-        for c, particle in enumerate(self.scene):
-            """i.force_accumulator_x += constraint[2*c][0]
-            i.force_accumulator_y += constraint[2*c+1][0]"""
-            particle.force_accumulator[0] += constraint[2*c][0]
-            particle.force_accumulator[1] += constraint[2*c+1][0]
+        self.system.forces[self.index] += constraint.reshape((-1, self.dimensions))
 
     def get_forces(self):
-        j_trans = self.j.T
-        solution_vectors = np.linalg.solve(self.j.dot(self.W).dot(j_trans),
-                                           - self.dj.dot(self.dq) - self.j.dot(self.W).dot(self.Q))
-        return j_trans.dot(solution_vectors)
+        if self._dirty:
+            self.update()
+
+        # the constraint forces are only solved once per update
+        if self._forces is None:
+            profiler = self.profiler
+            with profiler.phase("constraints.solve"):
+                if self.constraint_count == 0 or self.solver == "xpbd":
+                    # the xpbd solver works on the positions, see solve_positions()
+                    self._forces = np.zeros((len(self.q), 1), dtype=np.float64)
+                elif self._use_islands:
+                    self._forces = self._solve_islands().reshape((-1, 1))
+                else:
+                    self._forces = self.j.T.dot(self._lagrange_multipliers()).reshape((-1, 1))
+
+            if profiler.enabled:
+                profiler.count("constraints", self.constraint_count)
+                profiler.add("solver_iterations", self.solver_iterations)
+                profiler.count("solver_residual", self.solver_residual)
+                profiler.count("constraint_residual", self.residual)
+        return self._forces
+
+    def _correction(self, right_hand_side: np.ndarray) -> np.ndarray:
+        # minimal (mass weighted) change of the coordinates with J Δ = right_hand_side: Δ = W J^T (J W J^T)^-1 rhs
+        j = self.j
+        jw = self._weighted(j)
+        solve = SOLVERS.get(self.solver, SOLVERS["direct"])
+        solution, _, _ = solve(jw.dot(j.T), right_hand_side, None, self.tolerance, self.max_iterations)
+        return jw.T.dot(solution).reshape((-1, self.dimensions))
+
+    def project(self, iterations: int = 1, velocities: bool = True, tolerance: float = 0.0) -> float:
+        """
+        Post-step projection of the positions (and velocities) back onto the constraints.
+        Call this after each step of the ode solver.
+
+        :param iterations: maximum number of newton iterations for the positions
+        :param velocities: also remove the velocity components that violate dC = J dq = 0
+        :param tolerance: stop iterating when the largest constraint error is below this value
+        :return: largest constraint error after the projection
+        """
+        with self.profiler.phase("constraints.project"):
+            return self._project(iterations, velocities, tolerance)
+
+    def _project(self, iterations: int, velocities: bool, tolerance: float) -> float:
+        self.update(jacobian=True)
+        if self.constraint_count == 0:
+            return 0.0
+
+        for _ in range(iterations):
+            if self.residual <= tolerance:
+                break
+            self.system.positions[self.index] -= self._correction(self.c)
+            self.update(jacobian=True)
+
+        if velocities:
+            self.system.velocities[self.index] -= self._correction(self.dc)
+            self.update(jacobian=True)
+
+        return self.residual
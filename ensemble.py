@@ -0,0 +1,187 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from forces import Gravity, LinearFrictionForce, gravity_masses
+from simulation import Simulation
+
+
+class Ensemble:
+    """
+    Simulates many independent copies (members) of one constrained scene with different
+    initial conditions. The state of all members is stacked into arrays of shape (M, N, D)
+    and the constraint systems of all members are solved with one batched np.linalg.solve.
+
+    :param constraint_manager: ConstraintManager of the base scene, its particles are the simulated particles
+    :param positions: initial positions of all members, shape (M, N, D)
+    :param velocities: initial velocities of all members, shape (M, N, D)
+    :param timestep: timestep of the RK4 integration
+    :param fields: Gravity / LinearFrictionForce objects of the base scene
+    :param add_forces: optional function (positions, velocities, forces) that adds further forces to
+                       the (M, N, D) force array of all members
+    """
+
+    def __init__(self, constraint_manager, positions, velocities, timestep: float, fields=(), add_forces=None):
+        self.manager = constraint_manager
+        self.manager.update()
+        self.dimensions = constraint_manager.dimensions
+        self.timestep = np.float64(timestep)
+        self.tickcounter = 0
+
+        self.positions = np.array(positions, dtype=np.float64)
+        self.velocities = np.array(velocities, dtype=np.float64)
+        if self.positions.shape != self.velocities.shape or self.positions.ndim != 3:
+            raise ValueError("positions and velocities must have the shape (members, particles, dimensions)")
+
+        system, index = constraint_manager.system, constraint_manager.index
+        self.masses = system.masses[index].copy()
+        self.field_masses = gravity_masses(self.masses)
+        self.inverse_masses = system.inverse_masses[index].copy()
+
+        # accelerations and damping of the fields for the local particles
+        particle_count = len(self.masses)
+        self.accelerations = np.zeros((particle_count, self.dimensions), dtype=np.float64)
+        self.damping = np.zeros(particle_count, dtype=np.float64)
+        for field in fields:
+            local = constraint_manager.local_index[np.arange(system.count)[field.index]]
+            local = local[local >= 0]
+            if isinstance(field, Gravity):
+                self.accelerations[local] += field.acceleration()
+            elif isinstance(field, LinearFrictionForce):
+                self.damping[local] += field.strength
+            else:
+                raise TypeError(f"{type(field).__name__} is not supported, use add_forces instead")
+
+        self.add_forces = add_forces
+
+    @property
+    def members(self) -> int:
+        return len(self.positions)
+
+    @property
+    def time(self) -> float:
+        return self.tickcounter * self.timestep
+
+    def _accelerations(self, positions: np.ndarray, velocities: np.ndarray) -> np.ndarray:
+        members, particles, dimensions = positions.shape
+
+        # external forces
+        forces = self.field_masses[:, np.newaxis] * self.accelerations - self.damping[:, np.newaxis] * velocities
+        if self.add_forces is not None:
+            self.add_forces(positions, velocities, forces)
+
+        manager = self.manager
+        if manager.constraint_count:
+            # dense jacobians of all members, shape (M, C, N * D)
+            rows, cols = manager.pattern
+            j_values, dj_values, c = manager.evaluate(positions, velocities)
+            j = np.zeros((members, manager.constraint_count, particles * dimensions), dtype=np.float64)
+            dj = np.zeros_like(j)
+            j[:, rows, cols] = j_values
+            dj[:, rows, cols] = dj_values
+
+            dq = velocities.reshape((members, -1, 1))
+            w = np.repeat(self.inverse_masses, dimensions)
+            jw = j * w
+
+            # J W J^T λ = - dJ dq - J W Q (- α C - β dC)
+            b = - dj @ dq - jw @ forces.reshape((members, -1, 1))
+            if manager.baumgarte_alpha or manager.baumgarte_beta:
+                b -= (manager.baumgarte_alpha * c + manager.baumgarte_beta * (j @ dq)[..., 0])[..., np.newaxis]
+            lagrange_multipliers = np.linalg.solve(jw @ j.transpose(0, 2, 1), b)
+
+            forces += (j.transpose(0, 2, 1) @ lagrange_multipliers).reshape(forces.shape)
+
+        return forces * self.inverse_masses[:, np.newaxis]
+
+    def step(self) -> None:
+        # classic RK4 on the stacked state of all members
+        dt = self.timestep
+        x0, v0 = self.positions, self.velocities
+
+        kx0, kv0 = v0, self._accelerations(x0, v0)
+        kx1 = v0 + 0.5 * dt * kv0
+        kv1 = self._accelerations(x0 + 0.5 * dt * kx0, kx1)
+        kx2 = v0 + 0.5 * dt * kv1
+        kv2 = self._accelerations(x0 + 0.5 * dt * kx1, kx2)
+        kx3 = v0 + dt * kv2
+        kv3 = self._accelerations(x0 + dt * kx2, kx3)
+
+        self.positions = x0 + dt / 6.0 * (kx0 + 2.0 * kx1 + 2.0 * kx2 + kx3)
+        self.velocities = v0 + dt / 6.0 * (kv0 + 2.0 * kv1 + 2.0 * kv2 + kv3)
+        self.tickcounter += 1
+
+    def run(self, steps: int, record_every: int = 1) -> dict:
+        """
+        :return: dict with "time" (T,), "positions" and "velocities" (T, M, N, D)
+        """
+        samples = steps // record_every
+        trajectories = {
+            "time": np.zeros(samples, dtype=np.float64),
+            "positions": np.zeros((samples,) + self.positions.shape, dtype=np.float64),
+            "velocities": np.zeros((samples,) + self.positions.shape, dtype=np.float64),
+        }
+        for step in range(samples * record_every):
+            self.step()
+            if (step + 1) % record_every == 0:
+                sample = (step + 1) // record_every - 1
+                trajectories["time"][sample] = self.time
+                trajectories["positions"][sample] = self.positions
+                trajectories["velocities"][sample] = self.velocities
+        return trajectories
+
+
+def _run_member(arguments: tuple) -> np.ndarray:
+    build_scene, parameter, steps, timestep, record_every = arguments
+    return Simulation(build_scene(parameter), timestep).run(steps, record_every)["positions"]
+
+
+def run_parallel(build_scene, parameters: list, steps: int, timestep: float,
+                 record_every: int = 1, processes: int = None) -> np.ndarray:
+    """
+    Runs one Simulation per parameter in a process pool. Useful for members that can't be
+    batched, e.g. scenes with different constraints or forces.
+
+    :param build_scene: picklable (module level) function parameter -> Scene
+    :param parameters: one parameter (e.g. a perturbation of the initial conditions) per member
+    :return: positions of all members, shape (T, M, N, D)
+    """
+    arguments = [(build_scene, parameter, steps, timestep, record_every) for parameter in parameters]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        positions = list(executor.map(_run_member, arguments))
+    return np.stack(positions, axis=1)
+
+
+def divergence(positions: np.ndarray, reference: int = 0) -> np.ndarray:
+    """
+    Distance in state space of every member to the reference member.
+
+    :param positions: trajectories of shape (T, M, N, D)
+    :return: array of shape (T, M)
+    """
+    difference = positions - positions[:, reference:reference + 1]
+    return np.sqrt(np.sum(difference ** 2, axis=(2, 3)))
+
+
+def lyapunov_exponents(time: np.ndarray, distances: np.ndarray) -> np.ndarray:
+    """
+    Lyapunov-style divergence rate of every member: slope of a least squares fit of log(distance) over time.
+
+    :param time: times of the samples, shape (T,)
+    :param distances: output of divergence(), shape (T, M)
+    :return: array of shape (M,), nan for members without divergence (e.g. the reference)
+    """
+    # a member that blew up (nan / inf) has no meaningful rate, fitting only its finite part would hide that
+    unstable = np.flatnonzero(~np.all(np.isfinite(distances), axis=0))
+    if len(unstable):
+        raise ValueError(f"{len(unstable)} members have non-finite distances (first: {unstable[:10].tolist()}), "
+                         f"reduce the timestep or the perturbation")
+
+    with np.errstate(divide="ignore"):
+        log_distances = np.log(distances)
+
+    exponents = np.full(distances.shape[1], np.nan)
+    for member in range(distances.shape[1]):
+        # samples where the member coincides with the reference (distance 0) have no logarithm
+        valid = distances[:, member] > 0
+        if np.count_nonzero(valid) >= 2:
+            exponents[member] = np.polyfit(time[valid], log_distances[valid, member], 1)[0]
+    return exponents
@@ -1,31 +1,101 @@
 import numpy as np
+from objects import particle_indices
+
+
+def gravity_masses(masses: np.ndarray) -> np.ndarray:
+    # particles with infinite mass (inverse mass 0) are pinned, m g would be infinite and 0 * inf = nan
+    return np.where(np.isfinite(masses), masses, 0.0)
 
 
 class LinearFrictionForce:
-    def __init__(self, scene: list, strength: float, dimensions: int):
+    def __init__(self, scene, strength: float, dimensions: int):
         self.strength = np.float64(strength)
         self.scene = scene
         self.dimension = dimensions
+        self.system, self.index = particle_indices(scene)
 
     def add_forces(self) -> None:
-        for particle in self.scene:
-            for dim in range(self.dimension):
-                particle.force_accumulator[dim] += -self.strength * particle.velocity[dim]
+        self.system.forces[self.index] -= self.strength * self.system.velocities[self.index]
 
 
 class Gravity:
-    def __init__(self, scene: list, strength: float, dimension: int):
+    def __init__(self, scene, strength: float, dimension: int):
         self.strength = np.float64(strength)
         self.scene = scene
         self.dimension = dimension
+        self.system, self.index = particle_indices(scene)
+
+    def acceleration(self) -> np.ndarray:
+        # acceleration vector, e.g. (0, -g) for the y dimension
+        acceleration = np.zeros(self.system.dimensions, dtype=np.float64)
+        acceleration[self.dimension] = -self.strength
+        return acceleration
 
     def add_forces(self) -> None:
-        for i in self.scene:
-            # apply force in the specified dimension, e.g. y dimension
-            i.force_accumulator[self.dimension] += -self.strength * i.mass
+        # apply force in the specified dimension, e.g. y dimension
+        masses = gravity_masses(self.system.masses[self.index])
+        self.system.forces[self.index, self.dimension] -= self.strength * masses
+
+    def potential_energy(self) -> float:
+        system = self.system
+        return self.strength * np.dot(gravity_masses(system.masses[self.index]),
+                                      system.positions[self.index, self.dimension])
+
+
+def _index_key(index) -> tuple:
+    return (index.start, index.stop, index.step) if isinstance(index, slice) else index.tobytes()
+
+
+class ForceRegistry:
+    """
+    Collects the force generators of a scene. Global fields (Gravity, LinearFrictionForce)
+    acting on the same particles are fused into a single pass over the force buffer:
+    F = m g - c v. All other generators (e.g. springs) are called one after another.
+    """
+
+    def __init__(self, system):
+        self.system = system
+        self.forces = []
+        self._fields = None
+        self._others = []
+
+    def add(self, force):
+        self.forces.append(force)
+        self._fields = None
+        return force
+
+    def _fuse(self) -> None:
+        # group the fields by the particles they act on
+        fields = {}
+        self._others = []
+        for force in self.forces:
+            if isinstance(force, (Gravity, LinearFrictionForce)) and force.system is self.system:
+                fields.setdefault(_index_key(force.index), (force.index, []))[1].append(force)
+            else:
+                self._others.append(force)
+        self._fields = list(fields.values())
+
+    def add_forces(self) -> None:
+        if self._fields is None:
+            self._fuse()
+
+        system = self.system
+        for index, fields in self._fields:
+            acceleration = np.zeros(system.dimensions, dtype=np.float64)
+            damping = 0.0
+            for field in fields:
+                if isinstance(field, Gravity):
+                    acceleration += field.acceleration()
+                else:
+                    damping += field.strength
+
+            forces = gravity_masses(system.masses[index])[:, np.newaxis] * acceleration
+            if damping:
+                forces -= damping * system.velocities[index]
+            system.forces[index] += forces
+
+        for force in self._others:
+            force.add_forces()
 
     def potential_energy(self) -> float:
-        potential_energy = 0
-        for i in self.scene:
-            potential_energy += i.mass * self.strength * i.position[self.dimension]
-        return potential_energy
+        return sum(force.potential_energy() for force in self.forces if hasattr(force, "potential_energy"))
@@ -1,16 +1,14 @@
 import pygame
-import time, os
+import sys, time, os
 
-from ode_solvers import rk4
-from objects import Object, Spring, Spring_to_mouse, coords_to_pygame
+from objects import Particle, ParticleSystem, Spring, Spring_to_mouse, pygame_to_coords, particle_indices
+from collisions import SpatialHash
 from constraints import ConstraintManager
-from ode_solvers.rk4 import rk4
-
-pygame.init()
+from ode_solvers.rk4 import runge_kutta_4th_order
+from simulation import Scene, Simulation
+from profiler import Profiler
 
 WIDTH, HEIGHT = 1600, 800
-WIN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption(os.path.basename(__file__))
 
 WHITE = (255, 255, 255)
 YELLOW = (255, 255, 0)
@@ -18,42 +16,34 @@ BLUE = (100, 149, 237)
 RED = (188, 39, 50)
 DARK_GREY = (80, 78, 81)
 
-FONT = pygame.font.SysFont("DejaVu Sans", 20)
-
 FRAMERATE = 60  # framerate * tickrate
 TIMESTEP = 1 / FRAMERATE  # 1 / (FRAMERATE / 60)
+DIMENSIONS = 2
+ZOOM = 1
 
 
-def main():
-    run = True
-    clock = pygame.time.Clock()
-    tickcounter = 0
+def create_scene(system: ParticleSystem = None):
+    """
+    Creates two particles on rails, connected by a spring.
 
-    p1 = Object(0, 100, 10, BLUE, 10, TIMESTEP)
-    p1.x_vel = 0
-    p1.y_vel = 0
+    :return: (Scene for the Simulation runner, list of particles and springs, constraint manager)
+    """
+    system = ParticleSystem(DIMENSIONS) if system is None else system
 
-    p2 = Object(200, 200, 10, RED, 10, TIMESTEP)
-    p2.y_vel = 0
-    p2.y_vel = 0
+    p1 = Particle([0, 40], 10, DIMENSIONS, ZOOM, TIMESTEP, 10, BLUE, system=system)
+    p2 = Particle([200, 200], 10, DIMENSIONS, ZOOM, TIMESTEP, 10, RED, system=system)
 
     spring = Spring(p1, p2, length=30, k=5)
 
     scene = [p1, p2, spring]
 
-    # remove all objects of type spring from scene
-    scene_without_springs = [i for i in scene if not isinstance(i, Spring)]
-
     # particles/objects used for the constraints
     constraints_scene = [p1, p2]
 
     # import/create constraints
-    constraint_manager = ConstraintManager(constraints_scene)
-
-    # control time
-    start_time = time.time()
-    energy_diff = 0
-    last_energy = p1.energy() + p2.energy() + spring.energy()
+    constraint_manager = ConstraintManager(constraints_scene, DIMENSIONS)
+    constraint_manager.rail_constraint(p1, '40 * cos((1/40)*x)')
+    constraint_manager.rail_constraint(p2, 'x')
 
     def add_forces():
 
@@ -65,11 +55,38 @@ def main():
 
         # calculate the constraint forces to the regular forces
         # to satisfy the constraints
-        constraint_manager.update(constraints_scene)
-        constraint_manager.rail_constraint(p1, '40 * cos((1/40)*x)')
-        constraint_manager.rail_constraint(p2, 'x')
+        constraint_manager.update()
         constraint_manager.add_forces()
 
+    def energy() -> float:
+        return p1.energy() + p2.energy() + spring.energy()
+
+    return Scene(constraints_scene, add_forces, energy=energy), scene, constraint_manager
+
+
+def main():
+    pygame.init()
+    WIN = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption(os.path.basename(__file__))
+    FONT = pygame.font.SysFont("DejaVu Sans", 20)
+
+    run = True
+    clock = pygame.time.Clock()
+
+    simulation_scene, scene, constraint_manager = create_scene()
+
+    # timing of the phases of every frame, shown in the top left corner
+    profiler = Profiler(TIMESTEP, history=10 * FRAMERATE)
+    constraint_manager.profiler = profiler
+    add_forces = profiler.timed("forces", simulation_scene.add_forces)
+
+    # grid for finding the particle closest to the mouse
+    system, index = particle_indices(simulation_scene.particles)
+    grid = SpatialHash(cell_size=50)
+
+    energy_diff = 0
+    last_energy = simulation_scene.energy()
+
     mouse_down = False
 
     while run:
@@ -86,7 +103,8 @@ def main():
 
                 # create a spring between the mouse and the closest particle
                 mouse_pos = pygame.mouse.get_pos()
-                closest_particle = min(scene_without_springs, key=lambda x: x.distance(coords_to_pygame(mouse_pos)))
+                grid.build(system.positions[index])
+                closest_particle = simulation_scene.particles[grid.nearest(pygame_to_coords(mouse_pos))]
                 spring_mouse = Spring_to_mouse(closest_particle, 1, 20, mouse_pos[0], mouse_pos[1])
                 scene.append(spring_mouse)
 
@@ -98,36 +116,32 @@ def main():
 
             if event.type == pygame.MOUSEBUTTONUP:
                 # remove all Spring_to_mouse objects from scene
-                scene = [i for i in scene if not isinstance(i, Spring_to_mouse)]
-
+                mouse_down = False
+                scene[:] = [i for i in scene if not isinstance(i, Spring_to_mouse)]
 
         # update positions
-        rk4([p1, p2], add_forces)
-        #ode_solvers.velocity_verlet([p1, p2], add_forces)
+        with profiler.phase("integrate"):
+            runge_kutta_4th_order(simulation_scene.particles, add_forces)
 
         # drawing
-        for i in scene:
-            i.draw(WIN)
+        with profiler.phase("draw"):
+            for i in scene:
+                i.draw(WIN)
 
         # total energy in scene
-
-        total_energy = p1.energy() + p2.energy() + spring.energy()
+        total_energy = simulation_scene.energy()
         energy_diff += abs(total_energy - last_energy)
         last_energy = total_energy
 
-        if round(tickcounter * TIMESTEP, 2) == 10:
+        if round(profiler.steps * TIMESTEP, 2) == 10:
             print(f"Numerical error (accumulated): {energy_diff}")
 
         # status text
-        tickcounter += 1
-        status_text_rt = FONT.render(f"Realtime    : {round(time.time() - start_time, 2)}", 1, WHITE)
-        status_text_pt = FONT.render(f"Program Time: {round(tickcounter * TIMESTEP, 2)}", 1, WHITE)
-        energy_text = FONT.render(f"Total system energy: {total_energy}", 1, WHITE)
-        energy_diff_text = FONT.render(f"Numerical error (accumulated): {round(energy_diff , 5)}", 1, WHITE)
-        WIN.blit(status_text_rt, (0, 0))
-        WIN.blit(status_text_pt, (0, 20))
-        WIN.blit(energy_text, (0, 40))
-        WIN.blit(energy_diff_text, (0, 60))
+        profiler.draw(WIN, FONT, extra=[
+            f"Total system energy: {total_energy}",
+            f"Numerical error (accumulated): {round(energy_diff , 5)}",
+        ])
+        profiler.end_step()
 
         pygame.display.update()
 
@@ -135,4 +149,11 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--headless" in sys.argv:
+        start = time.time()
+        scene, _, _ = create_scene()
+        trajectories = Simulation(scene, TIMESTEP).run(10 * FRAMERATE)
+        print(f"Simulated {len(trajectories['time'])} steps in {round(time.time() - start, 2)}s, "
+              f"energy: {round(trajectories['energy'][0], 3)} -> {round(trajectories['energy'][-1], 3)}")
+    else:
+        main()
@@ -0,0 +1,66 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+
+def direct(a: sparse.spmatrix, b: np.ndarray, x0: np.ndarray = None,
+           tolerance: float = 1e-10, max_iterations: int = 100) -> tuple:
+    """
+    Direct solve of a x = b (sparse or dense).
+
+    :return: (x, iterations, residual norm)
+    """
+    if isinstance(a, np.ndarray):
+        x = np.linalg.solve(a, b)
+    else:
+        x = spsolve(sparse.csc_matrix(a), b)
+    return x, 1, np.linalg.norm(a.dot(x) - b)
+
+
+def conjugate_gradient(a: sparse.spmatrix, b: np.ndarray, x0: np.ndarray = None,
+                       tolerance: float = 1e-10, max_iterations: int = 100) -> tuple:
+    """
+    Jacobi preconditioned conjugate gradient method for a symmetric positive definite matrix a.
+    Iterates until |a x - b| <= tolerance * |b| or max_iterations is reached.
+
+    :return: (x, iterations, residual norm)
+    """
+    x = np.zeros_like(b) if x0 is None else x0.copy()
+    diagonal = a.diagonal()
+    inverse_diagonal = np.divide(1.0, diagonal, out=np.ones_like(diagonal), where=diagonal != 0)
+
+    r = b - a.dot(x)
+    threshold = tolerance * max(np.linalg.norm(b), 1e-300)
+    residual = np.linalg.norm(r)
+    if residual <= threshold:
+        return x, 0, residual
+
+    z = inverse_diagonal * r
+    p = z.copy()
+    rz = r.dot(z)
+
+    iterations = 0
+    while iterations < max_iterations:
+        iterations += 1
+        ap = a.dot(p)
+        alpha = rz / p.dot(ap)
+        x += alpha * p
+        r -= alpha * ap
+
+        residual = np.linalg.norm(r)
+        if residual <= threshold:
+            break
+
+        z = inverse_diagonal * r
+        rz_new = r.dot(z)
+        p *= rz_new / rz
+        p += z
+        rz = rz_new
+
+    return x, iterations, residual
+
+
+SOLVERS = {
+    "direct": direct,
+    "cg": conjugate_gradient,
+}
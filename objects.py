@@ -1,7 +1,8 @@
 import pygame
-import math
+import math, weakref
 import numpy as np
 from numpy import float64
+from scipy import sparse
 
 WHITE = (255, 255, 255)
 
@@ -10,39 +11,314 @@ def coords_to_pygame(coords: tuple) -> tuple:
     return coords[0] + 400, -coords[1] + 400
 
 
+def coords_to_pygame_array(coords: np.ndarray) -> np.ndarray:
+    # coords_to_pygame for an array of points with shape (n, 2)
+    points = np.empty((len(coords), 2), dtype=float64)
+    points[:, 0] = coords[:, 0] + 400
+    points[:, 1] = 400 - coords[:, 1]
+    return points
+
+
+def pygame_to_coords(coords: tuple) -> tuple:
+    return coords[0] - 400, -(coords[1] - 400)
+
+
+class ParticleSystem:
+    """
+    Struct-of-arrays storage for the state of many particles.
+
+    Positions, velocities, forces, masses, inverse masses and radii of all particles live in
+    contiguous float64 arrays of shape (N, D) and (N,). Particle objects are only views
+    (index + back-reference) into this storage, so solvers, forces and constraints can
+    work on whole arrays at once.
+    """
+
+    # the particles keep their system alive, a default system is dropped with the last of its particles
+    _default_systems = weakref.WeakValueDictionary()
+
+    def __init__(self, dimensions: int, capacity: int = 16):
+        self.dimensions = dimensions
+        self.count = 0
+
+        capacity = max(capacity, 1)
+        self._positions = np.zeros((capacity, dimensions), dtype=float64)
+        self._velocities = np.zeros((capacity, dimensions), dtype=float64)
+        self._previous_positions = np.zeros((capacity, dimensions), dtype=float64)
+        self._forces = np.zeros((capacity, dimensions), dtype=float64)
+        self._masses = np.zeros(capacity, dtype=float64)
+        self._inverse_masses = np.zeros(capacity, dtype=float64)
+        self._radii = np.zeros(capacity, dtype=float64)
+
+    @classmethod
+    def default(cls, dimensions: int) -> "ParticleSystem":
+        # shared system for particles that are created without an explicit system, scenes should pass their own
+        system = cls._default_systems.get(dimensions)
+        if system is None:
+            system = cls._default_systems[dimensions] = cls(dimensions)
+        return system
+
+    # views on the used part of the storage arrays
+    @property
+    def positions(self) -> np.ndarray:
+        return self._positions[:self.count]
+
+    @property
+    def velocities(self) -> np.ndarray:
+        return self._velocities[:self.count]
+
+    @property
+    def previous_positions(self) -> np.ndarray:
+        return self._previous_positions[:self.count]
+
+    @property
+    def forces(self) -> np.ndarray:
+        return self._forces[:self.count]
+
+    @property
+    def masses(self) -> np.ndarray:
+        return self._masses[:self.count]
+
+    @property
+    def inverse_masses(self) -> np.ndarray:
+        return self._inverse_masses[:self.count]
+
+    @property
+    def radii(self) -> np.ndarray:
+        return self._radii[:self.count]
+
+    def _grow(self, capacity: int) -> None:
+        for name in ("_positions", "_velocities", "_previous_positions", "_forces", "_masses", "_inverse_masses",
+                     "_radii"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=float64)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add(self, positions, masses, velocities=None, radii=0.0) -> np.ndarray:
+        """
+        Adds particles to the system without creating Particle objects.
+
+        :param positions: array of shape (n, D)
+        :param masses: array of shape (n,) or a single mass for all particles
+        :param velocities: optional array of shape (n, D), defaults to 0
+        :param radii: array of shape (n,) or a single radius for all particles (used for collisions)
+        :return: indices of the new particles
+        """
+        positions = np.asarray(positions, dtype=float64).reshape(-1, self.dimensions)
+        n = len(positions)
+        if self.count + n > len(self._masses):
+            self._grow(max(2 * len(self._masses), self.count + n))
+
+        index = np.arange(self.count, self.count + n)
+        self.count += n
+
+        self._positions[index] = positions
+        self._previous_positions[index] = positions
+        self._velocities[index] = 0 if velocities is None else velocities
+        self._forces[index] = 0
+        self._radii[index] = radii
+        self.set_masses(index, masses)
+        return index
+
+    def set_masses(self, index, masses) -> None:
+        masses = np.asarray(masses, dtype=float64)
+        self._masses[index] = masses
+        # a particle with infinite mass has an inverse mass of 0 and is not moved by forces
+        with np.errstate(divide="ignore"):
+            self._inverse_masses[index] = 1 / masses
+
+    def particle(self, index: int, zoom: int = 1, timestep: float = 0.0, radius: float = None,
+                 color: tuple = WHITE) -> "Particle":
+        # create a Particle view for an already existing particle (keeps its radius if none is given)
+        particle = Particle.__new__(Particle)
+        particle._init_view(self, index, zoom, timestep, radius, color)
+        return particle
+
+    def clear_forces(self, index=slice(None)) -> None:
+        self.forces[index] = 0
+
+
+def particle_indices(scene):
+    """
+    Resolves a scene into the particle system and the indices of the particles in it.
+
+    :param scene: list of particles sharing one ParticleSystem, a ParticleSystem (all particles)
+                  or a tuple (system, indices) for particles without Particle objects
+    :return: (system, index) where index is a slice if the particles are contiguous,
+             otherwise an integer array
+    """
+    if isinstance(scene, ParticleSystem):
+        return scene, slice(0, scene.count)
+
+    if isinstance(scene, tuple) and len(scene) == 2 and isinstance(scene[0], ParticleSystem):
+        system, index = scene
+        if isinstance(index, slice):
+            return system, slice(*index.indices(system.count))
+        index = np.asarray(index, dtype=np.intp).ravel()
+    else:
+        system = scene[0].system
+        if any(particle.system is not system for particle in scene):
+            raise ValueError("all particles of a scene have to belong to the same ParticleSystem")
+        index = np.fromiter((particle.index for particle in scene), dtype=np.intp, count=len(scene))
+
+    if len(index) and np.all(np.diff(index) == 1):
+        return system, slice(int(index[0]), int(index[-1]) + 1)
+    return system, index
+
+
+def integrator_cache(integrator_type):
+    """
+    Cache of the integrators behind the solver functions that are called with a list of particles
+    every frame (e.g. runge_kutta_4th_order), so the buffers of an integrator are created only once.
+    The integrators are weakly keyed by the first particle of the list, so they (and the ParticleSystem
+    they reference) are dropped together with the particles of a scene.
+
+    :param integrator_type: integrator class, constructed with (particles, timestep)
+    :return: function particles -> integrator
+    """
+    integrators = weakref.WeakKeyDictionary()
+
+    def integrator_for(particles):
+        system, index = particle_indices(particles)
+        key = (particles[0].timestep, (index.start, index.stop) if isinstance(index, slice) else index.tobytes())
+
+        cache = integrators.setdefault(particles[0], {})
+        integrator = cache.get(key)
+        if integrator is None or integrator.system is not system:
+            integrator = cache[key] = integrator_type(particles, particles[0].timestep)
+        return integrator
+
+    return integrator_for
+
+
+class Trail:
+    """
+    Fixed-capacity ring buffer of the past positions of a particle.
+
+    :param capacity: maximum number of stored points, the oldest points are overwritten
+    :param dimensions: dimensions of the points
+    :param every: only every k-th appended point is stored
+    :param min_distance: points closer than this to the last stored point are skipped
+    """
+
+    def __init__(self, capacity: int = 500, dimensions: int = 2, every: int = 1, min_distance: float = 0.0):
+        self.points_buffer = np.zeros((capacity, dimensions), dtype=float64)
+        self.capacity = capacity
+        self.every = every
+        self.min_distance = min_distance
+        self.length = 0
+        self.head = 0       # index of the next point to write
+        self.appended = 0   # number of append calls, used for decimation
+
+    def __len__(self) -> int:
+        return self.length
+
+    def append(self, point) -> None:
+        self.appended += 1
+        if (self.appended - 1) % self.every:
+            return
+
+        if self.min_distance and self.length:
+            last = self.points_buffer[self.head - 1]
+            if np.sum((last - point) ** 2) < self.min_distance ** 2:
+                return
+
+        self.points_buffer[self.head] = point
+        self.head = (self.head + 1) % self.capacity
+        self.length = min(self.length + 1, self.capacity)
+
+    def clear(self) -> None:
+        self.length = 0
+        self.head = 0
+        self.appended = 0
+
+    def points(self) -> np.ndarray:
+        # stored points from the oldest to the newest
+        if self.length < self.capacity:
+            return self.points_buffer[:self.length]
+        return np.concatenate((self.points_buffer[self.head:], self.points_buffer[:self.head]))
+
+
+def _as_indices(particles) -> np.ndarray:
+    # Particle objects or indices into the particle system to an index array
+    if isinstance(particles, np.ndarray):
+        return particles.astype(np.intp)
+    return np.array([particle.index if isinstance(particle, Particle) else particle for particle in particles],
+                    dtype=np.intp)
+
+
 class Particle:
     def __init__(self, position: list, mass: float, dimensions: int, zoom: int,
-                 timestep: float, radius: float, color: tuple):
+                 timestep: float, radius: float, color: tuple, system: ParticleSystem = None,
+                 trail_length: int = 500, trail_every: int = 1):
 
-        self.position = np.array(position, dtype=float64)
-        self.velocity = np.array(dimensions * [0], dtype=float64)           # initializing all velocities to 0
-        self.previous_position = np.array(position, dtype=float64)
-        self.mass = np.float64(mass)
-        self.force_accumulator = np.array(dimensions * [0], dtype=float64)  # initializing all forces to 0
+        if system is None:
+            system = ParticleSystem.default(dimensions)
+
+        index = int(system.add([position], [mass])[0])
+        self._init_view(system, index, zoom, timestep, radius, color, trail_length, trail_every)
+
+    def _init_view(self, system: ParticleSystem, index: int, zoom: int, timestep: float,
+                   radius: float, color: tuple, trail_length: int = 500, trail_every: int = 1) -> None:
+        self.system = system
+        self.index = index
         self.timestep = np.float64(timestep)
-        self.dimensions = dimensions
+        self.dimensions = system.dimensions
 
-        self.radius = radius
+        if radius is not None:
+            self.radius = radius
         self.color = color
-        self.trail = []
+        self.trail = Trail(trail_length, system.dimensions, trail_every)
         self.ZOOM = zoom
 
-        """self.x = x
-        self.y = y
-        self.x_vel = 0
-        self.y_vel = 0
+    # state of the particle, these are views into the arrays of the particle system
+    @property
+    def position(self) -> np.ndarray:
+        return self.system.positions[self.index]
 
-        self.prev_x = x
-        self.prev_y = y
+    @position.setter
+    def position(self, value) -> None:
+        self.system.positions[self.index] = value
 
-        self.mass = mass
-        self.force_accumulator_x = 0
-        self.force_accumulator_y = 0
-        self.timestep = timestep
+    @property
+    def velocity(self) -> np.ndarray:
+        return self.system.velocities[self.index]
 
-        self.radius = radius
-        self.color = color
-        self.trail = []"""
+    @velocity.setter
+    def velocity(self, value) -> None:
+        self.system.velocities[self.index] = value
+
+    @property
+    def previous_position(self) -> np.ndarray:
+        return self.system.previous_positions[self.index]
+
+    @previous_position.setter
+    def previous_position(self, value) -> None:
+        self.system.previous_positions[self.index] = value
+
+    @property
+    def force_accumulator(self) -> np.ndarray:
+        return self.system.forces[self.index]
+
+    @force_accumulator.setter
+    def force_accumulator(self, value) -> None:
+        self.system.forces[self.index] = value
+
+    @property
+    def radius(self) -> float64:
+        return self.system.radii[self.index]
+
+    @radius.setter
+    def radius(self, value: float) -> None:
+        self.system.radii[self.index] = value
+
+    @property
+    def mass(self) -> float64:
+        return self.system.masses[self.index]
+
+    @mass.setter
+    def mass(self, value: float) -> None:
+        self.system.set_masses(self.index, value)
 
     def distance(self, tuple_coords: tuple) -> float:
         temporary_sum = 0
@@ -55,11 +331,7 @@ class Particle:
         if trail:
             # trail of object
             if len(self.trail) > 2:
-                updated_points = []
-                for point in self.trail:
-                    x, y = point[0], point[1]
-                    updated_points.append(coords_to_pygame((self.ZOOM * x, self.ZOOM * y)))
-
+                updated_points = coords_to_pygame_array(self.ZOOM * self.trail.points())
                 pygame.draw.lines(win, self.color, False, updated_points, 2)
 
         pygame.draw.circle(win, self.color, coords_to_pygame((self.ZOOM * self.position[0], self.ZOOM * self.position[1])), self.ZOOM * self.radius)
@@ -68,7 +340,7 @@ class Particle:
         current_velocity = self.velocity
         self.position += current_velocity * self.timestep
         self.velocity += self.force_accumulator / self.mass * self.timestep
-        self.trail.append((self.x, self.y))
+        self.trail.append(self.position)
         self.force_accumulator = np.array([0, 0])
         """x_vel = self.x_vel
         y_vel = self.y_vel
@@ -83,7 +355,7 @@ class Particle:
     def semi_implicit_euler(self):
         self.position += self.velocity * self.timestep
         self.velocity += (self.force_accumulator / self.mass) * self.timestep
-        self.trail.append((self.position[0], self.position[1]))
+        self.trail.append(self.position)
         self.force_accumulator = np.array([0, 0])
         """self.x += self.x_vel * self.timestep
         self.y += self.y_vel * self.timestep
@@ -96,47 +368,35 @@ class Particle:
 
     def verlet(self):
         dt = self.timestep
+        acceleration = self.force_accumulator / self.mass
 
-        temp_x = self.x
-        temp_y = self.y
-
-        self.x = 2 * self.x - self.prev_x + (self.force_accumulator_x / self.mass) * (dt ** 2)
-        self.y = 2 * self.y - self.prev_y + (self.force_accumulator_y / self.mass) * (dt ** 2)
+        temp_position = self.position.copy()
+        self.position = 2 * self.position - self.previous_position + acceleration * (dt ** 2)
+        self.previous_position = temp_position
 
-        self.prev_x = temp_x
-        self.prev_y = temp_y
+        self.velocity += acceleration * dt
 
-        self.x_vel += (self.force_accumulator_x / self.mass) * dt
-        self.y_vel += (self.force_accumulator_y / self.mass) * dt
-
-        self.trail.append((self.x, self.y))
-        self.force_accumulator_x = 0
-        self.force_accumulator_y = 0
+        self.trail.append(self.position)
+        self.force_accumulator = 0
 
     def velocity_verlet_1(self):
         dt = self.timestep
+        acceleration = self.force_accumulator / self.mass
 
-        self.x += self.x_vel * dt + 0.5 * (self.force_accumulator_x / self.mass) * (dt ** 2)
-        self.y += self.y_vel * dt + 0.5 * (self.force_accumulator_y / self.mass) * (dt ** 2)
+        self.position += self.velocity * dt + 0.5 * acceleration * (dt ** 2)
+        velocity = self.velocity + 0.5 * acceleration * dt
 
-        v_x = self.x_vel + 0.5 * (self.force_accumulator_x / self.mass) * dt
-        v_y = self.y_vel + 0.5 * (self.force_accumulator_y / self.mass) * dt
+        self.force_accumulator = 0
 
-        self.force_accumulator_x = 0
-        self.force_accumulator_y = 0
+        return velocity
 
-        return [v_x, v_y]
-
-    def velocity_verlet_2(self, velocities):
+    def velocity_verlet_2(self, velocity):
         dt = self.timestep
 
-        new_a_x = self.force_accumulator_x / self.mass
-        new_a_y = self.force_accumulator_y / self.mass
-
-        self.x_vel = velocities[0] + 0.5 * new_a_x * dt
-        self.y_vel = velocities[1] + 0.5 * new_a_y * dt
+        new_acceleration = self.force_accumulator / self.mass
+        self.velocity = velocity + 0.5 * new_acceleration * dt
 
-        self.trail.append((self.x, self.y))
+        self.trail.append(self.position)
 
     def energy(self) -> float:
         return 0.5 * self.mass * np.linalg.norm(self.velocity) ** 2
@@ -188,6 +448,123 @@ class Spring:
         return 0.5 * self.k * (distance - self.length) ** 2
 
 
+class SpringNetwork:
+    """
+    Many springs between the particles of one ParticleSystem, stored as index arrays.
+    All spring forces are calculated in one numpy pass.
+
+    Every spring can have a damping coefficient c, which damps the relative velocity of its
+    particles along the spring: F = - c ((v1 - v2) · u) u.
+    """
+
+    def __init__(self, system: ParticleSystem, particles1=(), particles2=(), lengths=(), k=(), damping=0.0):
+        self.system = system
+        self.particles1 = np.zeros(0, dtype=np.intp)
+        self.particles2 = np.zeros(0, dtype=np.intp)
+        self.lengths = np.zeros(0, dtype=float64)
+        self.k = np.zeros(0, dtype=float64)
+        self.damping = np.zeros(0, dtype=float64)
+        self.add(particles1, particles2, lengths, k, damping)
+
+    def add(self, particles1, particles2, lengths, k, damping=0.0) -> None:
+        """
+        Adds springs to the network. Particles can be given as Particle objects or as indices.
+        lengths, k and damping can be single values for all new springs.
+        """
+        particles1 = _as_indices(particles1)
+        particles2 = _as_indices(particles2)
+        count = len(particles1)
+
+        self.particles1 = np.concatenate((self.particles1, particles1))
+        self.particles2 = np.concatenate((self.particles2, particles2))
+        self.lengths = np.concatenate((self.lengths, np.broadcast_to(np.asarray(lengths, dtype=float64), count)))
+        self.k = np.concatenate((self.k, np.broadcast_to(np.asarray(k, dtype=float64), count)))
+        self.damping = np.concatenate((self.damping, np.broadcast_to(np.asarray(damping, dtype=float64), count)))
+
+    def __len__(self) -> int:
+        return len(self.k)
+
+    def _distances(self) -> tuple:
+        positions = self.system.positions
+        d = positions[self.particles1] - positions[self.particles2]
+        distance = np.sqrt(np.einsum("ij,ij->i", d, d))
+        return d, distance
+
+    def _directions(self, d: np.ndarray, distance: np.ndarray) -> np.ndarray:
+        # unit vectors u = d / |d| (0 for springs of length 0)
+        return np.divide(d, distance[:, np.newaxis], out=np.zeros_like(d), where=distance[:, np.newaxis] > 0)
+
+    def calc_forces(self) -> np.ndarray:
+        # force on the first particle of every spring: k (l - |d|) d / |d|
+        d, distance = self._distances()
+        magnitude = self.k * (self.lengths - distance)
+        np.divide(magnitude, distance, out=magnitude, where=distance > 0)
+        forces = d * magnitude[:, np.newaxis]
+
+        if np.any(self.damping):
+            # - c ((v1 - v2) · u) u
+            u = self._directions(d, distance)
+            velocities = self.system.velocities
+            dv = velocities[self.particles1] - velocities[self.particles2]
+            forces -= (self.damping * np.einsum("ij,ij->i", dv, u))[:, np.newaxis] * u
+        return forces
+
+    def add_forces(self) -> None:
+        forces = self.system.forces
+        spring_forces = self.calc_forces()
+
+        for dim in range(self.system.dimensions):
+            forces[:, dim] += (np.bincount(self.particles1, spring_forces[:, dim], minlength=len(forces))
+                               - np.bincount(self.particles2, spring_forces[:, dim], minlength=len(forces)))
+
+    def _assemble(self, blocks: np.ndarray) -> sparse.csr_matrix:
+        # sparse (n D, n D) matrix from the (S, D, D) block of the first particle of every spring,
+        # the block is +block on the diagonal and -block off the diagonal of the spring
+        dimensions = self.system.dimensions
+        size = self.system.count * dimensions
+        offsets = np.arange(dimensions)
+        rows1 = (self.particles1[:, np.newaxis] * dimensions + offsets)[:, :, np.newaxis]
+        rows2 = (self.particles2[:, np.newaxis] * dimensions + offsets)[:, :, np.newaxis]
+        cols1, cols2 = rows1.transpose(0, 2, 1), rows2.transpose(0, 2, 1)
+        shape = blocks.shape
+
+        rows = np.concatenate([np.broadcast_to(r, shape).ravel() for r in (rows1, rows1, rows2, rows2)])
+        cols = np.concatenate([np.broadcast_to(c, shape).ravel() for c in (cols1, cols2, cols1, cols2)])
+        values = np.concatenate((blocks.ravel(), -blocks.ravel(), -blocks.ravel(), blocks.ravel()))
+        return sparse.csr_matrix((values, (rows, cols)), shape=(size, size))
+
+    def jacobians(self) -> tuple:
+        """
+        Derivatives of the spring forces with respect to the positions and velocities of all particles
+        of the system. The part of the stiffness matrix orthogonal to a spring is dropped for compressed
+        springs, so both matrices are negative semi definite (the implicit system stays solvable with CG).
+
+        :return: (∂F/∂x, ∂F/∂v) as sparse (n D, n D) matrices
+        """
+        d, distance = self._distances()
+        u = self._directions(d, distance)
+        outer = u[:, :, np.newaxis] * u[:, np.newaxis, :]
+        identity = np.eye(self.system.dimensions)
+
+        # ∂F1/∂x1 = - k (u u^T + max(0, 1 - l / |d|) (I - u u^T))
+        ratio = np.divide(self.lengths, distance, out=np.ones_like(distance), where=distance > 0)
+        transverse = np.maximum(0.0, 1.0 - ratio)[:, np.newaxis, np.newaxis]
+        stiffness = - self.k[:, np.newaxis, np.newaxis] * (outer + transverse * (identity - outer))
+
+        # ∂F1/∂v1 = - c u u^T
+        damping = - self.damping[:, np.newaxis, np.newaxis] * outer
+        return self._assemble(stiffness), self._assemble(damping)
+
+    def energy(self) -> float:
+        _, distance = self._distances()
+        return 0.5 * np.sum(self.k * (distance - self.lengths) ** 2)
+
+    def draw(self, win, zoom: int = 1):
+        positions = self.system.positions
+        for p1, p2 in zip(positions[self.particles1], positions[self.particles2]):
+            pygame.draw.line(win, WHITE, coords_to_pygame(zoom * p1), coords_to_pygame(zoom * p2), 2)
+
+
 class Spring_to_mouse:
     def __init__(self, p1, length, k, mouse_x, mouse_y):
         self.p1 = p1
@@ -197,27 +574,23 @@ class Spring_to_mouse:
         self.mouse_y = mouse_y
 
     def draw(self, win):
-        pygame.draw.line(win, WHITE, coords_to_pygame([self.p1.x, self.p1.y]), [self.mouse_x, self.mouse_y], 2)
+        pygame.draw.line(win, WHITE, coords_to_pygame(self.p1.position), [self.mouse_x, self.mouse_y], 2)
 
-    def add_forces(self):
-        p1x, p1y = coords_to_pygame([self.p1.x, self.p1.y])
-        distance_x = p1x - self.mouse_x
-        distance_y = p1y - self.mouse_y
-        distance = math.sqrt(distance_x ** 2 + distance_y ** 2)
+    def _distance(self) -> tuple:
+        # the mouse position is in pygame coordinates
+        mouse = pygame_to_coords((self.mouse_x, self.mouse_y))
+        distance_x = self.p1.position[0] - mouse[0]
+        distance_y = self.p1.position[1] - mouse[1]
+        return distance_x, distance_y, math.sqrt(distance_x ** 2 + distance_y ** 2)
 
-        force = (self.k * (self.length - distance))
-        theta = math.atan2(distance_y, distance_x)
-        force_x = math.cos(theta) * force
-        force_y = math.sin(theta) * force
+    def add_forces(self):
+        force_x, force_y = self.calc_force()
 
-        self.p1.force_accumulator_x += force_x
-        self.p1.force_accumulator_y += force_y
+        self.p1.force_accumulator[0] += force_x
+        self.p1.force_accumulator[1] += force_y
 
     def calc_force(self):
-        p1x, p1y = coords_to_pygame([self.p1.x, self.p1.y])
-        distance_x = p1x - self.mouse_x
-        distance_y = p1y - self.mouse_y
-        distance = math.sqrt(distance_x ** 2 + distance_y ** 2)
+        distance_x, distance_y, distance = self._distance()
 
         force = (self.k * (self.length - distance))
         theta = math.atan2(distance_y, distance_x)
@@ -227,10 +600,5 @@ class Spring_to_mouse:
         return [force_x, force_y]
 
     def energy(self):
-        p1x, p1y = coords_to_pygame([self.p1.x, self.p1.y])
-
-        # calculate the distance between the two objects
-        distance_x = p1x - self.mouse_x
-        distance_y = p1y - self.mouse_y
-        distance = math.sqrt(distance_x ** 2 + distance_y ** 2)
-        return 0.5 * self.k * (distance - self.length) ** 2
\ No newline at end of file
+        _, _, distance = self._distance()
+        return 0.5 * self.k * (distance - self.length) ** 2
@@ -0,0 +1,189 @@
+import numpy as np
+from objects import particle_indices
+
+# butcher tableau of the Dormand-Prince 5(4) method, the forces don't depend on the time so the nodes c aren't needed.
+# The last row holds the 5th order weights, so the last stage is the first stage of the next step.
+A = np.array([
+    [0, 0, 0, 0, 0, 0],
+    [1 / 5, 0, 0, 0, 0, 0],
+    [3 / 40, 9 / 40, 0, 0, 0, 0],
+    [44 / 45, -56 / 15, 32 / 9, 0, 0, 0],
+    [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729, 0, 0],
+    [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656, 0],
+    [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+], dtype=np.float64)
+# difference between the 5th and the embedded 4th order solution
+E = np.array([71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40], dtype=np.float64)
+# coefficients of the 4th order continuous extension (dense output), y(t + σh) = y + h K^T P [σ, σ², σ³, σ⁴]
+P = np.array([
+    [1, -8048581381 / 2820520608, 8663915743 / 2820520608, -12715105075 / 11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200 / 32700410799, -68118460800 / 10900136933, 87487479700 / 32700410799],
+    [0, -1754552775 / 470086768, 14199869525 / 1410260304, -10690763975 / 1880347072],
+    [0, 127303824393 / 49829197408, -318862633887 / 49829197408, 701980252875 / 199316789632],
+    [0, -282668133 / 205662961, 2019193451 / 616988883, -1453857185 / 822651844],
+    [0, 40617522 / 29380423, -110615467 / 29380423, 69997945 / 29380423],
+], dtype=np.float64)
+
+SAFETY = 0.9
+MIN_FACTOR = 0.2
+MAX_FACTOR = 10.0
+
+
+class DormandPrince:
+    """
+    Adaptive Runge-Kutta 5(4) integrator (Dormand-Prince) with embedded error control,
+    working on the packed (N, D) state arrays of a ParticleSystem like RungeKutta4.
+
+    The step size is chosen so that the estimated local error of the positions and velocities
+    stays below absolute_tolerance + relative_tolerance * |state|. step(add_forces) advances the
+    simulation by exactly one timestep (e.g. one frame) with as many internal steps as needed,
+    so the integrator can be used by the Simulation runner. advance(..., clip=False) steps freely
+    past the end time instead and interpolate() gives the state at the frame times (dense output).
+
+    :param scene: list of particles (or a ParticleSystem)
+    :param timestep: time that step() advances, also used as the first internal step size
+    :param relative_tolerance: relative tolerance of the local error
+    :param absolute_tolerance: absolute tolerance of the local error
+    :param min_timestep: smallest allowed internal step, a smaller step raises a RuntimeError
+    :param max_timestep: largest allowed internal step (default: no limit)
+    """
+
+    def __init__(self, scene, timestep: float, relative_tolerance: float = 1e-6, absolute_tolerance: float = 1e-9,
+                 min_timestep: float = 1e-12, max_timestep: float = np.inf):
+        self.system, self.index = particle_indices(scene)
+        self.timestep = np.float64(timestep)
+        self.relative_tolerance = relative_tolerance
+        self.absolute_tolerance = absolute_tolerance
+        self.min_timestep = min_timestep
+        self.max_timestep = max_timestep
+
+        # size of the next internal step
+        self.h = min(self.timestep, max_timestep)
+        self.time = 0.0
+
+        n = len(self.system.masses[self.index])
+        shape = (2, n, self.system.dimensions)
+
+        # state (positions, velocities) at the beginning and the end of the last step
+        self.y0 = np.zeros(shape, dtype=np.float64)
+        self.y1 = np.zeros(shape, dtype=np.float64)
+        # derivatives (velocities, accelerations) of all 7 stages
+        self.k = np.zeros((7,) + shape, dtype=np.float64)
+        self._fsal = False
+
+        # dense output of the last accepted step
+        self.last_time = 0.0
+        self.last_h = 0.0
+        self._y_last = np.zeros(shape, dtype=np.float64)
+        self._q = np.zeros((4,) + shape, dtype=np.float64)
+
+        # statistics
+        self.accepted = 0
+        self.rejected = 0
+        self.evaluations = 0
+
+    @property
+    def statistics(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "evaluations": self.evaluations,
+            "timestep": float(self.h),
+        }
+
+    def _evaluate(self, add_forces, stage: int, state: np.ndarray) -> None:
+        # k = (v, F / m) at the given state
+        system = self.system
+        system.positions[self.index] = state[0]
+        system.velocities[self.index] = state[1]
+
+        add_forces()
+        self.k[stage, 0] = state[1]
+        np.multiply(system.forces[self.index], system.inverse_masses[self.index][:, np.newaxis], out=self.k[stage, 1])
+        system.forces[self.index] = 0
+        self.evaluations += 1
+
+    def _write_state(self, state: np.ndarray) -> None:
+        self.system.positions[self.index] = state[0]
+        self.system.velocities[self.index] = state[1]
+
+    def attempt(self, add_forces, end_time: float = np.inf) -> bool:
+        """
+        Tries one internal step of size h (shortened to end at end_time).
+
+        :return: True if the step was accepted
+        """
+        system = self.system
+        h = min(self.h, self.max_timestep, end_time - self.time)
+
+        # the last stage of the previous step can be reused if the state wasn't changed since
+        # (e.g. by a projection onto the constraints)
+        positions, velocities = system.positions[self.index], system.velocities[self.index]
+        if not (self._fsal and np.array_equal(positions, self.y1[0]) and np.array_equal(velocities, self.y1[1])):
+            self.y0[0], self.y0[1] = positions, velocities
+            self._evaluate(add_forces, 0, self.y0)
+        else:
+            self.y0[...] = self.y1
+            self.k[0] = self.k[6]
+
+        for stage in range(1, 7):
+            state = self.y0 + h * np.tensordot(A[stage, :stage], self.k[:stage], axes=1)
+            self._evaluate(add_forces, stage, state)
+        # the 7th stage was evaluated at the 5th order solution
+        self.y1[...] = state
+
+        # error estimate, root mean square norm of the scaled error
+        error = h * np.tensordot(E, self.k, axes=1)
+        scale = self.absolute_tolerance + self.relative_tolerance * np.maximum(np.abs(self.y0), np.abs(self.y1))
+        error_norm = np.sqrt(np.mean((error / scale) ** 2)) if error.size else 0.0
+
+        if error_norm <= 1.0:
+            factor = MAX_FACTOR if error_norm == 0 else min(MAX_FACTOR, SAFETY * error_norm ** -0.2)
+            self.last_time, self.last_h = self.time, h
+            self._y_last[...] = self.y0
+            self._q[...] = np.tensordot(P.T, self.k, axes=1)
+            self.time = end_time if h == end_time - self.time else self.time + h
+            # a step that was shortened to hit end_time doesn't say anything about the next step size
+            self.h = max(self.h, h * factor) if h < self.h else h * factor
+            self.accepted += 1
+            self._fsal = True
+            self._write_state(self.y1)
+            return True
+
+        # the rejected step starts again from y0, also if it fails, so the caller can checkpoint or retry
+        self.h = h * max(MIN_FACTOR, SAFETY * error_norm ** -0.2)
+        self.rejected += 1
+        self._fsal = False
+        self._write_state(self.y0)
+        if self.h < self.min_timestep:
+            raise RuntimeError(f"step size {self.h:.3g} is below the minimum {self.min_timestep:.3g} "
+                               f"at time {self.time:.6g}")
+        return False
+
+    def advance(self, add_forces, end_time: float, clip: bool = True) -> None:
+        """
+        Integrates until end_time.
+
+        :param clip: shorten the last step to end exactly at end_time, otherwise the last step can end
+                     after end_time and the state at end_time is available through interpolate()
+        """
+        while self.time < end_time:
+            self.attempt(add_forces, end_time if clip else np.inf)
+
+    def step(self, add_forces) -> None:
+        self.advance(add_forces, self.time + self.timestep)
+
+    def interpolate(self, time: float) -> tuple:
+        """
+        Dense output: state at a time inside the last accepted step, without evaluating any forces.
+
+        :return: (positions, velocities) arrays of shape (N, D)
+        """
+        if self.accepted == 0 or not self.last_time <= time <= self.time:
+            raise ValueError(f"time {time} is outside of the last step [{self.last_time}, {self.time}]")
+
+        sigma = (time - self.last_time) / self.last_h
+        powers = np.cumprod(np.full(4, sigma))
+        state = self._y_last + self.last_h * np.tensordot(powers, self._q, axes=1)
+        return state[0], state[1]
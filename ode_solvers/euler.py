@@ -0,0 +1,125 @@
+import numpy as np
+from scipy import sparse
+from objects import particle_indices
+from linear_solvers import SOLVERS
+
+
+class ExplicitEuler:
+    """
+    Explicit (forward) euler method on the packed state arrays of a ParticleSystem.
+    Same interface as RungeKutta4: one add_forces evaluation per step.
+    """
+
+    def __init__(self, scene, timestep: float):
+        self.system, self.index = particle_indices(scene)
+        self.timestep = np.float64(timestep)
+
+    def _accelerations(self, add_forces) -> np.ndarray:
+        system = self.system
+        add_forces()
+        accelerations = system.forces[self.index] * system.inverse_masses[self.index][:, np.newaxis]
+        system.forces[self.index] = 0
+        return accelerations
+
+    def step(self, add_forces) -> None:
+        system = self.system
+        accelerations = self._accelerations(add_forces)
+        system.positions[self.index] += self.timestep * system.velocities[self.index]
+        system.velocities[self.index] += self.timestep * accelerations
+
+
+class SemiImplicitEuler(ExplicitEuler):
+    """
+    Semi-implicit (symplectic) euler method: the velocity is updated first and the
+    new velocity is used to update the position.
+    """
+
+    def step(self, add_forces) -> None:
+        system = self.system
+        accelerations = self._accelerations(add_forces)
+        system.velocities[self.index] += self.timestep * accelerations
+        system.positions[self.index] += self.timestep * system.velocities[self.index]
+
+
+class ImplicitEuler(ExplicitEuler):
+    """
+    Implicit (backward) euler method with one newton step for stiff spring networks:
+
+        (M - h ∂F/∂v - h² ∂F/∂x) Δv = h (F + h ∂F/∂x v),    v += Δv,    x += h v
+
+    ∂F/∂x and ∂F/∂v are assembled from the given SpringNetworks (or set by the Simulation runner
+    from Scene.springs), all other forces of add_forces are treated explicitly. Particles with an
+    infinite mass keep their velocity.
+
+    :param scene: list of particles (or a ParticleSystem)
+    :param timestep: timestep of the integration
+    :param springs: SpringNetworks of the particles
+    :param solver: linear solver of linear_solvers.SOLVERS, the system is symmetric positive definite
+    :param tolerance: relative tolerance of the iterative solvers
+    :param max_iterations: maximum number of iterations of the iterative solvers
+    """
+
+    def __init__(self, scene, timestep: float, springs=(), solver: str = "cg",
+                 tolerance: float = 1e-8, max_iterations: int = 200):
+        super().__init__(scene, timestep)
+        if solver not in SOLVERS:
+            raise ValueError(f"unknown solver '{solver}', choose one of {list(SOLVERS)}")
+        self.springs = list(springs)
+        self.solver = solver
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+        # degrees of freedom of the integrated particles in the (n D) system matrices
+        dimensions = self.system.dimensions
+        particles = np.arange(self.system.count)[self.index]
+        self.dofs = (particles[:, np.newaxis] * dimensions + np.arange(dimensions)).ravel()
+
+        # change of the velocities of the last step, used to warm start the solver
+        self.dv = np.zeros(len(self.dofs), dtype=np.float64)
+        self.solver_iterations = 0
+        self.solver_residual = 0.0
+
+    def _jacobians(self) -> tuple:
+        size = len(self.dofs)
+        stiffness = sparse.csr_matrix((size, size))
+        damping = sparse.csr_matrix((size, size))
+        full = len(self.dofs) == self.system.count * self.system.dimensions
+
+        for network in self.springs:
+            dfdx, dfdv = network.jacobians()
+            if not full:
+                dfdx = dfdx[self.dofs][:, self.dofs]
+                dfdv = dfdv[self.dofs][:, self.dofs]
+            stiffness = stiffness + dfdx
+            damping = damping + dfdv
+        return stiffness, damping
+
+    def step(self, add_forces) -> None:
+        if not self.springs:
+            # without a stiffness the newton step is the semi-implicit euler step
+            SemiImplicitEuler.step(self, add_forces)
+            return
+
+        system, h = self.system, self.timestep
+        add_forces()
+        forces = system.forces[self.index].flatten()
+        system.forces[self.index] = 0
+        velocities = system.velocities[self.index].ravel()
+        stiffness, damping = self._jacobians()
+
+        # particles with infinite mass (inverse mass 0) are removed from the system: Δv = 0
+        inverse_masses = np.repeat(system.inverse_masses[self.index], system.dimensions)
+        free = inverse_masses > 0
+        masses = np.divide(1.0, inverse_masses, out=np.ones_like(inverse_masses), where=free)
+        mask = sparse.diags(free.astype(np.float64))
+
+        a = sparse.diags(masses) - h * damping - h * h * stiffness
+        a = (mask @ a @ mask + sparse.diags((~free).astype(np.float64))).tocsr()
+        b = h * (forces + h * stiffness.dot(velocities))
+        b[~free] = 0
+
+        self.dv, self.solver_iterations, self.solver_residual = SOLVERS[self.solver](
+            a, b, self.dv, self.tolerance, self.max_iterations)
+
+        system.velocities[self.index] += self.dv.reshape((-1, system.dimensions))
+        system.positions[self.index] += h * system.velocities[self.index]
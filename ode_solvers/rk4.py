@@ -1,46 +1,79 @@
 import numpy as np
-from objects import Particle
+from objects import particle_indices, integrator_cache
 
 
-def rk4_1(p1: Particle) -> tuple:
-    dt = p1.timestep
-    kx0 = p1.velocity * dt
-    kv0 = (p1.force_accumulator / p1.mass) * dt
-    kx1 = (p1.velocity + kv0 / 2.00) * dt
-    p1.force_accumulator = np.array([0, 0], dtype=np.float64)
-    return kx0, kv0, kx1
-
-
-def rk4_2(p1: Particle, org_vel: np.ndarray) -> tuple:
-    dt = p1.timestep
-    kv1 = (p1.force_accumulator / p1.mass) * dt
-    kx2 = (org_vel + kv1 / 2.00) * dt
-    p1.force_accumulator = np.array([0, 0], dtype=np.float64)
-    return kx2, kv1
-
-
-def rk4_3(p1: Particle, org_vel: np.ndarray) -> tuple:
-    dt = p1.timestep
-    kv2 = (p1.force_accumulator / p1.mass) * dt
-    kx3 = (org_vel + kv2) * dt
-    p1.force_accumulator = np.array([0, 0], dtype=np.float64)
-    return kx3, kv2
-
-
-def rk4_4(p1: Particle) -> np.ndarray:
-    dt = p1.timestep
-    kv3 = (p1.force_accumulator / p1.mass) * dt
-    p1.force_accumulator = np.array([0, 0], dtype=np.float64)
-    return kv3
-
+class RungeKutta4:
+    """
+    Classic 4th order Runge-Kutta integrator working on the packed (N, D) state arrays
+    of a ParticleSystem. All stage buffers are preallocated, so a step does no per-particle
+    Python work. The add_forces callback writes its forces into the shared force array
+    of the particle system (e.g. through the force_accumulator views of the particles).
+    """
 
-def apply_rk4(p1: Particle, kx0: np.ndarray, kx1: np.ndarray, kx2: np.ndarray, kx3: np.ndarray,
-              kv0: np.ndarray, kv1: np.ndarray, kv2: np.ndarray, kv3: np.ndarray,
-              org_coord: np.ndarray, org_vel: np.ndarray) -> None:
-    p1.position = org_coord + (kx0 + 2.0 * kx1 + 2.0 * kx2 + kx3) / 6.0
-    p1.velocity = org_vel + (kv0 + 2.0 * kv1 + 2.0 * kv2 + kv3) / 6.0
-    p1.trail.append(p1.position)
-    p1.force_accumulator = np.array([0, 0], dtype=np.float64)
+    def __init__(self, scene, timestep: float):
+        self.system, self.index = particle_indices(scene)
+        self.timestep = np.float64(timestep)
+
+        n = len(self.system.masses[self.index])
+        shape = (n, self.system.dimensions)
+
+        # state at the beginning of the step
+        self.x0 = np.zeros(shape, dtype=np.float64)
+        self.v0 = np.zeros(shape, dtype=np.float64)
+
+        # stage buffers
+        self.kx = np.zeros((4,) + shape, dtype=np.float64)
+        self.kv = np.zeros((4,) + shape, dtype=np.float64)
+        self.temporary = np.zeros(shape, dtype=np.float64)
+
+    def _evaluate(self, add_forces, stage: int, inverse_masses: np.ndarray) -> None:
+        system = self.system
+
+        # kx = v * dt
+        np.multiply(system.velocities[self.index], self.timestep, out=self.kx[stage])
+
+        # kv = F / m * dt
+        add_forces()
+        np.multiply(system.forces[self.index], inverse_masses, out=self.kv[stage])
+        self.kv[stage] *= self.timestep
+        system.forces[self.index] = 0
+
+    def _set_state(self, stage: int, factor: float) -> None:
+        # state = original state + factor * k[stage]
+        system = self.system
+        np.multiply(self.kx[stage], factor, out=self.temporary)
+        self.temporary += self.x0
+        system.positions[self.index] = self.temporary
+        np.multiply(self.kv[stage], factor, out=self.temporary)
+        self.temporary += self.v0
+        system.velocities[self.index] = self.temporary
+
+    def step(self, add_forces) -> None:
+        system = self.system
+        self.x0[...] = system.positions[self.index]
+        self.v0[...] = system.velocities[self.index]
+        inverse_masses = system.inverse_masses[self.index][:, np.newaxis]
+
+        self._evaluate(add_forces, 0, inverse_masses)
+        self._set_state(0, 0.5)
+        self._evaluate(add_forces, 1, inverse_masses)
+        self._set_state(1, 0.5)
+        self._evaluate(add_forces, 2, inverse_masses)
+        self._set_state(2, 1.0)
+        self._evaluate(add_forces, 3, inverse_masses)
+
+        # weighted sum of the stages: (k0 + 2 k1 + 2 k2 + k3) / 6
+        for k, original, target in ((self.kx, self.x0, system.positions), (self.kv, self.v0, system.velocities)):
+            np.add(k[1], k[2], out=self.temporary)
+            self.temporary *= 2.0
+            self.temporary += k[0]
+            self.temporary += k[3]
+            self.temporary /= 6.0
+            self.temporary += original
+            target[self.index] = self.temporary
+
+
+_integrator_for = integrator_cache(RungeKutta4)
 
 
 def runge_kutta_4th_order(particles, add_forces):
@@ -53,66 +86,7 @@ def runge_kutta_4th_order(particles, add_forces):
     :return: None
     """
 
-    original_coordinates = [particle.position for particle in particles]
-    original_velocities = [particle.velocity for particle in particles]
-
-    add_forces()
-
-    # first step
-    kx0_list = []
-    kx1_list = []
-    kv0_list = []
-
-    for index, particle in enumerate(particles):
-        kx0, kv0, kx1 = rk4_1(particle)
-        kx0_list.append(kx0)
-        kx1_list.append(kx1)
-        kv0_list.append(kv0)
-
-    for index, particle in enumerate(particles):
-        particle.position = original_coordinates[index] + kx0_list[index] / 2
-        particle.velocity = original_velocities[index] + kv0_list[index] / 2
-
-    add_forces()
-
-    # second step
-    kx2_list = []
-    kv1_list = []
-
-    for index, particle in enumerate(particles):
-        kx2, kv1 = rk4_2(particle, original_velocities[index])
-        kx2_list.append(kx2)
-        kv1_list.append(kv1)
-
-    for index, particle in enumerate(particles):
-        particle.position = original_coordinates[index] + kx1_list[index] / 2
-        particle.velocity = original_velocities[index] + kv1_list[index] / 2
-
-    add_forces()
-
-    # third step
-    kx3_list = []
-    kv2_list = []
-
-    for index, particle in enumerate(particles):
-        kx3, kv2 = rk4_3(particle, original_velocities[index])
-        kx3_list.append(kx3)
-        kv2_list.append(kv2)
-
-    for index, particle in enumerate(particles):
-        particle.position = original_coordinates[index] + kx2_list[index]
-        particle.velocity = original_velocities[index] + kv2_list[index]
-
-    add_forces()
-
-    # fourth step
-    kv3_list = []
+    _integrator_for(particles).step(add_forces)
 
     for particle in particles:
-        kv3 = rk4_4(particle)
-        kv3_list.append(kv3)
-
-    for index, particle in enumerate(particles):
-        apply_rk4(particle, kx0_list[index], kx1_list[index], kx2_list[index], kx3_list[index],
-                  kv0_list[index], kv1_list[index], kv2_list[index], kv3_list[index], original_coordinates[index],
-                  original_velocities[index])
+        particle.trail.append(particle.position)
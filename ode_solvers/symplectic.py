@@ -0,0 +1,151 @@
+import numpy as np
+from objects import particle_indices
+
+
+class _Symplectic:
+    """
+    Base of the symplectic integrators, which work on the packed (N, D) state arrays of a
+    ParticleSystem with (at most) one add_forces evaluation per step.
+
+    If a ConstraintManager is given (or set by the Simulation runner from Scene.constraints), the
+    positions are projected onto the constraints after every drift and the velocities are taken
+    from the projected positions (SHAKE / RATTLE). The constraint forces of add_forces then only
+    have to keep the accelerations on the constraints, the drift of the positions is removed
+    without breaking the symplectic structure of the step.
+
+    :param scene: list of particles (or a ParticleSystem)
+    :param timestep: timestep of the integration
+    :param constraints: optional ConstraintManager of the particles
+    """
+
+    def __init__(self, scene, timestep: float, constraints=None):
+        self.system, self.index = particle_indices(scene)
+        self.timestep = np.float64(timestep)
+        self.constraints = constraints
+
+        n = len(self.system.masses[self.index])
+        self.accelerations = np.zeros((n, self.system.dimensions), dtype=np.float64)
+        self.x0 = np.zeros_like(self.accelerations)
+        self.evaluations = 0
+
+    def _evaluate(self, add_forces) -> np.ndarray:
+        # accelerations F / m for the current state of the system
+        system = self.system
+        add_forces()
+        np.multiply(system.forces[self.index], system.inverse_masses[self.index][:, np.newaxis],
+                    out=self.accelerations)
+        system.forces[self.index] = 0
+        self.evaluations += 1
+        return self.accelerations
+
+    def _drift(self, velocities: np.ndarray, dt: float) -> np.ndarray:
+        """
+        x += v dt, followed by the projection onto the constraints.
+
+        :return: the velocities that lead to the projected positions
+        """
+        self.x0[...] = self.system.positions[self.index]
+        self.system.positions[self.index] = self.x0 + dt * velocities
+        if self.constraints is None:
+            return velocities
+
+        self.constraints.project(velocities=False)
+        return (self.system.positions[self.index] - self.x0) / dt
+
+
+class VelocityVerlet(_Symplectic):
+    """
+    Velocity verlet (kick-drift-kick). The accelerations at the end of a step are the accelerations
+    at the beginning of the next one, so a step needs one force evaluation. They are only evaluated
+    again if the state was changed between the steps (e.g. by ConstraintManager.project).
+
+    Velocity dependent forces (friction, constraint forces) are evaluated with the velocity predicted
+    from the half step velocity and the last accelerations. With constraints, the final velocities are
+    projected onto the tangent space of the constraints (RATTLE).
+    """
+
+    def __init__(self, scene, timestep: float, constraints=None):
+        super().__init__(scene, timestep, constraints)
+        # state at the end of the last step, belonging to self.accelerations
+        self.x1 = np.full_like(self.accelerations, np.nan)
+        self.v1 = np.full_like(self.accelerations, np.nan)
+
+    def step(self, add_forces) -> None:
+        system, index, dt = self.system, self.index, self.timestep
+        if not (np.array_equal(system.positions[index], self.x1) and np.array_equal(system.velocities[index], self.v1)):
+            self._evaluate(add_forces)
+
+        # kick, drift
+        half_velocities = self._drift(system.velocities[index] + 0.5 * dt * self.accelerations, dt)
+
+        # forces at the new positions with the predicted velocities, kick
+        system.velocities[index] = half_velocities + 0.5 * dt * self.accelerations
+        self._evaluate(add_forces)
+        system.velocities[index] = half_velocities + 0.5 * dt * self.accelerations
+        if self.constraints is not None:
+            self.constraints.project(iterations=0)
+
+        self.x1[...] = system.positions[index]
+        self.v1[...] = system.velocities[index]
+
+
+class PositionVerlet(_Symplectic):
+    """
+    Position verlet (drift-kick-drift): the forces are evaluated once per step at the midpoint positions.
+    With constraints, the positions and velocities are projected at the end of the step (the midpoint
+    is only used for the force evaluation).
+    """
+
+    def step(self, add_forces) -> None:
+        system, index, dt = self.system, self.index, self.timestep
+
+        # drift
+        system.positions[index] += 0.5 * dt * system.velocities[index]
+        # kick
+        system.velocities[index] += dt * self._evaluate(add_forces)
+        # drift
+        system.positions[index] += 0.5 * dt * system.velocities[index]
+        if self.constraints is not None:
+            self.constraints.project()
+
+
+class Leapfrog(_Symplectic):
+    """
+    Leapfrog with staggered velocities: after every step the velocities of the system are the
+    velocities half a timestep before the positions (v(t - dt / 2)). The first step starts with a
+    half kick from the initial velocities. Because of the staggered velocities, constraints must be
+    given to the integrator instead of projecting the state after every step.
+
+    synchronized_state() returns positions and velocities at the same time (e.g. for the energy).
+    """
+
+    def __init__(self, scene, timestep: float, constraints=None):
+        super().__init__(scene, timestep, constraints)
+        self.started = False
+        # velocities before the kick of the last step, v(t - dt / 2)
+        self.v0 = np.zeros_like(self.accelerations)
+
+    def step(self, add_forces) -> None:
+        system, index, dt = self.system, self.index, self.timestep
+
+        # kick, v(t + dt / 2) = v(t - dt / 2) + a(t) dt
+        accelerations = self._evaluate(add_forces)
+        if self.started:
+            self.v0[...] = system.velocities[index]
+        else:
+            # the initial velocities are v(t), v(t - dt / 2) is extrapolated
+            self.v0[...] = system.velocities[index] - 0.5 * dt * accelerations
+        kick = dt if self.started else 0.5 * dt
+        system.velocities[index] += kick * accelerations
+        self.started = True
+
+        # drift, x(t + dt) = x(t) + v(t + dt / 2) dt
+        system.velocities[index] = self._drift(system.velocities[index], dt)
+
+    def synchronized_state(self) -> tuple:
+        """
+        State at the beginning of the last step, with the velocity v(t) = (v(t - dt / 2) + v(t + dt / 2)) / 2.
+
+        :return: (positions, velocities), copies of shape (N, D)
+        """
+        return self.x0.copy(), 0.5 * (self.v0 + self.system.velocities[self.index])
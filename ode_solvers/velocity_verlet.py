@@ -1,20 +1,20 @@
+from objects import integrator_cache
+from ode_solvers.symplectic import VelocityVerlet
+
+_integrator_for = integrator_cache(VelocityVerlet)
+
 
 def velocity_verlet(particles, add_forces):
     """
     This function takes a list of objects and a function that adds forces to the objects.
     It then calculates the next step in the simulation using the velocity verlet method.
 
-    :param objects: list of objects
+    :param particles: list of particles
     :param add_forces: function that adds forces to the objects
     :return: None
     """
 
-    vel = []
-    for particle in particles:
-        vel.append(particle.velocity_verlet_1())
+    _integrator_for(particles).step(add_forces)
 
-    add_forces()
-
-    for obj in objects:
-        index = objects.index(obj)
-        obj.velocity_verlet_2(vel[index])
+    for particle in particles:
+        particle.trail.append(particle.position)
@@ -0,0 +1,49 @@
+import numpy as np
+from objects import particle_indices
+
+
+class XPBD:
+    """
+    Extended position based dynamics with substeps. Every step is split into substeps, each substep
+    integrates the forces of add_forces explicitly, predicts the positions, projects them onto the
+    constraints (ConstraintManager.solve_positions) and takes the velocities from the corrected positions.
+    Every substep is linear in the number of particles and constraints, no global system is solved.
+
+    The ConstraintManager has to be created with solver="xpbd", so that it doesn't add constraint forces.
+
+    :param scene: list of particles (or a ParticleSystem)
+    :param timestep: timestep of one step
+    :param constraints: ConstraintManager of the particles (or set by the Simulation runner from Scene.constraints)
+    :param substeps: number of substeps per step
+    :param iterations: constraint iterations per substep
+    """
+
+    def __init__(self, scene, timestep: float, constraints=None, substeps: int = 10, iterations: int = 1):
+        self.system, self.index = particle_indices(scene)
+        self.timestep = np.float64(timestep)
+        self.constraints = constraints
+        self.substeps = substeps
+        self.iterations = iterations
+
+        n = len(self.system.masses[self.index])
+        self.x0 = np.zeros((n, self.system.dimensions), dtype=np.float64)
+
+    def step(self, add_forces) -> None:
+        system, index = self.system, self.index
+        constraints = self.constraints
+        if constraints is not None and constraints.solver != "xpbd":
+            raise ValueError("the XPBD integrator needs a ConstraintManager with solver='xpbd'")
+        h = self.timestep / self.substeps
+
+        for _ in range(self.substeps):
+            add_forces()
+            system.velocities[index] += h * system.forces[index] * system.inverse_masses[index][:, np.newaxis]
+            system.forces[index] = 0
+
+            # predict, project
+            self.x0[...] = system.positions[index]
+            system.positions[index] += h * system.velocities[index]
+            if constraints is not None:
+                constraints.solve_positions(h, self.iterations)
+
+            system.velocities[index] = (system.positions[index] - self.x0) / h
@@ -1,14 +1,16 @@
-import time, os, pygame
-
-from objects import Object, Gravity, coords_to_pygame
+# import from directory above
+import sys
+sys.path.append("..")
+from objects import Particle, ParticleSystem, coords_to_pygame
 from constraints import ConstraintManager
-from ode_solvers import rk4
+from forces import Gravity
+from ensemble import Ensemble, divergence, lyapunov_exponents
+from profiler import Profiler
+import numpy as np
 
-pygame.init()
+import time, os, pygame
 
 WIDTH, HEIGHT = 1920, 1080
-WIN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption(os.path.basename(__file__))
 
 WHITE = (255, 255, 255)
 YELLOW = (255, 255, 0)
@@ -16,67 +18,55 @@ BLUE = (100, 149, 237)
 RED = (188, 39, 50)
 DARK_GREY = (80, 78, 81)
 
-FONT = pygame.font.SysFont("DejaVu Sans", 20)
-
 FRAMERATE = 60
 TIMESTEP = 1 / FRAMERATE
-
-
-def main():
-    run = True
-    clock = pygame.time.Clock()
-    tickcounter = 0
-
-    objects_p2 = []
-    objects_p3 = []
-    colors = []
-
-    for i in range(20):
-        COLOR = (255, i*10, i*10)
-        colors.append(COLOR)
-
-        p2 = Object(100, 0, 10, COLOR, 200, TIMESTEP)
-        p2.x_vel = 0
-        p2.y_vel = 0
-
-        p3 = Object(100, -100, 10, COLOR, 200, TIMESTEP)
-        p3.x_vel = 5*i
-        p3.y_vel = 0
-
-        objects_p2.append(p2)
-        objects_p3.append(p3)
-
-    p1 = Object(0, 0, 10, YELLOW, 100, TIMESTEP)
-    p1.x_vel = 0
-    p1.y_vel = 0
-
-    scene = [p1] + objects_p2 + objects_p3
-
-    # particles/objects used for the constraints
-    constraints_scene = objects_p2 + objects_p3
+DIMENSIONS = 2
+MEMBERS = 20
+# difference of the initial x velocity of the lower particle between neighbouring members,
+# small for the lyapunov study and large enough in the demo to see the members separate within a second
+PERTURBATION = 1e-3
+VISIBLE_PERTURBATION = 5
+
+
+def create_ensemble(members: int = MEMBERS, perturbation: float = PERTURBATION) -> Ensemble:
+    """
+    Double pendulums that only differ in the initial x velocity of the lower particle, member i
+    starts with i * perturbation, so all members start close to the base trajectory (member 0).
+    """
+    system = ParticleSystem(DIMENSIONS)
+    p2 = Particle([100, 0], 10, DIMENSIONS, 1, TIMESTEP, 10, WHITE, system=system)
+    p3 = Particle([100, -100], 10, DIMENSIONS, 1, TIMESTEP, 10, WHITE, system=system)
 
     # gravity force
-    gravity = Gravity(constraints_scene, 981)
+    gravity = Gravity([p2, p3], 981, 1)
 
     # import/create constraints
-    constraint_manager = ConstraintManager(constraints_scene)
+    constraint_manager = ConstraintManager([p2, p3], DIMENSIONS)
+    constraint_manager.circular_wire_constraint(p2)
+    constraint_manager.distance_constraint(p2, p3)
+
+    positions = np.repeat(system.positions[np.newaxis], members, axis=0)
+    velocities = np.zeros_like(positions)
+    velocities[:, 1, 0] = perturbation * np.arange(members)
 
-    def add_forces():
-        # add gravity
-        gravity.add_forces()
+    return Ensemble(constraint_manager, positions, velocities, TIMESTEP, fields=[gravity])
 
-        # update the state variables
-        constraint_manager.update(constraints_scene)
 
-        # calculate/add constraint forces
-        for i in range(len(objects_p2)):
-            constraint_manager.circular_wire_constraint(objects_p2[i])
-            constraint_manager.distance_constraint(objects_p2[i], objects_p3[i])
+def main():
+    pygame.init()
+    WIN = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption(os.path.basename(__file__))
+    FONT = pygame.font.SysFont("DejaVu Sans", 20)
+
+    run = True
+    clock = pygame.time.Clock()
 
-        constraint_manager.add_forces()
+    ensemble = create_ensemble(perturbation=VISIBLE_PERTURBATION)
+    colors = [(255, i * 10, i * 10) for i in range(ensemble.members)]
+    origin = coords_to_pygame((0, 0))
 
-    # control time
-    start_time = time.time()
+    # timing of the phases of every frame, shown in the top left corner
+    profiler = Profiler(TIMESTEP, history=10 * FRAMERATE)
 
     while run:
         clock.tick(FRAMERATE)
@@ -86,30 +76,21 @@ def main():
             if event.type == pygame.QUIT:
                 run = False
 
-        rk4(constraints_scene, add_forces)
-
-        # drawing
-        for i in scene:
-            i.draw(WIN, trail=False)
-
-        # pendulum connection line
-        for i in range(len(objects_p2)):
-            pygame.draw.line(WIN, colors[i], coords_to_pygame((p1.x, p1.y)), coords_to_pygame((objects_p2[i].x, objects_p2[i].y)), 1)
-            pygame.draw.line(WIN, colors[i], coords_to_pygame((objects_p2[i].x, objects_p2[i].y)), coords_to_pygame((objects_p3[i].x, objects_p3[i].y)), 1)
+        with profiler.phase("integrate"):
+            ensemble.step()
 
-        # total energy in scene
-        total_energy = gravity.potential_energy()
-        for i in scene:
-            total_energy += i.energy()
+        # drawing the pendulums and their connection lines
+        with profiler.phase("draw"):
+            pygame.draw.circle(WIN, YELLOW, origin, 10)
+            for color, (p2, p3) in zip(colors, ensemble.positions):
+                pygame.draw.line(WIN, color, origin, coords_to_pygame(p2), 1)
+                pygame.draw.line(WIN, color, coords_to_pygame(p2), coords_to_pygame(p3), 1)
+                pygame.draw.circle(WIN, color, coords_to_pygame(p2), 10)
+                pygame.draw.circle(WIN, color, coords_to_pygame(p3), 10)
 
         # status text
-        tickcounter += 1
-        status_text_rt = FONT.render(f"Realtime    : {round(time.time() - start_time, 2)}", 1, WHITE)
-        status_text_pt = FONT.render(f"Program Time: {round(tickcounter * TIMESTEP, 2)}", 1, WHITE)
-        energy_text = FONT.render(f"Total system energy: {round(total_energy, 2)} (Numerical Error)", 1, WHITE)
-        WIN.blit(status_text_rt, (0, 0))
-        WIN.blit(status_text_pt, (0, 20))
-        WIN.blit(energy_text, (0, 40))
+        profiler.draw(WIN, FONT)
+        profiler.end_step()
 
         pygame.display.update()
 
@@ -117,4 +98,13 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    if "--headless" in sys.argv:
+        # sensitivity study without a display
+        start = time.time()
+        ensemble = create_ensemble(1000)
+        trajectories = ensemble.run(5 * FRAMERATE)
+        exponents = lyapunov_exponents(trajectories["time"], divergence(trajectories["positions"]))
+        print(f"Simulated {ensemble.members} pendulums for {ensemble.time:.2f}s in {round(time.time() - start, 2)}s, "
+              f"mean divergence rate: {np.nanmean(exponents):.3f} 1/s")
+    else:
+        main()
@@ -1,19 +1,20 @@
 # import from directory above
 import sys
 sys.path.append("..")
-from objects import Particle, coords_to_pygame
+from objects import Particle, ParticleSystem, coords_to_pygame
 from constraints import ConstraintManager
 from ode_solvers.rk4 import runge_kutta_4th_order
+from simulation import Scene, Simulation
 import numpy as np
 from forces import Gravity, LinearFrictionForce
+from profiler import Profiler
+from trajectory import TrajectoryWriter, TrajectoryReader
+from screen_recorder import FrameRecorder
+from renderer import SceneRenderer
 
 import time, os, pygame
 
-pygame.init()
-
 WIDTH, HEIGHT = 1000, 800
-WIN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption(os.path.basename(__file__))
 
 WHITE = (255, 255, 255)
 YELLOW = (255, 255, 0)
@@ -21,34 +22,41 @@ BLUE = (100, 149, 237)
 RED = (188, 39, 50)
 DARK_GREY = (80, 78, 81)
 
-FONT = pygame.font.SysFont("DejaVu Sans", 20)
-
 FRAMERATE = 160
 TIMESTEP = 1 / FRAMERATE
 DIMENSIONS = 2
 ZOOM = 100
 
 
-def draw_connection_line(p1: Particle, p2: Particle) -> None:
-    pygame.draw.line(WIN, WHITE, coords_to_pygame((ZOOM * p1.position[0], ZOOM * p1.position[1])),
-                     coords_to_pygame((ZOOM * p2.position[0], ZOOM * p2.position[1])), 1)
-
-
 def particles_distance(p1: Particle, p2: Particle) -> float:
     return np.sqrt((p1.position[0] - p2.position[0]) ** 2 + (p1.position[1] - p2.position[1]) ** 2)
 
 
-def main():
-    run = True
-    clock = pygame.time.Clock()
-    tickcounter = 0
+def draw_scene(win, renderer: SceneRenderer, scene: list) -> None:
+    index = [i.index for i in scene]
+
+    # drawing the trails, the particles themselves and the pendulum connection lines
+    for i in scene:
+        renderer.trail(win, i.trail, i.color)
+    renderer.particles(win, index, [i.color for i in scene])
+    renderer.chain(win, index)
 
-    p1 = Particle([0, 0], 1.00, DIMENSIONS, ZOOM, TIMESTEP, 0.30, YELLOW)
-    p2 = Particle([1, 0], 1.00, DIMENSIONS, ZOOM, TIMESTEP, 0.30, DARK_GREY)
-    p3 = Particle([1, -1], 1.00, DIMENSIONS, ZOOM, TIMESTEP, 0.30, YELLOW)
-    p4 = Particle([1, -2], 1.00, DIMENSIONS, ZOOM, TIMESTEP, 0.30, DARK_GREY)
+    # draw each particles mass on the particle itself (the rendered texts are cached)
+    renderer.labels(win, [f"{round(i.mass, 2)}kg" for i in scene], index, offset=(40, -40))
 
-    scene = [p1, p2, p3, p4]
+
+def create_scene(system: ParticleSystem = None):
+    """
+    Creates the triple pendulum.
+
+    :return: (Scene for the Simulation runner, all particles, gravity, constraint manager)
+    """
+    system = ParticleSystem(DIMENSIONS) if system is None else system
+
+    p1 = Particle([0, 0], 1.00, DIMENSIONS, ZOOM, TIMESTEP, 0.30, YELLOW, system=system)
+    p2 = Particle([1, 0], 1.00, DIMENSIONS, ZOOM, TIMESTEP, 0.30, DARK_GREY, system=system)
+    p3 = Particle([1, -1], 1.00, DIMENSIONS, ZOOM, TIMESTEP, 0.30, YELLOW, system=system)
+    p4 = Particle([1, -2], 1.00, DIMENSIONS, ZOOM, TIMESTEP, 0.30, DARK_GREY, system=system)
 
     # gravity force
     gravity = Gravity([p2, p3, p4], 9.81, 1)  # dimension starting from 0
@@ -57,80 +65,160 @@ def main():
     # import/create constraints
     constraints_scene = [p2, p3, p4]
     constraint_manager = ConstraintManager(constraints_scene, DIMENSIONS)
+    constraint_manager.circular_wire_constraint(p2)
+    constraint_manager.distance_constraint(p2, p3)
+    constraint_manager.distance_constraint(p3, p4)
 
     def add_forces() -> None:
         gravity.add_forces()
         linear_friction.add_forces()
 
         constraint_manager.update()
-        constraint_manager.circular_wire_constraint(p2)
-        constraint_manager.distance_constraint(p2, p3)
-        constraint_manager.distance_constraint(p3, p4)
         constraint_manager.add_forces()
 
-    # control time
-    start_time = time.time()
+    def energy() -> float:
+        return (p1.energy() + p2.energy()
+                + p3.energy() + p4.energy()
+                + gravity.potential_energy())
+
+    # project the particles back onto the constraints after every step to remove the drift
+    scene = Scene(constraints_scene, add_forces, after_step=constraint_manager.project, energy=energy)
+    return scene, [p1, p2, p3, p4], gravity, constraint_manager
+
+
+def run_headless(steps: int, profiler: Profiler = None) -> dict:
+    # simulate without a display, as fast as possible
+    scene, _, _, constraint_manager = create_scene()
+    if profiler is not None:
+        constraint_manager.profiler = profiler
+    return Simulation(scene, TIMESTEP, profiler=profiler).run(steps)
+
+
+def record_headless(steps: int, path: str) -> TrajectoryReader:
+    # stream the trajectory into a file instead of keeping it in memory
+    scene, _, _, _ = create_scene()
+    simulation = Simulation(scene, TIMESTEP)
+    with TrajectoryWriter.for_simulation(simulation, path, metadata={"scene": "triple_pendulum"}) as writer:
+        simulation.record(writer, steps)
+    return TrajectoryReader(path)
+
+
+def record_video(steps: int, path: str, fps: float = 30) -> int:
+    # render offscreen at a fixed simulation time cadence, faster than real time and without a display
+    simulation_scene, scene, _, _ = create_scene()
+    project = simulation_scene.after_step
+
+    def after_step() -> None:
+        # the Simulation runner doesn't keep the trails like runge_kutta_4th_order, so every step is added here
+        project()
+        for particle in simulation_scene.particles:
+            particle.trail.append(particle.position)
+
+    simulation_scene.after_step = after_step
+    pygame.font.init()
+    renderer = SceneRenderer(scene[0].system, ZOOM, coords_to_pygame((0, 0)), pygame.font.SysFont("DejaVu Sans", 20))
+
+    def draw(surface, simulation) -> None:
+        renderer.begin(surface)
+        draw_scene(surface, renderer, scene)
+        renderer.end()
+
+    with FrameRecorder(path, draw, (WIDTH, HEIGHT), fps) as recorder:
+        simulation = Simulation(simulation_scene, TIMESTEP, renderer=recorder)
+        recorder(simulation)
+        for _ in range(steps):
+            simulation.step()
+    return recorder.frames
+
+
+def main():
+    pygame.init()
+    WIN = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption(os.path.basename(__file__))
+    FONT = pygame.font.SysFont("DejaVu Sans", 20)
+
+    run = True
+    clock = pygame.time.Clock()
+
+    simulation_scene, scene, gravity, constraint_manager = create_scene()
+    p1, p2, p3, p4 = scene
+    renderer = SceneRenderer(p1.system, ZOOM, coords_to_pygame((0, 0)), FONT)
+
+    # timing of the phases of every frame, shown in the top left corner
+    profiler = Profiler(TIMESTEP, history=10 * FRAMERATE)
+    constraint_manager.profiler = profiler
+    add_forces = profiler.timed("forces", simulation_scene.add_forces)
 
     while run:
         clock.tick(FRAMERATE)
-        WIN.fill((0, 0, 0))
+        renderer.begin(WIN)
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 run = False
 
         # ode solver
-        runge_kutta_4th_order([p2, p3, p4],
-                              add_forces)
+        with profiler.phase("integrate"):
+            runge_kutta_4th_order(simulation_scene.particles, add_forces)
+        with profiler.phase("after_step"):
+            simulation_scene.after_step()
 
-        total_energy = (p1.energy() + p2.energy()
-                        + p3.energy() + p4.energy()
-                        + gravity.potential_energy())
+        total_energy = simulation_scene.energy()
 
         #############################
         ###### DRAWING SECTION ######
         #############################
 
-        # drawing the particles themselves
-        for i in scene:
-            i.draw(WIN)
-
-        # drawing the pendulum connection lines
-        draw_connection_line(p1, p2)
-        draw_connection_line(p2, p3)
-        draw_connection_line(p3, p4)
-
-        # draw each particles mass on the particle itself
-        for i in scene:
-            mass_text = FONT.render(f"{round(i.mass, 2)}kg", 1, WHITE)
-            WIN.blit(mass_text, coords_to_pygame((i.position[0] * ZOOM + 40, i.position[1] * ZOOM + 40)))
-
-        # status texts
-        tickcounter += 1
-        status_text_rt = FONT.render(f"Realtime    : {round(time.time() - start_time, 2)}", 1, WHITE)
-        status_text_pt = FONT.render(f"Program Time: {round(tickcounter * TIMESTEP, 2)}", 1, WHITE)
-        energy_text = FONT.render(f"Total system energy: {round(total_energy, 3)} (Numerical Error)", 1, WHITE)
-        distance_text = FONT.render(f"Distance between p2 and p3: {round(particles_distance(p2, p3), 3)}", 1, WHITE)
-        distance_text2 = FONT.render(f"Distance between p3 and p4: {round(particles_distance(p3, p4), 3)}", 1, WHITE)
-        WIN.blit(status_text_rt, (0, 0))
-        WIN.blit(status_text_pt, (0, 20))
-        WIN.blit(energy_text, (0, 40))
-        WIN.blit(distance_text, (0, 60))
-        WIN.blit(distance_text2, (0, 80))
+        with profiler.phase("draw"):
+            draw_scene(WIN, renderer, scene)
+
+        # status texts, they change every frame and are not cached
+        renderer.lines(WIN, profiler.hud_lines() + [
+            f"Total system energy: {round(total_energy, 3)} (Numerical Error)",
+            f"Distance between p2 and p3: {round(particles_distance(p2, p3), 3)}",
+            f"Distance between p3 and p4: {round(particles_distance(p3, p4), 3)}",
+        ], cached=False)
+        profiler.end_step()
 
         # draw a scale line
-        position_legend = [1, 3]
-        pygame.draw.line(WIN, WHITE, (1*ZOOM, 3*ZOOM), (2*ZOOM, 3*ZOOM), 1)
-        pygame.draw.line(WIN, WHITE, (1*ZOOM, 3.05*ZOOM), (1*ZOOM, 2.95*ZOOM), 1)
-        pygame.draw.line(WIN, WHITE, (2*ZOOM, 3.05*ZOOM), (2*ZOOM, 2.95*ZOOM), 1)
+        renderer.track(pygame.draw.line(WIN, WHITE, (1*ZOOM, 3*ZOOM), (2*ZOOM, 3*ZOOM), 1))
+        renderer.track(pygame.draw.line(WIN, WHITE, (1*ZOOM, 3.05*ZOOM), (1*ZOOM, 2.95*ZOOM), 1))
+        renderer.track(pygame.draw.line(WIN, WHITE, (2*ZOOM, 3.05*ZOOM), (2*ZOOM, 2.95*ZOOM), 1))
         # write the scale value
-        scale_text = FONT.render("1m", 1, WHITE)
-        WIN.blit(scale_text, (1.35*ZOOM, 3.1*ZOOM))
+        renderer.text(WIN, "1m", (1.35*ZOOM, 3.1*ZOOM))
 
-        pygame.display.update()
+        # only the changed parts of the screen are updated
+        pygame.display.update(renderer.end())
 
     pygame.quit()
 
 
 if __name__ == "__main__":
-    main()
+    if "--video" in sys.argv:
+        # --video <file.gif|file.mp4|frames/%05d.png> renders the simulation offscreen
+        start = time.time()
+        frames = record_video(10 * FRAMERATE, sys.argv[sys.argv.index("--video") + 1])
+        print(f"Rendered {frames} frames in {round(time.time() - start, 2)}s")
+    elif "--record" in sys.argv:
+        # --record <file> streams the trajectory into a file, read it with trajectory.TrajectoryReader
+        start = time.time()
+        reader = record_headless(10 * FRAMERATE, sys.argv[sys.argv.index("--record") + 1])
+        print(f"Recorded {len(reader)} steps in {round(time.time() - start, 2)}s, "
+              f"energy: {round(reader.energy[0], 3)} -> {round(reader.energy[-1], 3)}")
+    elif "--headless" in sys.argv:
+        # --profile <file.csv|file.json> writes the timing of every step
+        profiler = Profiler(TIMESTEP) if "--profile" in sys.argv else None
+        start = time.time()
+        trajectories = run_headless(10 * FRAMERATE, profiler)
+        print(f"Simulated {len(trajectories['time'])} steps in {round(time.time() - start, 2)}s, "
+              f"energy: {round(trajectories['energy'][0], 3)} -> {round(trajectories['energy'][-1], 3)}")
+        if profiler is not None:
+            path = sys.argv[sys.argv.index("--profile") + 1]
+            if path.endswith(".json"):
+                profiler.to_json(path)
+            else:
+                profiler.to_csv(path)
+            for name, value in profiler.summary().items():
+                print(f"{name:20} {value:.6g}")
+    else:
+        main()
@@ -0,0 +1,202 @@
+import csv, json, time
+from collections import deque
+import numpy as np
+
+WHITE = (255, 255, 255)
+
+
+class _Phase:
+    """
+    Context manager that adds the elapsed time to one named phase of the current step.
+    One instance per phase name is reused, so entering a phase doesn't allocate.
+    """
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception) -> bool:
+        current = self.profiler.current
+        current[self.name] = current.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+class _NullPhase:
+    # shared no-op phase of the disabled profiler
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception) -> bool:
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class Profiler:
+    """
+    Lightweight instrumentation of the step loop.
+
+    Phases are timed with "with profiler.phase(name):" and are inclusive, e.g. "forces" contains
+    the time of "constraints.update" and "constraints.solve" if the constraints are updated in add_forces.
+    Counters are set with count() (last value of the step) or add() (summed over the step).
+    end_step() closes the record of the current step, the records can be exported as CSV/JSON
+    or shown as a pygame HUD.
+
+    :param timestep: timestep of the simulation, used for the program time in the HUD
+    :param history: number of step records that are kept (None keeps all)
+    """
+
+    enabled = True
+
+    def __init__(self, timestep: float = 0.0, history: int = None):
+        self.timestep = timestep
+        self.records = deque(maxlen=history)
+        self.current = {}
+        self.steps = 0
+        self._phases = {}
+        self._columns = {}
+        self.start_time = time.perf_counter()
+        self._step_start = self.start_time
+
+    def phase(self, name: str) -> _Phase:
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = _Phase(self, name)
+        return phase
+
+    def timed(self, name: str, function):
+        # wraps function so that every call is timed as the phase name
+        phase = self.phase(name)
+
+        def wrapper(*args, **kwargs):
+            with phase:
+                return function(*args, **kwargs)
+        return wrapper
+
+    def count(self, name: str, value) -> None:
+        self.current[name] = value
+
+    def add(self, name: str, value=1) -> None:
+        self.current[name] = self.current.get(name, 0) + value
+
+    def end_step(self) -> None:
+        now = time.perf_counter()
+        self.current["frame"] = now - self._step_start
+        self._step_start = now
+
+        for name in self.current:
+            self._columns.setdefault(name, None)
+        self.records.append(self.current)
+        self.current = {}
+        self.steps += 1
+
+    @property
+    def columns(self) -> list:
+        # names of all phases and counters in the order they first appeared
+        return list(self._columns)
+
+    def as_arrays(self, last: int = None) -> dict:
+        """
+        :param last: only use the last records
+        :return: dict name -> array (T,) over the steps, nan where a step has no value
+        """
+        records = list(self.records)[-last:] if last else list(self.records)
+        return {name: np.array([record.get(name, np.nan) for record in records], dtype=np.float64)
+                for name in self.columns}
+
+    def summary(self, last: int = None) -> dict:
+        # mean of every phase (seconds) and counter over the (last) records
+        summary = {}
+        for name, values in self.as_arrays(last).items():
+            valid = values[np.isfinite(values)]
+            summary[name] = float(np.mean(valid)) if len(valid) else np.nan
+        return summary
+
+    def to_csv(self, path: str) -> None:
+        # one row per step, phases in seconds
+        columns = self.columns
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=["step"] + columns)
+            writer.writeheader()
+            first = self.steps - len(self.records)
+            for step, record in enumerate(self.records, first):
+                writer.writerow(dict(record, step=step))
+
+    def to_json(self, path: str) -> None:
+        first = self.steps - len(self.records)
+        with open(path, "w") as file:
+            json.dump({
+                "timestep": self.timestep,
+                "columns": self.columns,
+                "summary": self.summary(),
+                "steps": [dict(record, step=step) for step, record in enumerate(self.records, first)],
+            }, file, indent=2)
+
+    def hud_lines(self, last: int = 60) -> list:
+        lines = [f"Realtime    : {round(time.perf_counter() - self.start_time, 2)}",
+                 f"Program Time: {round(self.steps * self.timestep, 2)}"]
+        for name, value in self.summary(last).items():
+            if not np.isfinite(value):
+                continue
+            if name in self._phases or name == "frame":
+                lines.append(f"{name}: {1000 * value:.3f} ms")
+            else:
+                lines.append(f"{name}: {value:.4g}")
+        return lines
+
+    def draw(self, win, font, position: tuple = (0, 0), extra: list = (), last: int = 60, color=WHITE) -> None:
+        """
+        Draws the HUD (real/program time, mean time of every phase and the counters) onto a pygame surface.
+
+        :param extra: further lines that are drawn below the HUD
+        """
+        x, y = position
+        for line in self.hud_lines(last) + list(extra):
+            win.blit(font.render(line, 1, color), (x, y))
+            y += font.get_linesize()
+
+
+class NullProfiler:
+    """
+    Disabled profiler with the same interface, every call is a no-op.
+    """
+
+    enabled = False
+    timestep = 0.0
+    steps = 0
+    records = ()
+    columns = ()
+
+    def phase(self, name: str) -> _NullPhase:
+        return _NULL_PHASE
+
+    def timed(self, name: str, function):
+        return function
+
+    def count(self, name: str, value) -> None:
+        pass
+
+    def add(self, name: str, value=1) -> None:
+        pass
+
+    def end_step(self) -> None:
+        pass
+
+    def summary(self, last: int = None) -> dict:
+        return {}
+
+    def draw(self, win, font, position: tuple = (0, 0), extra: list = (), last: int = 60, color=WHITE) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,190 @@
+from collections import OrderedDict
+import numpy as np
+import pygame
+
+WHITE = (255, 255, 255)
+
+# above this number of rectangles SceneRenderer clears and updates their bounding rectangle instead
+MAX_DIRTY_RECTS = 256
+
+
+class TextCache:
+    """
+    Rendered text surfaces by (text, color), so unchanged labels are not rendered again every frame.
+    The least recently used surfaces are dropped if more than capacity texts are cached.
+
+    :param font: pygame font of the texts
+    :param capacity: maximum number of cached surfaces
+    """
+
+    def __init__(self, font, capacity: int = 512):
+        self.font = font
+        self.capacity = capacity
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text: str, color=WHITE) -> pygame.Surface:
+        key = (text, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        surface = self.surfaces[key] = self.font.render(text, 1, color)
+        self.misses += 1
+        if len(self.surfaces) > self.capacity:
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+class SceneRenderer:
+    """
+    Batched drawing of the particles of a ParticleSystem.
+
+    All positions are transformed to screen coordinates with one affine map (zoom and origin, the
+    y axis points up), particles are blitted from cached circle sprites with one Surface.blits call,
+    chains of links and trails are single polylines and static texts come from a TextCache.
+
+    The rectangles of everything drawn in a frame are collected. begin() only clears the rectangles of
+    the last frame and end() returns the rectangles that changed, for pygame.display.update(rects).
+
+    :param system: ParticleSystem of the particles
+    :param zoom: pixels per unit of length
+    :param origin: screen position of the origin
+    :param font: pygame font of the texts (optional)
+    :param background: background color
+    """
+
+    def __init__(self, system, zoom: float = 1.0, origin: tuple = (400, 400), font=None, background=(0, 0, 0)):
+        self.system = system
+        self.zoom = zoom
+        self.origin = np.array(origin, dtype=np.float64)
+        self.texts = TextCache(font) if font is not None else None
+        self.background = background
+        self._sprites = {}
+        self._rects = []
+        self._last_rects = None
+        self._screen = None
+
+    def transform(self, points: np.ndarray) -> np.ndarray:
+        # world coordinates (n, 2) to screen coordinates: origin + zoom * (x, -y)
+        return self.origin + self.zoom * points[..., :2] * (1.0, -1.0)
+
+    def screen_positions(self, index=slice(None)) -> np.ndarray:
+        return self.transform(self.system.positions[index])
+
+    def _sprite(self, color: tuple, radius: int) -> pygame.Surface:
+        # circle on a transparent (color keyed) square surface
+        key = (tuple(color), radius)
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            key_color = (0, 0, 0) if any(color) else (255, 0, 255)
+            sprite = pygame.Surface((2 * radius + 1, 2 * radius + 1))
+            sprite.fill(key_color)
+            sprite.set_colorkey(key_color)
+            pygame.draw.circle(sprite, color, (radius, radius), radius)
+            sprite = self._sprites[key] = sprite.convert() if pygame.display.get_surface() else sprite
+        return sprite
+
+    def particles(self, win, index=slice(None), colors=WHITE, radii=None) -> None:
+        """
+        Draws the particles as filled circles.
+
+        :param colors: one color for all particles or a list with the color of every particle
+        :param radii: radii in world units (default: the radii of the ParticleSystem)
+        """
+        positions = self.screen_positions(index)
+        radii = self.system.radii[index] if radii is None else radii
+        pixels = np.maximum(np.rint(self.zoom * np.broadcast_to(radii, len(positions))), 1).astype(int)
+        corners = np.rint(positions - pixels[:, np.newaxis]).astype(int).tolist()
+
+        if isinstance(colors[0], (int, np.integer)) and np.all(pixels == pixels[:1]):
+            # one sprite for all particles
+            sprites = [self._sprite(colors, int(pixels[0]))] * len(pixels) if len(pixels) else []
+        else:
+            if isinstance(colors[0], (int, np.integer)):
+                colors = [colors] * len(positions)
+            sprites = [self._sprite(color, radius) for color, radius in zip(colors, pixels.tolist())]
+        self._rects += win.blits(list(zip(sprites, corners)))
+
+    def chain(self, win, index, color=WHITE, width: int = 1) -> None:
+        # links between the consecutive particles of the index as one polyline
+        points = self.screen_positions(index)
+        if len(points) > 1:
+            self._rects.append(pygame.draw.lines(win, color, False, points, width))
+
+    def links(self, win, particles1, particles2, color=WHITE, width: int = 1) -> None:
+        """
+        Draws links between two index arrays of particles (e.g. the springs of a SpringNetwork).
+        Consecutive links that continue at the end of the previous link (particles1[i + 1] == particles2[i])
+        form one polyline, so a chain of links is drawn with one call.
+        """
+        particles1, particles2 = np.atleast_1d(particles1), np.atleast_1d(particles2)
+        if not len(particles1):
+            return
+        starts = self.screen_positions(particles1)
+        ends = self.screen_positions(particles2)
+
+        # a polyline ends where the next link doesn't start at the end of the link
+        breaks = np.flatnonzero(particles1[1:] != particles2[:-1]) + 1
+        for first, last in zip(np.r_[0, breaks], np.r_[breaks, len(particles1)]):
+            points = np.vstack((starts[first:last], ends[last - 1]))
+            self._rects.append(pygame.draw.lines(win, color, False, points.tolist(), width))
+
+    def trail(self, win, trail, color=WHITE, width: int = 2) -> None:
+        if len(trail) > 2:
+            self._rects.append(pygame.draw.lines(win, color, False, self.transform(trail.points()), width))
+
+    def text(self, win, text: str, position: tuple, color=WHITE, cached: bool = True) -> None:
+        # texts that change every frame (e.g. numbers) are rendered without the cache, so they don't evict the labels
+        surface = self.texts.render(text, color) if cached else self.texts.font.render(text, 1, color)
+        self._rects.append(win.blit(surface, position))
+
+    def labels(self, win, texts: list, index=slice(None), offset: tuple = (0, 0), color=WHITE) -> None:
+        """
+        Draws one text next to every particle, e.g. the masses. The texts are rendered once and cached.
+
+        :param offset: offset of the texts from the particles in pixels
+        """
+        corners = np.rint(self.screen_positions(index) + offset).astype(int).tolist()
+        surfaces = [self.texts.render(text, color) for text in texts]
+        self._rects += win.blits(list(zip(surfaces, corners)))
+
+    def lines(self, win, lines: list, position: tuple = (0, 0), color=WHITE, cached: bool = True) -> None:
+        # block of text lines, e.g. Profiler.hud_lines() with cached=False
+        x, y = position
+        for line in lines:
+            self.text(win, line, (x, y), color, cached)
+            y += self.texts.font.get_linesize()
+
+    def track(self, rect) -> None:
+        # rectangle drawn by other code, so it is cleared and updated like the own drawings
+        self._rects.append(pygame.Rect(rect))
+
+    @staticmethod
+    def _merge(rects: list) -> list:
+        # filling or updating many small rectangles is slower than one large one
+        return [rects[0].unionall(rects[1:])] if len(rects) > MAX_DIRTY_RECTS else rects
+
+    def begin(self, win) -> None:
+        # clears what was drawn in the last frame, the whole surface in the first frame
+        self._screen = win.get_rect()
+        if self._last_rects is None:
+            win.fill(self.background)
+        else:
+            for rect in self._merge(self._last_rects):
+                win.fill(self.background, rect)
+        self._rects = []
+
+    def end(self) -> list:
+        """
+        :return: rectangles of the screen that changed since the last frame (everything in the first frame)
+        """
+        if self._last_rects is None:
+            dirty = [self._screen]
+        else:
+            dirty = self._merge(self._last_rects + self._rects)
+        self._last_rects = self._rects
+        return dirty
@@ -0,0 +1,226 @@
+import functools, json, os
+import numpy as np
+from objects import ParticleSystem, SpringNetwork
+from forces import ForceRegistry, Gravity, LinearFrictionForce
+from constraints import ConstraintManager
+from simulation import Scene, Simulation
+from ode_solvers.rk4 import RungeKutta4
+from ode_solvers.euler import ExplicitEuler, SemiImplicitEuler, ImplicitEuler
+from ode_solvers.dormand_prince import DormandPrince
+from ode_solvers.symplectic import VelocityVerlet, PositionVerlet, Leapfrog
+from ode_solvers.xpbd import XPBD
+
+# solver names of the scene files
+SOLVERS = {
+    "rk4": RungeKutta4,
+    "explicit_euler": ExplicitEuler,
+    "semi_implicit_euler": SemiImplicitEuler,
+    "implicit_euler": ImplicitEuler,
+    "dormand_prince": DormandPrince,
+    "velocity_verlet": VelocityVerlet,
+    "position_verlet": PositionVerlet,
+    "leapfrog": Leapfrog,
+    "xpbd": XPBD,
+}
+
+FORCES = {
+    "gravity": Gravity,
+    "linear_friction": LinearFrictionForce,
+}
+
+# arrays with more elements are written into the .npz payload by save_scene
+INLINE_LIMIT = 64
+
+
+class _Payload:
+    # arrays of the .npz file next to the scene file, referenced as "@name" in the description
+    def __init__(self, path: str):
+        self.path = path
+        self._data = None
+
+    def array(self, value, dtype=np.float64) -> np.ndarray:
+        if isinstance(value, str) and value.startswith("@"):
+            if self._data is None:
+                if self.path is None or not os.path.exists(self.path):
+                    raise ValueError(f"the scene references the array '{value}' but has no payload file")
+                self._data = np.load(self.path, allow_pickle=False)
+            return self._data[value[1:]].astype(dtype, copy=False)
+        return np.asarray(value, dtype=dtype)
+
+    def index(self, value, count: int):
+        # particle selection: all particles if missing, {"start", "stop"} or an index array
+        if value is None:
+            return slice(0, count)
+        if isinstance(value, dict):
+            return slice(value.get("start", 0), value.get("stop", count))
+        return self.array(value, np.intp)
+
+
+def read_description(path: str) -> dict:
+    # .toml or .json scene description
+    if path.endswith(".toml"):
+        import tomllib
+        with open(path, "rb") as file:
+            return tomllib.load(file)
+    with open(path) as file:
+        return json.load(file)
+
+
+def _build_constraints(description: dict, system: ParticleSystem, payload: _Payload, local) -> ConstraintManager:
+    # local maps the particle indices of the file to indices of the particle system
+    options = {name: description[name] for name in ("solver", "tolerance", "max_iterations", "baumgarte_alpha",
+                                                    "baumgarte_beta", "islands", "threads", "compliance")
+               if name in description}
+    manager = ConstraintManager((system, local(description.get("particles"))), system.dimensions, **options)
+
+    # the constraints are declared as index arrays, without one constraint object per constraint
+    distance = description.get("distance")
+    if distance is not None:
+        lengths = payload.array(distance["lengths"]) if "lengths" in distance else None
+        manager.add_distance_constraints(local(payload.array(distance["particles1"], np.intp)),
+                                         local(payload.array(distance["particles2"], np.intp)), lengths)
+
+    wire = description.get("circular_wire")
+    if wire is not None:
+        radii = payload.array(wire["radii"]) if "radii" in wire else None
+        manager.add_circular_wire_constraints(local(payload.array(wire["particles"], np.intp)), radii)
+
+    for rail in description.get("rail", ()):
+        manager.add_rail_constraints(local(payload.array(rail["particles"], np.intp)), rail["function"])
+
+    manager.update()
+    return manager
+
+
+def load_scene(path: str, system: ParticleSystem = None) -> tuple:
+    """
+    Loads a scene file. The particles are added to the system with one call, springs, forces and
+    constraints are created from index arrays, so no Particle objects are created.
+
+    Format (json or toml), every array can be written inline or as "@name" of an array in the
+    payload file (default: the scene file with the extension .npz):
+
+        dimensions: 2
+        timestep: 0.01
+        solver: {"name": "rk4", ...keyword arguments of the integrator}
+        payload: "scene.npz"
+        particles: {"positions": (N, D), "masses": (N,) or one value, "velocities": (N, D), "radii": (N,) or one value}
+        springs: {"particles1": (S,), "particles2": (S,), "lengths": (S,), "k": (S,), "damping": (S,)}
+        forces: [{"type": "gravity", "strength": 9.81, "dimension": 1, "particles": ...},
+                 {"type": "linear_friction", "strength": 0.1, "particles": ...}]
+        constraints: {"solver": "direct", ...options of the ConstraintManager, "particles": ...,
+                      "project": true (project the particles onto the constraints after every step),
+                      "distance": {"particles1", "particles2", "lengths" (optional)},
+                      "circular_wire": {"particles", "radii" (optional)},
+                      "rail": [{"function": "sin(x)", "particles": [...]}]}
+
+    "particles" of the forces and constraints is an index array, {"start": i, "stop": j} or missing for all
+    particles. Indices are local to the file, the particles of the file are the integrated particles.
+
+    :param system: ParticleSystem the particles are added to (default: a new system)
+    :return: (Scene, timestep, solver) where solver can be given to the Simulation runner
+    """
+    description = read_description(path)
+    payload_path = description.get("payload", os.path.splitext(os.path.basename(path))[0] + ".npz")
+    payload = _Payload(os.path.join(os.path.dirname(path), payload_path))
+
+    dimensions = description.get("dimensions", 2)
+    system = ParticleSystem(dimensions) if system is None else system
+    if system.dimensions != dimensions:
+        raise ValueError(f"the scene has {dimensions} dimensions, the particle system {system.dimensions}")
+
+    particles = description["particles"]
+    positions = payload.array(particles["positions"]).reshape(-1, dimensions)
+    offset = system.count
+    system.add(positions, payload.array(particles.get("masses", 1.0)),
+               payload.array(particles["velocities"]) if "velocities" in particles else None,
+               payload.array(particles.get("radii", 0.0)))
+    count = len(positions)
+
+    def local(value):
+        # indices of the file to indices of the particle system
+        index = payload.index(value, count)
+        if isinstance(index, slice):
+            return slice(index.start + offset, index.stop + offset)
+        return index + offset
+
+    registry = ForceRegistry(system)
+    for force in description.get("forces", ()):
+        options = {name: value for name, value in force.items() if name not in ("type", "particles")}
+        force_type = FORCES.get(force["type"])
+        if force_type is None:
+            raise ValueError(f"unknown force '{force['type']}', choose one of {list(FORCES)}")
+        if force_type is LinearFrictionForce:
+            options.setdefault("dimensions", dimensions)
+        registry.add(force_type((system, local(force.get("particles"))), **options))
+
+    springs = []
+    if "springs" in description:
+        spring = description["springs"]
+        springs.append(SpringNetwork(system, local(payload.array(spring["particles1"], np.intp)),
+                                     local(payload.array(spring["particles2"], np.intp)),
+                                     payload.array(spring["lengths"]), payload.array(spring["k"]),
+                                     payload.array(spring.get("damping", 0.0))))
+        registry.add(springs[-1])
+
+    manager = None
+    if "constraints" in description:
+        manager = _build_constraints(description["constraints"], system, payload, local)
+
+    def add_forces() -> None:
+        registry.add_forces()
+        if manager is not None:
+            manager.update()
+            manager.add_forces()
+
+    index = slice(offset, offset + count)
+
+    def energy() -> float:
+        kinetic = 0.5 * np.sum(system.masses[index] * np.sum(system.velocities[index] ** 2, axis=1))
+        return kinetic + registry.potential_energy() + sum(network.energy() for network in springs)
+
+    project = manager is not None and description.get("constraints", {}).get("project", False)
+    scene = Scene((system, index), add_forces, after_step=manager.project if project else None, energy=energy,
+                  constraints=manager, springs=springs)
+
+    solver = dict(description.get("solver", {}))
+    name = solver.pop("name", "rk4")
+    if name not in SOLVERS:
+        raise ValueError(f"unknown solver '{name}', choose one of {list(SOLVERS)}")
+    solver = functools.partial(SOLVERS[name], **solver) if solver else SOLVERS[name]
+    return scene, description.get("timestep", 0.01), solver
+
+
+def load_simulation(path: str, **kwargs) -> Simulation:
+    # Simulation of a scene file with the timestep and solver of the file, kwargs go to the Simulation
+    scene, timestep, solver = load_scene(path)
+    return Simulation(scene, timestep, solver=solver, **kwargs)
+
+
+def save_scene(path: str, description: dict, inline_limit: int = INLINE_LIMIT) -> None:
+    """
+    Writes a scene description (e.g. generated by a script) as json. Values can be numpy arrays,
+    arrays with more than inline_limit elements are written into the .npz payload next to the file.
+    """
+    arrays = {}
+
+    def convert(value, name: str):
+        if isinstance(value, dict):
+            return {key: convert(item, f"{name}.{key}" if name else key) for key, item in value.items()}
+        if isinstance(value, (list, tuple)) and any(isinstance(item, dict) for item in value):
+            return [convert(item, f"{name}.{number}") for number, item in enumerate(value)]
+        if isinstance(value, (np.ndarray, list, tuple)):
+            value = np.asarray(value)
+            if value.size > inline_limit:
+                arrays[name] = value
+                return "@" + name
+            return value.tolist()
+        return value.item() if isinstance(value, np.generic) else value
+
+    description = convert(description, "")
+    if arrays:
+        payload = os.path.splitext(path)[0] + ".npz"
+        description["payload"] = os.path.basename(payload)
+        np.savez(payload, **arrays)
+    with open(path, "w") as file:
+        json.dump(description, file, indent=2)
@@ -1,18 +1,193 @@
-# https://www.youtube.com/watch?v=K1Ne_pGy2e8
-import cv2, numpy, pyautogui, keyboard
-
-filename = "record"
-screen_size = (1920, 1080)
-codec = cv2.VideoWriter_fourcc(*'mp4v')
-vid = cv2.VideoWriter(filename + ".mp4", codec, 60.0, (screen_size))
-
-while True:
-    if keyboard.is_pressed('x'):
-        break
-    img = pyautogui.screenshot()
-    frame = numpy.array(img)
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    vid.write(frame)
-
-cv2.destroyAllWindows()
-vid.release()
\ No newline at end of file
+import os, queue, shutil, subprocess, sys, threading
+import numpy as np
+import pygame
+
+# byte order of the pixels for ffmpeg, by the shift of the channels on a little endian machine
+_CHANNELS = "rgba"
+
+
+def pixel_format(surface: pygame.Surface) -> str:
+    """
+    ffmpeg pixel format of the raw buffer of a 32 bit surface, e.g. "bgr0" for pygame's default masks.
+    """
+    if surface.get_bytesize() != 4:
+        raise ValueError("only 32 bit surfaces can be encoded without conversion")
+    channels = ["0"] * 4
+    for name, mask, shift in zip(_CHANNELS, surface.get_masks(), surface.get_shifts()):
+        if mask:
+            channels[shift // 8] = name
+    if sys.byteorder == "big":
+        channels.reverse()
+    return "".join(channels)
+
+
+def frame_bytes(surface: pygame.Surface) -> np.ndarray:
+    """
+    Copy of the pixels of a surface as one contiguous (height, width * 4) byte array, the rows
+    are taken directly from the buffer of the surface without any color conversion.
+    """
+    width, height = surface.get_size()
+    pixels = np.frombuffer(surface.get_view("0"), dtype=np.uint8).reshape(height, surface.get_pitch())
+    return pixels[:, :4 * width].copy()
+
+
+class FFmpegEncoder:
+    """
+    Encodes raw frames with an ffmpeg process. The frames are written into the pipe of the process by a
+    background thread, the encoding itself runs in parallel in the ffmpeg process. GIFs get a palette
+    generated from all frames.
+
+    :param path: output file, the container and codec are chosen by ffmpeg from the extension
+    :param size: (width, height) of the frames
+    :param fps: frame rate of the video
+    :param pixel_format: ffmpeg pixel format of the raw frames (see pixel_format())
+    :param ffmpeg: path of the ffmpeg executable
+    :param max_pending: number of frames that can wait for the pipe
+    """
+
+    def __init__(self, path: str, size: tuple, fps: float, pixel_format: str = "bgr0", ffmpeg: str = "ffmpeg",
+                 max_pending: int = 16):
+        executable = shutil.which(ffmpeg)
+        if executable is None:
+            raise RuntimeError(f"{ffmpeg} was not found, install ffmpeg or use ImageSequenceEncoder")
+
+        command = [executable, "-loglevel", "error", "-y",
+                   "-f", "rawvideo", "-pix_fmt", pixel_format, "-s", f"{size[0]}x{size[1]}", "-r", str(fps),
+                   "-i", "-"]
+        if path.endswith(".gif"):
+            command += ["-filter_complex", "split[a][b];[a]palettegen[p];[b][p]paletteuse"]
+        else:
+            command += ["-pix_fmt", "yuv420p"]
+        self.process = subprocess.Popen(command + [path], stdin=subprocess.PIPE)
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._write_frames, daemon=True)
+        self._thread.start()
+
+    def _write_frames(self) -> None:
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+            if self._error is None:
+                try:
+                    self.process.stdin.write(frame.data)
+                except Exception as error:
+                    self._error = error
+
+    def write(self, frame: np.ndarray) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put(frame)
+
+    def close(self) -> None:
+        if self.process.stdin.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed with the exit code {self.process.returncode}")
+        if self._error is not None:
+            raise self._error
+
+
+class ImageSequenceEncoder:
+    """
+    Saves every frame as an image (e.g. "frames/%05d.png"), for systems without ffmpeg.
+    The images are saved by a background thread.
+
+    :param path: file name pattern with the frame number, the directory is created
+    :param size: (width, height) of the frames
+    :param pixel_format: pixel format of the raw frames (see pixel_format())
+    """
+
+    def __init__(self, path: str, size: tuple, fps: float = None, pixel_format: str = "bgr0", max_pending: int = 16):
+        self.path = path
+        self.size = size
+        # byte of the red, green and blue channel of every pixel
+        self.channels = [pixel_format.index(name) for name in "rgb"]
+        self.count = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._save_frames, daemon=True)
+        self._thread.start()
+
+    def _save_frames(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            # after an error the queue is still drained, so write() and close() don't block
+            if self._error is None:
+                number, frame = item
+                width, height = self.size
+                try:
+                    rgb = np.ascontiguousarray(frame.reshape(height, width, 4)[:, :, self.channels])
+                    image = pygame.image.frombuffer(rgb.data, self.size, "RGB")
+                    pygame.image.save(image, self.path % number)
+                except Exception as error:
+                    self._error = error
+
+    def write(self, frame: np.ndarray) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put((self.count, frame))
+        self.count += 1
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+class FrameRecorder:
+    """
+    Renders a simulation into an offscreen surface at a fixed simulation time cadence and hands the
+    frames to an encoder. Used as the renderer of the Simulation runner, every call renders the
+    frames that are due up to the current simulation time, so the video is independent of the speed
+    of the simulation and runs without a display. Call the recorder once before the first step to
+    include the initial state.
+
+    :param path: output file, "%" in the path saves single images, otherwise ffmpeg encodes a video (e.g. .gif, .mp4)
+    :param draw: function (surface, simulation) that draws the scene
+    :param size: (width, height) of the frames
+    :param fps: frame rate of the video in frames per second of simulation time
+    :param background: color the surface is filled with before every frame
+    """
+
+    def __init__(self, path: str, draw, size: tuple = (800, 800), fps: float = 30, background=(0, 0, 0)):
+        self.draw = draw
+        self.fps = fps
+        self.background = background
+        self.surface = pygame.Surface(size, 0, 32)
+        self.frames = 0
+
+        encoder = ImageSequenceEncoder if "%" in path else FFmpegEncoder
+        self.encoder = encoder(path, size, fps, pixel_format=pixel_format(self.surface))
+
+    def __call__(self, simulation) -> None:
+        # the frame n shows the first state at or after the time n / fps
+        while self.frames / self.fps <= simulation.time + 1e-9 * simulation.timestep:
+            self.render(simulation)
+
+    def render(self, simulation) -> None:
+        self.surface.fill(self.background)
+        self.draw(self.surface, simulation)
+        self.encoder.write(frame_bytes(self.surface))
+        self.frames += 1
+
+    def close(self) -> None:
+        self.encoder.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception) -> bool:
+        self.close()
+        return False
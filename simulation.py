@@ -0,0 +1,154 @@
+import numpy as np
+from objects import particle_indices
+from profiler import NULL_PROFILER
+from ode_solvers.rk4 import RungeKutta4
+
+
+class Scene:
+    """
+    Definition of a scene for the Simulation runner.
+
+    :param particles: list of particles (or a ParticleSystem) that are integrated
+    :param add_forces: function that adds all forces for the current state
+    :param after_step: optional function called after every step, e.g. ConstraintManager.project
+    :param energy: optional function returning the total energy of the scene
+    :param constraints: optional ConstraintManager, handed to integrators that keep the particles on
+                        the constraints themselves (e.g. the symplectic integrators)
+    :param springs: optional list of SpringNetworks, handed to integrators that need the stiffness
+                    of the springs (e.g. ImplicitEuler)
+    :param collisions: optional Collisions, resolved after every step before after_step
+                       (for penalty forces call Collisions.add_forces in add_forces instead)
+    """
+
+    def __init__(self, particles, add_forces, after_step=None, energy=None, constraints=None, springs=(),
+                 collisions=None):
+        self.particles = particles
+        self.add_forces = add_forces
+        self.after_step = after_step
+        self.energy = energy
+        self.constraints = constraints
+        self.springs = list(springs)
+        self.collisions = collisions
+
+
+class Simulation:
+    """
+    Headless simulation runner. Steps run as fast as possible without any display,
+    an optional renderer is only called every render_every steps.
+
+    :param scene: Scene to simulate
+    :param timestep: timestep of the solver
+    :param solver: integrator class, constructed with (particles, timestep) and providing step(add_forces)
+    :param renderer: optional function called with the simulation
+    :param render_every: number of physics steps per rendered frame
+    :param profiler: optional Profiler, times the phases "integrate", "forces", "collisions", "after_step" and "draw"
+                     of every step
+    """
+
+    def __init__(self, scene: Scene, timestep: float, solver=RungeKutta4, renderer=None, render_every: int = 1,
+                 profiler=None):
+        self.scene = scene
+        self.timestep = timestep
+        self.solver = solver(scene.particles, timestep)
+        if scene.constraints is not None and hasattr(self.solver, "constraints"):
+            self.solver.constraints = scene.constraints
+        if scene.springs and hasattr(self.solver, "springs"):
+            self.solver.springs = scene.springs
+        self.system, self.index = particle_indices(scene.particles)
+        self.renderer = renderer
+        self.render_every = render_every
+        self.tickcounter = 0
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+        self._add_forces = self.profiler.timed("forces", scene.add_forces)
+
+    @property
+    def time(self) -> float:
+        return self.tickcounter * self.timestep
+
+    def step(self) -> None:
+        profiler = self.profiler
+        with profiler.phase("integrate"):
+            self.solver.step(self._add_forces)
+        if self.scene.collisions is not None:
+            with profiler.phase("collisions"):
+                self.scene.collisions.resolve()
+        if self.scene.after_step is not None:
+            with profiler.phase("after_step"):
+                self.scene.after_step()
+        self.tickcounter += 1
+
+        if self.renderer is not None and self.tickcounter % self.render_every == 0:
+            with profiler.phase("draw"):
+                self.renderer(self)
+        profiler.end_step()
+
+    def close(self) -> None:
+        # releases the threads of the scene (ConstraintManager), the simulation can still be stepped afterwards
+        if self.scene.constraints is not None:
+            self.scene.constraints.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception) -> bool:
+        self.close()
+        return False
+
+    def stream(self, steps: int, record_every: int = 1):
+        """
+        Runs the simulation and yields (tick, time, positions, velocities) every record_every steps.
+        The yielded arrays are copies of the state of the integrated particles.
+        """
+        try:
+            for _ in range(steps):
+                self.step()
+                if self.tickcounter % record_every == 0:
+                    yield (self.tickcounter, self.time,
+                           self.system.positions[self.index].copy(), self.system.velocities[self.index].copy())
+        finally:
+            self.close()
+
+    def run(self, steps: int, record_every: int = 1) -> dict:
+        """
+        Runs the simulation for a number of steps and returns the trajectories.
+
+        :return: dict with the arrays "time" (T,), "positions" (T, N, D), "velocities" (T, N, D)
+                 and "energy" (T,) if the scene defines an energy function
+        """
+        samples = steps // record_every
+        n, dimensions = self.system.positions[self.index].shape
+        trajectories = {
+            "time": np.zeros(samples, dtype=np.float64),
+            "positions": np.zeros((samples, n, dimensions), dtype=np.float64),
+            "velocities": np.zeros((samples, n, dimensions), dtype=np.float64),
+        }
+        if self.scene.energy is not None:
+            trajectories["energy"] = np.zeros(samples, dtype=np.float64)
+
+        sample = 0
+        for _ in range(steps):
+            self.step()
+            if self.tickcounter % record_every == 0 and sample < samples:
+                trajectories["time"][sample] = self.time
+                trajectories["positions"][sample] = self.system.positions[self.index]
+                trajectories["velocities"][sample] = self.system.velocities[self.index]
+                if self.scene.energy is not None:
+                    trajectories["energy"][sample] = self.scene.energy()
+                sample += 1
+
+        self.close()
+        return {name: values[:sample] for name, values in trajectories.items()}
+
+    def record(self, writer, steps: int, record_every: int = 1) -> None:
+        """
+        Runs the simulation and streams the state every record_every steps into a TrajectoryWriter,
+        so long runs don't have to fit into the memory like with run().
+        """
+        energy = self.scene.energy is not None and writer.header["energy"]
+        for _ in range(steps):
+            self.step()
+            if self.tickcounter % record_every == 0:
+                writer.append(self.time, self.system.positions[self.index], self.system.velocities[self.index],
+                              self.scene.energy() if energy else np.nan)
+        writer.flush()
+        self.close()
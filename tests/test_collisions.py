@@ -0,0 +1,51 @@
+# import from directory above
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from objects import ParticleSystem
+from collisions import SpatialHash, Collisions
+from simulation import Scene, Simulation
+
+
+def _close_pairs(positions: np.ndarray, distance: float) -> set:
+    # all pairs closer than distance by comparing every pair
+    d = np.linalg.norm(positions[:, np.newaxis] - positions[np.newaxis], axis=-1)
+    i, j = np.nonzero(np.triu(d < distance, 1))
+    return set(zip(i.tolist(), j.tolist()))
+
+
+def test_pairs_with_outliers():
+    # the grid must not depend on the extent of the points, far away points don't change the pairs
+    rng = np.random.default_rng(0)
+    for dimensions in (2, 3):
+        positions = rng.uniform(-5, 5, (500, dimensions))
+        positions[0] = 1e7
+        positions[1] = -3e12
+
+        grid = SpatialHash(0.5)
+        grid.build(positions)
+        i, j = grid.pairs()
+        pairs = [tuple(sorted(pair)) for pair in zip(i.tolist(), j.tolist())]
+        close = {pair for pair, distance in zip(pairs, np.linalg.norm(positions[i] - positions[j], axis=1))
+                 if distance < 0.5}
+
+        assert len(pairs) == len(set(pairs))
+        assert close == _close_pairs(positions, 0.5)
+        assert grid.nearest(positions[0] + 0.1) == 0
+        assert grid.within(positions[1], 1.0).tolist() == [1]
+
+
+def test_step_with_escaped_particle():
+    system = ParticleSystem(3)
+    positions = np.random.default_rng(1).uniform(0, 5, (200, 3))
+    positions[0] = 1e7
+    system.add(positions, np.ones(200), None, np.full(200, 0.2))
+
+    collisions = Collisions(system)
+    simulation = Simulation(Scene(system, lambda: None, collisions=collisions), 0.01)
+    for _ in range(5):
+        simulation.step()
+    assert np.all(np.isfinite(system.positions))
+    assert np.array_equal(system.positions[0], [1e7, 1e7, 1e7])
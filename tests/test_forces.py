@@ -0,0 +1,48 @@
+# import from directory above
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from objects import ParticleSystem, SpringNetwork
+from forces import Gravity, ForceRegistry
+from simulation import Scene, Simulation
+from ode_solvers.euler import SemiImplicitEuler
+from ode_solvers.rk4 import RungeKutta4
+
+
+def _hanging_spring() -> tuple:
+    # a pinned particle (infinite mass) with a particle hanging on a spring below it
+    system = ParticleSystem(2)
+    system.add([[0.0, 0.0], [0.0, -1.0]], [1.0, 1.0])
+    system.set_masses(0, np.inf)
+    springs = SpringNetwork(system, [0], [1], 1.0, 50.0)
+    return system, springs
+
+
+def test_gravity_on_pinned_particle():
+    for solver in (SemiImplicitEuler, RungeKutta4):
+        system, springs = _hanging_spring()
+        gravity = Gravity(system, 9.81, 1)
+
+        def add_forces():
+            gravity.add_forces()
+            springs.add_forces()
+
+        simulation = Simulation(Scene(system, add_forces, energy=gravity.potential_energy), 0.01, solver=solver)
+        simulation.run(100)
+        assert np.all(np.isfinite(system.positions)) and np.all(np.isfinite(system.velocities))
+        assert np.array_equal(system.positions[0], [0.0, 0.0])
+        assert system.positions[1, 1] < -1.0
+        assert np.isfinite(gravity.potential_energy())
+
+
+def test_fused_gravity_on_pinned_particle():
+    system, springs = _hanging_spring()
+    registry = ForceRegistry(system)
+    registry.add(Gravity(system, 9.81, 1))
+    registry.add(springs)
+
+    Simulation(Scene(system, registry.add_forces), 0.01, solver=SemiImplicitEuler).run(100)
+    assert np.all(np.isfinite(system.positions))
+    assert np.array_equal(system.positions[0], [0.0, 0.0])
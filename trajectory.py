@@ -0,0 +1,235 @@
+import json, os, queue, struct, threading
+import numpy as np
+
+# file layout: MAGIC, length of the json header (uint64), json header padded to HEADER_ALIGNMENT,
+# then one fixed size record per sample (time, positions, velocities and optionally energy)
+MAGIC = b"PHYSTRAJ"
+VERSION = 1
+HEADER_ALIGNMENT = 64
+
+
+def record_dtype(particle_count: int, dimensions: int, energy: bool = True, dtype=np.float64) -> np.dtype:
+    """
+    Structured dtype of one sample of a trajectory file.
+
+    :param dtype: float type of the positions and velocities (time and energy are always float64)
+    """
+    fields = [
+        ("time", np.float64),
+        ("positions", dtype, (particle_count, dimensions)),
+        ("velocities", dtype, (particle_count, dimensions)),
+    ]
+    if energy:
+        fields.append(("energy", np.float64))
+    return np.dtype(fields)
+
+
+class TrajectoryWriter:
+    """
+    Streams the state of a simulation into a binary trajectory file.
+
+    The samples are collected in a buffer of chunk_size records. Full chunks are written by a
+    background thread, so the step loop only copies the state into the buffer. At most
+    max_pending chunks wait for the thread, a faster simulation then waits for the disk instead
+    of filling the memory. The file is valid after every written chunk, an interrupted run can
+    be read up to the last flushed sample.
+
+    :param path: path of the trajectory file (overwritten)
+    :param particle_count: number of recorded particles
+    :param dimensions: number of dimensions of the particles
+    :param energy: store the energy of every sample
+    :param dtype: float type of the positions and velocities, e.g. np.float32 for half the size
+    :param metadata: dict with a json serializable description of the scene, stored in the header
+    :param chunk_size: number of samples per written chunk
+    :param max_pending: number of full chunks that can wait for the background thread
+    """
+
+    def __init__(self, path: str, particle_count: int, dimensions: int, energy: bool = True, dtype=np.float64,
+                 metadata: dict = None, chunk_size: int = 1024, max_pending: int = 4):
+        self.path = path
+        self.dtype = record_dtype(particle_count, dimensions, energy, dtype)
+        self.header = {
+            "version": VERSION,
+            "particle_count": particle_count,
+            "dimensions": dimensions,
+            "energy": energy,
+            "dtype": np.dtype(dtype).str,
+            "metadata": metadata or {},
+        }
+        self.count = 0
+
+        self._buffer = np.zeros(chunk_size, dtype=self.dtype)
+        self._filled = 0
+        self._file = open(path, "wb")
+        self._write_header()
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._flush_chunks, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def for_simulation(cls, simulation, path: str, record_every: int = 1, metadata: dict = None, **kwargs):
+        """
+        Writer for the particles of a Simulation, the header describes the scene (timestep, masses, radii).
+        """
+        system, index = simulation.system, simulation.index
+        particle_count, dimensions = system.positions[index].shape
+        scene = {
+            "timestep": float(simulation.timestep),
+            "record_every": record_every,
+            "masses": system.masses[index].tolist(),
+            "radii": system.radii[index].tolist(),
+        }
+        scene.update(metadata or {})
+        kwargs.setdefault("energy", simulation.scene.energy is not None)
+        return cls(path, particle_count, dimensions, metadata=scene, **kwargs)
+
+    def _write_header(self) -> None:
+        header = json.dumps(self.header).encode()
+        length = -(-(len(MAGIC) + 8 + len(header)) // HEADER_ALIGNMENT) * HEADER_ALIGNMENT - len(MAGIC) - 8
+        self._file.write(MAGIC + struct.pack("<Q", length) + header.ljust(length))
+
+    def _flush_chunks(self) -> None:
+        # background thread, writes the chunks in the order they were queued
+        while True:
+            chunk = self._queue.get()
+            try:
+                if chunk is None:
+                    return
+                if self._error is None:
+                    self._file.write(chunk.tobytes())
+                    self._file.flush()
+            except Exception as error:
+                # the thread keeps draining the queue, the error is raised by the next append or flush
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def append(self, time: float, positions: np.ndarray, velocities: np.ndarray, energy: float = np.nan) -> None:
+        self._check()
+        record = self._buffer[self._filled]
+        record["time"] = time
+        record["positions"] = positions
+        record["velocities"] = velocities
+        if self.header["energy"]:
+            record["energy"] = energy
+        self._filled += 1
+        self.count += 1
+        if self._filled == len(self._buffer):
+            self.flush(wait=False)
+
+    def flush(self, wait: bool = True) -> None:
+        """
+        Hands the buffered samples to the background thread.
+
+        :param wait: wait until all samples are written to the file
+        """
+        if self._filled:
+            self._queue.put(self._buffer[:self._filled].copy())
+            self._filled = 0
+        if wait:
+            self._queue.join()
+        self._check()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception) -> bool:
+        self.close()
+        return False
+
+
+class TrajectoryReader:
+    """
+    Reads a trajectory file through a memory map, only the sliced samples are loaded from the disk.
+
+    The fields are (samples, ...) arrays, e.g. reader.positions[1000:2000, 5] are the positions of
+    particle 5 in the samples 1000 to 2000 and reader.time[:] are the times of all samples.
+
+    :param path: path of the trajectory file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a trajectory file")
+            length, = struct.unpack("<Q", file.read(8))
+            self.header = json.loads(file.read(length))
+
+        if self.header["version"] > VERSION:
+            raise ValueError(f"{path} has the unsupported version {self.header['version']}")
+        self.dtype = record_dtype(self.header["particle_count"], self.header["dimensions"], self.header["energy"],
+                                  np.dtype(self.header["dtype"]))
+
+        # samples of a run that is still written (or was interrupted) are read up to the last complete one
+        offset = len(MAGIC) + 8 + length
+        samples = (os.path.getsize(path) - offset) // self.dtype.itemsize
+        self.records = np.memmap(path, dtype=self.dtype, mode="r", offset=offset, shape=(samples,))
+
+    @property
+    def metadata(self) -> dict:
+        return self.header["metadata"]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.records["time"]
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self.records["positions"]
+
+    @property
+    def velocities(self) -> np.ndarray:
+        return self.records["velocities"]
+
+    @property
+    def energy(self) -> np.ndarray:
+        if not self.header["energy"]:
+            raise KeyError("the trajectory has no energy")
+        return self.records["energy"]
+
+    def between(self, start_time: float, end_time: float) -> slice:
+        """
+        :return: slice of the samples with start_time <= time < end_time
+        """
+        time = self.time
+        return slice(int(np.searchsorted(time, start_time, side="left")),
+                     int(np.searchsorted(time, end_time, side="left")))
+
+    def read(self, samples=slice(None), particles=slice(None)) -> dict:
+        """
+        Loads a range of samples of some particles into memory.
+
+        :param samples: slice or index array of the samples
+        :param particles: slice or index array of the particles
+        :return: dict with the arrays "time" (T,), "positions" (T, N, D), "velocities" (T, N, D)
+                 and "energy" (T,) if the trajectory has the energy, like Simulation.run
+        """
+        records = self.records[samples]
+        trajectories = {
+            "time": np.array(records["time"]),
+            "positions": np.array(records["positions"][:, particles]),
+            "velocities": np.array(records["velocities"][:, particles]),
+        }
+        if self.header["energy"]:
+            trajectories["energy"] = np.array(records["energy"])
+        return trajectories